@@ -22,6 +22,16 @@ os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"  #để đăng nhập đc trên
 # Database config
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool kết nối: recycle < wait_timeout của MySQL, pre-ping để bỏ connection đã bị server đóng
+from app.db_pool import engine_options
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 20)),
+    pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 30)),
+    pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    pool_pre_ping=os.getenv('DB_POOL_PRE_PING', 'True') == 'True'
+)
 
 # Mail config
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
@@ -58,11 +68,77 @@ app.config['MODEL_EMBEDDING_NAME'] = os.getenv('MODEL_EMBEDDING_NAME')
 app.config['MODEL_CROSS_ENCODER_NAME'] = os.getenv('MODEL_CROSS_ENCODER_NAME')
 app.config['COLLECTION_NAME'] = os.getenv('COLLECTION_NAME')
 app.config['QDRANT_URL'] = os.getenv('QDRANT_URL')
+# background: load RAG/CNN ở thread nền ngay khi start, lazy: load khi có request đầu tiên cần
+app.config['MODEL_PRELOAD'] = os.getenv('MODEL_PRELOAD', 'background')
+# inprocess: mỗi worker tự load model, server: dùng chung model server (python -m app.model_server)
+app.config['MODEL_SERVING_MODE'] = os.getenv('MODEL_SERVING_MODE', 'inprocess')
+app.config['MODEL_SERVER_ADDRESS'] = os.getenv('MODEL_SERVER_ADDRESS', '/tmp/skinbox-model-server.sock')  # hoặc host:port
+# Bắt buộc đặt riêng khi dùng model server (chuỗi ngẫu nhiên dài, giống nhau ở server và web worker),
+# không có giá trị mặc định: thiếu thì model server và client từ chối chạy
+app.config['MODEL_SERVER_AUTHKEY'] = os.getenv('MODEL_SERVER_AUTHKEY', '').encode() or None
+app.config['MODEL_SERVER_MAX_INFLIGHT'] = int(os.getenv('MODEL_SERVER_MAX_INFLIGHT', 32))  # quá thì trả busy
+app.config['MODEL_SERVER_POOL_SIZE'] = int(os.getenv('MODEL_SERVER_POOL_SIZE', 8))  # connection mỗi web worker
+app.config['MODEL_SERVER_TIMEOUT'] = int(os.getenv('MODEL_SERVER_TIMEOUT', 120))
+app.config['MODEL_SERVER_STARTUP_TIMEOUT'] = int(os.getenv('MODEL_SERVER_STARTUP_TIMEOUT', 600))
+app.config['CV_BACKEND'] = os.getenv('CV_BACKEND', 'keras')  # keras | tflite | onnx
+app.config['CV_FAST_PREPROCESS'] = os.getenv('CV_FAST_PREPROCESS', 'True') == 'True'  # JPEG draft decode
+# Micro-batching cho CNN: gom request trong CV_BATCH_WAIT_MS hoặc đủ CV_BATCH_MAX_SIZE ảnh
+app.config['CV_BATCHING_ENABLED'] = os.getenv('CV_BATCHING_ENABLED', 'True') == 'True'
+app.config['CV_BATCH_MAX_SIZE'] = int(os.getenv('CV_BATCH_MAX_SIZE', 16))
+app.config['CV_BATCH_WAIT_MS'] = int(os.getenv('CV_BATCH_WAIT_MS', 10))
+# Retrieve rộng rồi rerank bằng cross-encoder, chỉ giữ top-N trong ngân sách token
+app.config['RAG_RERANK_ENABLED'] = os.getenv('RAG_RERANK_ENABLED', 'True') == 'True'
+app.config['RAG_CANDIDATE_K'] = int(os.getenv('RAG_CANDIDATE_K', 40))
+app.config['RAG_RERANK_TOP_N'] = int(os.getenv('RAG_RERANK_TOP_N', 6))
+app.config['RAG_CONTEXT_TOKEN_BUDGET'] = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', 1500))
+# Lịch sử gửi cho LLM: N tin nhắn gần nhất trong ngân sách token + tóm tắt cuốn chiếu phần cũ
+app.config['RAG_HISTORY_MAX_MESSAGES'] = int(os.getenv('RAG_HISTORY_MAX_MESSAGES', 12))
+app.config['RAG_HISTORY_TOKEN_BUDGET'] = int(os.getenv('RAG_HISTORY_TOKEN_BUDGET', 1200))
+app.config['RAG_HISTORY_SUMMARY_ENABLED'] = os.getenv('RAG_HISTORY_SUMMARY_ENABLED', 'True') == 'True'
+app.config['RAG_HISTORY_SUMMARY_BATCH'] = int(os.getenv('RAG_HISTORY_SUMMARY_BATCH', 6))
+# Cache embedding câu hỏi (LRU + SQLite tùy chọn) và gom batch embed_query đồng thời
+app.config['EMBEDDING_CACHE_SIZE'] = int(os.getenv('EMBEDDING_CACHE_SIZE', 4096))
+app.config['EMBEDDING_CACHE_PATH'] = os.getenv('EMBEDDING_CACHE_PATH')
+app.config['EMBEDDING_BATCH_MAX_SIZE'] = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', 32))
+app.config['EMBEDDING_BATCH_WAIT_MS'] = int(os.getenv('EMBEDDING_BATCH_WAIT_MS', 5))
+# Semantic cache câu trả lời (câu hỏi gần giống nhau, lịch sử ngắn)
+app.config['RAG_CACHE_ENABLED'] = os.getenv('RAG_CACHE_ENABLED', 'True') == 'True'
+app.config['RAG_CACHE_BACKEND'] = os.getenv('RAG_CACHE_BACKEND')  # dotted path tới class CacheBackend, mặc định in-memory
+app.config['RAG_CACHE_THRESHOLD'] = float(os.getenv('RAG_CACHE_THRESHOLD', 0.95))
+app.config['RAG_CACHE_TTL'] = int(os.getenv('RAG_CACHE_TTL', 6 * 3600))
+app.config['RAG_CACHE_MAX_ENTRIES'] = int(os.getenv('RAG_CACHE_MAX_ENTRIES', 1000))
+app.config['RAG_CACHE_VERSION_CHECK_SECONDS'] = int(os.getenv('RAG_CACHE_VERSION_CHECK_SECONDS', 60))
 
 
 
 # App settings
 PAGE_SIZE = 8
+# Cache user đã đăng nhập trong process (giây / số user), xóa khi user tự sửa hồ sơ / mật khẩu
+app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 60))
+app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 10000))
+# Số item mỗi trang mặc định của API chat (phân trang theo cursor)
+app.config['CHAT_CONVERSATIONS_PAGE_SIZE'] = int(os.getenv('CHAT_CONVERSATIONS_PAGE_SIZE', 30))
+app.config['CHAT_MESSAGES_PAGE_SIZE'] = int(os.getenv('CHAT_MESSAGES_PAGE_SIZE', 50))
+app.config['CHAT_PIPELINE_WORKERS'] = int(os.getenv('CHAT_PIPELINE_WORKERS', 8))
+# Kích thước ảnh chat tối đa (byte), lớn hơn thì trả 413 trước khi đọc hết body
+app.config['CHAT_IMAGE_MAX_BYTES'] = int(os.getenv('CHAT_IMAGE_MAX_BYTES', 5 * 1024 * 1024))
+# Job nền (phân tích ảnh chat): 'sqlite' dùng chung giữa các worker trên 1 máy (mặc định),
+# 'inprocess' chỉ dùng khi chạy 1 process (flask run, test) vì job không thấy được ở worker khác
+app.config['JOB_BACKEND'] = os.getenv('JOB_BACKEND', 'sqlite')
+# Để trong thư mục instance của app (quyền 700), không để ở /tmp mà user khác ghi được
+app.config['JOB_SQLITE_PATH'] = os.getenv('JOB_SQLITE_PATH', os.path.join(app.instance_path, 'jobs.sqlite'))
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 4))
+app.config['JOB_RESULT_TTL'] = int(os.getenv('JOB_RESULT_TTL', 3600))
+# Job sqlite đang chạy mà không được gia hạn quá số giây này (process chết) thì được chạy lại
+app.config['JOB_LEASE_TIMEOUT'] = int(os.getenv('JOB_LEASE_TIMEOUT', 60))
+# Số giây send-message chờ job phân tích ảnh (analysis_job_id) trước khi trả lời không có kết quả ảnh
+app.config['CHAT_ANALYSIS_WAIT_TIMEOUT'] = int(os.getenv('CHAT_ANALYSIS_WAIT_TIMEOUT', 30))
+# Hash mật khẩu (werkzeug): "scrypt:32768:8:1", "pbkdf2:sha256:600000"... đổi cost thì hash
+# cũ tự được hash lại khi user đăng nhập. Chạy trên pool riêng, quá QUEUE request chờ thì báo bận
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 4))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.getenv('PASSWORD_HASH_QUEUE', 64))
+app.config['PASSWORD_HASH_TIMEOUT'] = int(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
 # Khởi tạo các extension
 db.init_app(app)
 mail.init_app(app)
@@ -70,6 +146,29 @@ migrate.init_app(app, db)
 login.init_app(app)
 
 
-#import RAG CV cho rag
-from app.rag_chatbot import rag_chatbot
-from app.cv_model import cv_model
\ No newline at end of file
+# RAG và CNN load ở thread nền (hoặc lần đầu dùng), không chặn lúc import app
+from app.model_registry import model_registry
+
+
+def _load_rag_chatbot():
+    from app.rag_chatbot import RAGSystem
+    return RAGSystem()
+
+
+def _load_cv_model():
+    from app.cv_model import SkinDiseaseModel
+    return SkinDiseaseModel()
+
+
+def register_models(serving_mode):
+    if serving_mode == 'server':
+        # Model nằm ở process model server, worker chỉ giữ client
+        from app.model_server import connect_rag_chatbot, connect_cv_model
+        model_registry.register('rag_chatbot', connect_rag_chatbot)
+        model_registry.register('cv_model', connect_cv_model)
+    else:
+        model_registry.register('rag_chatbot', _load_rag_chatbot)
+        model_registry.register('cv_model', _load_cv_model)
+
+
+register_models(app.config['MODEL_SERVING_MODE'])
\ No newline at end of file
@@ -1,29 +1,35 @@
-from flask import render_template, request, redirect, url_for, flash
+from flask import render_template, request, redirect, url_for, flash, abort
 from flask_login import current_user, login_required
 from app.dao import dao_post
+from app.dao.pagination import clamp_limit
 import cloudinary.uploader
-from app.models import Post
 from flask import current_app
 
 # Danh sách bài viết
 @login_required
 def post_list():
-    page = request.args.get("page", 1, type=int)
-    per_page = 5  # số bài trên 1 trang
-    posts = Post.query.order_by(Post.created_at.desc()).paginate(page=page, per_page=per_page)
-    return render_template("post_list.html", posts=posts)
+    per_page = clamp_limit(request.args.get("limit", type=int), 5)  # số bài trên 1 trang
+    try:
+        posts, next_cursor = dao_post.get_all_posts(per_page, request.args.get("cursor"))
+    except ValueError:
+        abort(400)
+    return render_template("post_list.html", posts=posts, next_cursor=next_cursor)
 
 # Chi tiết bài viết
 @login_required
 def post_detail(post_id):
     post = dao_post.get_post_by_id(post_id)
-    comments = dao_post.get_comments_by_post(post_id)
+    try:
+        comments, next_cursor = dao_post.get_comments_by_post(post_id, cursor=request.args.get("cursor"))
+    except ValueError:
+        abort(400)
     like_count = dao_post.count_likes(post_id)
     user_liked = dao_post.user_liked_post(post_id, current_user.user_id)
     return render_template(
         "post_detail.html",
         post=post,
         comments=comments,
+        next_cursor=next_cursor,
         like_count=like_count,
         user_liked=user_liked
     )
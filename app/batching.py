@@ -0,0 +1,67 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class MicroBatcher:
+    """
+    Gom các request đến từ nhiều thread trong khoảng max_wait_ms (hoặc đủ max_batch_size)
+    rồi gọi process_batch(items) 1 lần. process_batch phải trả về list kết quả cùng thứ tự,
+    trả thiếu / thừa thì mọi request trong batch đều nhận lỗi thay vì chờ mãi.
+    submit chờ tối đa timeout giây (mặc định của batcher), quá thì raise concurrent.futures.TimeoutError.
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=5, name="micro-batcher", timeout=30):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit_async(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit(self, item, timeout=None):
+        future = self.submit_async(item)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            # Chưa vào batch thì bỏ luôn, khỏi tính toán cho request không còn ai chờ
+            future.cancel()
+            raise
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(item, future) for item, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+            try:
+                results = list(self.process_batch(items))
+                if len(results) != len(items):
+                    raise RuntimeError(f"process_batch trả về {len(results)} kết quả cho {len(items)} item")
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
@@ -1,16 +1,23 @@
 import uuid
+import json
+import time
 import datetime
 import base64
-from flask import render_template, redirect, request, url_for, session, flash, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from flask import render_template, redirect, request, url_for, session, flash, jsonify, Response, stream_with_context
 from flask_login import current_user, logout_user, login_required, login_user
+from sqlalchemy.exc import IntegrityError
 
 from app.models import RoleEnum, User, ChatConversation, ChatMessage, Symptom, SkinImage, CVPrediction
 from app import app, flow
 from app.form import LoginForm, RegisterForm, ProfileForm, ChangePasswordForm
-from app.dao import dao_authen, dao_user
+from app.dao import dao_authen, dao_user, dao_chat
+from app.dao.pagination import clamp_limit
+from app.passwords import PasswordHasherBusy
 from app.extensions import db
-from app.rag_chatbot import rag_chatbot
-from app.cv_model import cv_model
+from app.db_pool import pool_metrics
+from app.model_registry import model_registry, LOADING, PENDING
+from app.jobs import job_runner, DONE, FAILED
 
 import google.oauth2.id_token
 import google.auth.transport.requests
@@ -58,10 +65,15 @@ def login():
         if not user:
             mse = "Tài khoản không tồn tại trong hệ thống"
         else:
-            if dao_authen.check_password_md5(user, password):
+            try:
+                password_ok = dao_authen.check_password(user, password)
+            except PasswordHasherBusy:
+                password_ok = None
+                mse = "Hệ thống đang bận, vui lòng thử lại sau ít phút"
+            if password_ok:
                 login_user(user)
                 return redirect(url_for('index_controller'))
-            else:
+            elif password_ok is False:
                 mse = "Mật khẩu không đúng"
 
     return render_template('login.html', form=form, mse=mse)
@@ -187,17 +199,27 @@ def chatbot():
 @app.route('/api/chat/conversations', methods=['GET'])
 @login_required
 def get_conversations():
-    """Get all conversations for the current user"""
-    conversations = ChatConversation.query.filter_by(
-        user_id=current_user.user_id
-    ).order_by(ChatConversation.updated_at.desc()).all()
+    """
+    Get a page of conversations for the current user (?limit=&cursor=).
+    Cursor của trang kế tiếp nằm trong header X-Next-Cursor.
+    """
+    limit = clamp_limit(request.args.get('limit', type=int), app.config['CHAT_CONVERSATIONS_PAGE_SIZE'])
+    try:
+        conversations, next_cursor = dao_chat.get_conversations(
+            current_user.user_id, limit, request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify([{
+    response = jsonify([{
         'id': conv.conversation_id,
         'title': conv.title,
         'createdAt': conv.created_at.strftime('%d/%m/%Y %H:%M:%S'),
         'updatedAt': conv.updated_at.strftime('%d/%m/%Y %H:%M:%S')
     } for conv in conversations])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @app.route('/api/chat/conversations', methods=['POST'])
@@ -223,20 +245,22 @@ def create_conversation():
 @app.route('/api/chat/conversations/<int:conversation_id>/messages', methods=['GET'])
 @login_required
 def get_messages(conversation_id):
-    """Get all messages in a conversation (only if user owns it)"""
-    conversation = ChatConversation.query.filter_by(
-        conversation_id=conversation_id,
-        user_id=current_user.user_id
-    ).first()
+    """
+    Get the newest messages of a conversation, or the ones older than ?cursor=
+    (only if user owns it). Cursor để lấy tin cũ hơn nằm trong header X-Next-Cursor.
+    """
+    conversation = dao_chat.get_conversation(conversation_id, current_user.user_id)
 
     if not conversation:
         return jsonify({'error': 'Conversation not found or access denied'}), 404
 
-    messages = ChatMessage.query.filter_by(
-        conversation_id=conversation_id
-    ).order_by(ChatMessage.timestamp.asc()).all()
+    limit = clamp_limit(request.args.get('limit', type=int), app.config['CHAT_MESSAGES_PAGE_SIZE'])
+    try:
+        messages, next_cursor = dao_chat.get_messages(conversation_id, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify([{
+    response = jsonify([{
         'id': msg.message_id,
         'content': msg.content,
         'type': msg.message_type,
@@ -245,6 +269,9 @@ def get_messages(conversation_id):
         'image_url': msg.image_url,
         'is_html': msg.is_html
     } for msg in messages])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @app.route('/api/chat/conversations/<int:conversation_id>/messages', methods=['POST'])
@@ -363,169 +390,603 @@ def about():
 
 
 
+#---------- HEALTH -------------
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: process Flask đang chạy"""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 khi RAG và CNN đã load xong, 503 khi còn đang khởi động"""
+    ready = model_registry.is_ready()
+    return jsonify({
+        'ready': ready,
+        'models': model_registry.status()
+    }), 200 if ready else 503
+
+
+@app.route('/api/metrics/db-pool')
+@login_required
+def db_pool_metrics():
+    """Số liệu pool kết nối DB của process này (chỉ admin)"""
+    if current_user.role != RoleEnum.ADMIN:
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(pool_metrics.snapshot(db.engine.pool))
+
+
 #---------- RAG - CNN -------------
 
+# Executor giới hạn số thread cho các bước chạy song song của chat (upload, CNN, retrieve)
+chat_executor = ThreadPoolExecutor(
+    max_workers=app.config['CHAT_PIPELINE_WORKERS'],
+    thread_name_prefix="chat-pipeline"
+)
+
+RAG_ERROR_MESSAGE = "Xin lỗi, có lỗi xảy ra khi xử lý yêu cầu của bạn. Vui lòng thử lại."
+EMPTY_QUERY_MESSAGE = "Xin hãy mô tả vấn đề hoặc gửi hình ảnh để tôi có thể tư vấn."
+
+
+def _get_chat_models(need_cv):
+    """
+    Lấy RAG (và CNN nếu có ảnh) từ model_registry. Trả về (rag_chatbot, cv_model, None)
+    hoặc (None, None, response 503) khi model còn đang khởi động
+    """
+    rag_chatbot = model_registry.get('rag_chatbot')
+    cv_model = model_registry.get('cv_model') if need_cv else None
+    # CNN lỗi hẳn thì vẫn trả lời bằng RAG, chỉ chờ khi CNN còn đang load
+    cv_warming_up = need_cv and cv_model is None and model_registry.state('cv_model') in (LOADING, PENDING)
+
+    if rag_chatbot is not None and not cv_warming_up:
+        return rag_chatbot, cv_model, None
+
+    warming_up = cv_warming_up or model_registry.state('rag_chatbot') in (LOADING, PENDING)
+    response = jsonify({
+        'success': False,
+        'warming_up': warming_up,
+        'error': 'Hệ thống đang khởi động mô hình AI, vui lòng thử lại sau giây lát.'
+        if warming_up else 'Mô hình AI hiện không khả dụng, vui lòng thử lại sau.'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return None, None, response
+
+
+def _find_conversation_id(conversation_id):
+    """Id conversation của user hiện tại, None nếu không có / không thuộc user"""
+    return db.session.query(ChatConversation.conversation_id).filter_by(
+        conversation_id=conversation_id,
+        user_id=current_user.user_id
+    ).scalar()
+
+
+def _create_conversation(message_text):
+    # Tạo conversation mới với title từ message đầu tiên
+    title = message_text[:50] + "..." if message_text else "Cuộc trò chuyện mới"
+    conversation = ChatConversation(
+        user_id=current_user.user_id,
+        title=title
+    )
+    db.session.add(conversation)
+    db.session.flush()
+    return conversation.conversation_id
+
+
+def _end_read_transaction():
+    """
+    Kết thúc transaction chỉ đọc (tra client_request_id / conversation) để trả connection về
+    pool trước các bước chậm: upload Cloudinary, CNN, chờ job phân tích ảnh
+    """
+    db.session.commit()
+
+
+def _decode_image(image_data):
+    """data URL base64 -> bytes"""
+    return base64.b64decode(image_data.split(',')[1])
+
+
+class ChatImageTooLarge(Exception):
+    pass
+
+
+# Phần ngoài ảnh của body (text, các field form, boundary) được phép khi chặn sớm theo Content-Length
+CHAT_BODY_OVERHEAD_BYTES = 64 * 1024
+
+
+def _image_too_large_response():
+    max_mb = app.config['CHAT_IMAGE_MAX_BYTES'] / (1024 * 1024)
+    return jsonify({'success': False, 'error': f'Ảnh vượt quá {max_mb:g}MB'}), 413
+
+
+def _read_image_file(image_file):
+    """
+    Đọc file ảnh multipart thành 1 buffer bytes duy nhất (dùng chung cho Cloudinary và CNN),
+    dừng ngay khi vượt CHAT_IMAGE_MAX_BYTES
+    """
+    max_bytes = app.config['CHAT_IMAGE_MAX_BYTES']
+    image_bytes = image_file.stream.read(max_bytes + 1)
+    if len(image_bytes) > max_bytes:
+        raise ChatImageTooLarge()
+    return image_bytes
+
+
+def _parse_chat_request():
+    """
+    Body của send-message: multipart/form-data (ảnh nhị phân ở field 'image') hoặc JSON cũ
+    (ảnh là data URL base64). Trả về (các field, image_bytes hoặc None).
+    Body lớn hơn giới hạn bị từ chối theo Content-Length trước khi đọc
+    """
+    max_bytes = app.config['CHAT_IMAGE_MAX_BYTES']
+    if request.mimetype == 'multipart/form-data':
+        if request.content_length and request.content_length > max_bytes + CHAT_BODY_OVERHEAD_BYTES:
+            raise ChatImageTooLarge()
+        data = request.form.to_dict()
+        image_file = request.files.get('image')
+        image_bytes = _read_image_file(image_file) if image_file and image_file.filename else None
+        return data, image_bytes
+
+    # base64 lớn hơn ~4/3 so với ảnh gốc
+    if request.content_length and request.content_length > max_bytes * 4 // 3 + CHAT_BODY_OVERHEAD_BYTES:
+        raise ChatImageTooLarge()
+    data = request.get_json() or {}
+    image_bytes = None
+    if data.get('image'):
+        try:
+            image_bytes = _decode_image(data.pop('image'))
+        except Exception as e:
+            app.logger.error(f"Image decode error: {e}")
+        if image_bytes is not None and len(image_bytes) > max_bytes:
+            raise ChatImageTooLarge()
+    return data, image_bytes
+
+
+def _upload_chat_image_result(image_bytes):
+    """Upload ảnh chat lên Cloudinary, trả về kết quả upload (secure_url, public_id, ...) hoặc None"""
+    try:
+        return cloudinary.uploader.upload(
+            image_bytes,
+            folder="chat_images"
+        )
+    except Exception as e:
+        app.logger.error(f"Image upload error: {e}")
+        return None
+
+
+def _upload_chat_image(image_bytes):
+    upload_result = _upload_chat_image_result(image_bytes)
+    return upload_result['secure_url'] if upload_result else None
+
+
+def _save_user_message(conversation_id, message_text, has_image, image_url, client_request_id=None):
+    user_message = ChatMessage(
+        conversation_id=conversation_id,
+        user_id=current_user.user_id,
+        content=message_text,
+        message_type='user',
+        has_image=has_image,
+        image_url=image_url,
+        client_request_id=client_request_id
+    )
+    db.session.add(user_message)
+    db.session.flush()
+    return user_message
+
+
+def _get_client_request_id(data):
+    client_request_id = str(data.get('client_request_id') or '').strip()
+    return client_request_id[:64] or None
+
+
+def _find_request_messages(client_request_id):
+    """(tin user, tin bot) đã lưu của lần gửi client_request_id (khi client gửi lại)"""
+    if not client_request_id:
+        return None, None
+    messages = ChatMessage.query.filter_by(
+        user_id=current_user.user_id,
+        client_request_id=client_request_id
+    ).all()
+    by_type = {message.message_type: message for message in messages}
+    return by_type.get('user'), by_type.get('bot')
+
+
+def _replayed_response(user_message, bot_message):
+    """Response cho lần gửi lại của 1 request đã trả lời xong: trả câu trả lời đã lưu"""
+    return {
+        'success': True,
+        'conversation_id': bot_message.conversation_id,
+        'response': bot_message.content,
+        'cv_prediction': None,
+        'disease_name': None,
+        'confidence': None,
+        'image_url': user_message.image_url if user_message else None,
+        'timings': {},
+        'replayed': True
+    }
+
+
+def _commit_chat_inputs(conversation_id, message_text, has_image, image_url, prediction, client_request_id):
+    """
+    Transaction 1: hội thoại (tạo mới nếu conversation_id là None), tin nhắn user và kết quả
+    phân tích ảnh. Chỉ mở sau khi upload / CNN đã xong và commit ngay trước khi gọi LLM nên
+    không giữ lock / connection trong lúc chờ. Trả về conversation_id, hoặc None nếu 1 request
+    cùng client_request_id vừa lưu trước (2 lần gửi chạy song song)
+    """
+    try:
+        if conversation_id is None:
+            conversation_id = _create_conversation(message_text)
+        _save_user_message(conversation_id, message_text, has_image, image_url, client_request_id)
+        _save_image_analysis(prediction, message_text, image_url)
+        db.session.commit()
+        return conversation_id
+    except IntegrityError:
+        db.session.rollback()
+        return None
+
+
+def _timed(fn, *args):
+    """Chạy fn trên executor, trả về (kết quả, thời gian ms) để ghi timings từng bước"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _predict_image(cv_model, image_bytes):
+    try:
+        return cv_model.predict(image_bytes)
+    except Exception as e:
+        app.logger.error(f"Image processing error: {e}")
+        return None
+
+
+def _analyze_image_job(image_bytes):
+    """
+    Job nền 'analyze_image': upload Cloudinary + CNN cho ảnh chat. Các bản ghi Symptom /
+    SkinImage / CVPrediction vẫn được lưu cùng tin nhắn khi send-message dùng job này
+    """
+    upload = chat_executor.submit(_upload_chat_image_result, image_bytes)
+    cv_model = model_registry.wait('cv_model', app.config['CHAT_ANALYSIS_WAIT_TIMEOUT'])
+    prediction = _predict_image(cv_model, image_bytes) if cv_model is not None else None
+    upload_result = upload.result() or {}
+
+    cv_prediction, raw_disease_name, confidence = _describe_prediction(prediction)
+    if prediction is not None:
+        disease_name, conf, raw_name = prediction
+        prediction = [disease_name, float(conf) if conf else 0.0, raw_name]
+    return {
+        'image_url': upload_result.get('secure_url'),
+        'public_id': upload_result.get('public_id'),
+        'prediction': prediction,
+        'cv_prediction': cv_prediction,
+        'disease_name': raw_disease_name,
+        'confidence': confidence
+    }
+
+
+def _discard_image_analysis(result):
+    """Cleanup job 'analyze_image' không được gắn vào tin nhắn nào: xóa ảnh đã upload"""
+    if result.get('public_id'):
+        cloudinary.uploader.destroy(result['public_id'])
+
+
+job_runner.register('analyze_image', _analyze_image_job, cleanup=_discard_image_analysis)
+
+
+def _find_user_job(job_id):
+    job = job_runner.get(job_id)
+    if job is None or job['owner_id'] != current_user.user_id:
+        return None
+    return job
+
+
+def _resolve_analysis_job(analysis_job_id, image_bytes):
+    """
+    Chọn nguồn phân tích ảnh cho send-message: job nền (analysis_job_id) hoặc ảnh gửi kèm.
+    Job không tìm thấy (đã hết hạn, hoặc backend inprocess ở worker khác) mà có ảnh thì
+    phân tích ảnh ngay trong request; không có ảnh thì trả 404 để client gửi lại kèm ảnh.
+    Trả về (analysis_job_id, image_bytes, response lỗi hoặc None)
+    """
+    if not analysis_job_id:
+        return None, image_bytes, None
+    if _find_user_job(analysis_job_id) is not None:
+        return analysis_job_id, None, None
+    if image_bytes is not None:
+        app.logger.warning(f"Analysis job {analysis_job_id} not found, analysing image inline")
+        return None, image_bytes, None
+    return None, None, (jsonify({
+        'success': False,
+        'error': 'Analysis job not found',
+        'analysis_job_missing': True
+    }), 404)
+
+
+def _wait_image_analysis(job_id, timings):
+    """(image_url, prediction) từ job phân tích ảnh; job lỗi / quá hạn chờ thì (None, None)"""
+    started = time.perf_counter()
+    job = job_runner.wait(job_id, app.config['CHAT_ANALYSIS_WAIT_TIMEOUT'])
+    timings['analysis_wait_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    if job is None or job['status'] != DONE:
+        app.logger.error(f"Image analysis job {job_id} not finished: {job['status'] if job else 'missing'}")
+        return None, None
+    result = job['result']
+    prediction = tuple(result['prediction']) if result['prediction'] else None
+    return result['image_url'], prediction
+
+
+def _submit_chat_stages(rag_chatbot, cv_model, image_bytes, message_text, upload=True):
+    """
+    Các bước không phụ thuộc nhau chạy song song trên chat_executor: upload Cloudinary,
+    dự đoán CNN và retrieve cho phần text (không cần kết quả CNN)
+    """
+    futures = {}
+    if image_bytes is not None:
+        if upload:
+            futures['upload'] = chat_executor.submit(_timed, _upload_chat_image, image_bytes)
+        futures['predict'] = chat_executor.submit(_timed, _predict_image, cv_model, image_bytes)
+    if message_text.strip():
+        futures['retrieval'] = chat_executor.submit(_timed, rag_chatbot.retrieve, message_text)
+    return futures
+
+
+def _stage_result(futures, stage, timings):
+    if stage not in futures:
+        return None
+    result, elapsed_ms = futures[stage].result()
+    timings[f'{stage}_ms'] = round(elapsed_ms, 1)
+    return result
+
+
+def _describe_prediction(prediction):
+    """
+    (disease_name, conf, raw_disease_name) từ CNN -> (cv_prediction, raw_disease_name, confidence)
+    """
+    if prediction is None:
+        return "Có lỗi xảy ra khi xử lý hình ảnh. Vui lòng thử lại.", None, None
+
+    disease_name, conf, raw_disease_name = prediction
+    confidence = float(conf) if conf else 0.0
+    if disease_name and confidence > 0.2:
+        cv_prediction = f"Phân tích hình ảnh cho thấy dấu hiệu của: **{disease_name}** (độ tin cậy: {confidence:.1%})."
+    else:
+        cv_prediction = "Không thể xác định rõ tình trạng da từ hình ảnh. Vui lòng thử lại với hình ảnh rõ hơn hoặc mô tả thêm triệu chứng."
+    return cv_prediction, raw_disease_name, confidence
+
+
+def _save_image_analysis(prediction, message_text, image_url):
+    """Lưu hình ảnh và kết quả dự đoán vào database (Symptom/SkinImage/CVPrediction)"""
+    if prediction is None:
+        return
+    disease_name, conf, raw_disease_name = prediction
+    try:
+        symptom = Symptom(
+            user_id=current_user.user_id,
+            description_text=message_text if message_text else f"Phân tích hình ảnh da - {disease_name or 'Không xác định'}"
+        )
+        db.session.add(symptom)
+        db.session.flush()
+
+        skin_image = SkinImage(
+            user_id=current_user.user_id,
+            symptom_id=symptom.symptom_id,
+            image_path=image_url if image_url else "unknown"
+        )
+        db.session.add(skin_image)
+        db.session.flush()
+
+        if disease_name:
+            cv_pred = CVPrediction(
+                skinimage_id=skin_image.skinimage_id,
+                confidence=float(conf) if conf else 0.0,
+                disease_name=raw_disease_name
+            )
+            db.session.add(cv_pred)
+
+    except Exception as e:
+        app.logger.error(f"Error saving image data: {e}")
+
+
+def _build_combined_query(message_text, cv_prediction):
+    # Tạo câu hỏi tổng hợp cho RAG
+    if cv_prediction:
+        return f"{message_text}. {cv_prediction}" if message_text else cv_prediction
+    return message_text
+
+
+def _summarize_history_job(conversation_id):
+    """
+    Job nền 'summarize_history': gộp tin nhắn cũ vào tóm tắt hội thoại. Gọi LLM ngoài request
+    để lượt chat không phải chờ thêm 1 lần gọi LLM
+    """
+    rag_chatbot = model_registry.wait('rag_chatbot', app.config['CHAT_ANALYSIS_WAIT_TIMEOUT'])
+    if rag_chatbot is None:
+        return {'updated': False}
+    return {'updated': rag_chatbot.summarize_conversation(conversation_id)}
+
+
+job_runner.register('summarize_history', _summarize_history_job)
+
+
+def _load_chat_history(rag_chatbot, conversation_id):
+    """
+    Đọc lịch sử cho LLM rồi commit để trả connection về pool trước mọi lần gọi LLM (vài giây);
+    lần truy cập DB sau sẽ tự lấy connection mới. Tóm tắt hội thoại (nếu đến lượt) chạy ở job nền
+    """
+    try:
+        chat_history, summary_due = rag_chatbot.load_conversation_history(conversation_id)
+        db.session.commit()
+    except Exception as e:
+        # Lỗi đọc lịch sử thì vẫn trả lời, chỉ không kèm lịch sử
+        app.logger.error(f"Chat history error: {e}")
+        db.session.rollback()
+        return []
+
+    if summary_due:
+        try:
+            job_runner.submit('summarize_history', {'conversation_id': conversation_id})
+        except Exception as e:
+            app.logger.warning(f"Không tạo được job tóm tắt hội thoại: {e}")
+    return chat_history
+
+
+def _compose_response_text(cv_prediction, rag_response_content):
+    # Tạo response text cuối cùng - QUAN TRỌNG: không dùng HTML lồng nhau
+    if cv_prediction and rag_response_content:
+        # Có cả CV và RAG response
+        return f"{cv_prediction}\n\n{rag_response_content}"
+    elif cv_prediction:
+        # Chỉ có CV
+        return cv_prediction
+    # Chỉ có RAG
+    return rag_response_content
+
+
+def _save_bot_message(conversation_id, response_text, client_request_id=None):
+    """
+    Transaction 2 (sau khi LLM trả lời). Nếu 1 lần gửi lại cùng client_request_id đã lưu
+    câu trả lời trước thì giữ bản đó và trả về nó
+    """
+    # Lưu tin nhắn bot KHÔNG đánh dấu HTML (vì đã xử lý plain text)
+    bot_message = ChatMessage(
+        conversation_id=conversation_id,
+        user_id=current_user.user_id,
+        content=response_text,
+        message_type='bot',
+        is_html=False,  # Để frontend tự format
+        client_request_id=client_request_id
+    )
+    db.session.add(bot_message)
+
+    # Cập nhật thời gian conversation
+    ChatConversation.query.filter_by(conversation_id=conversation_id).update(
+        {'updated_at': datetime.datetime.utcnow()}, synchronize_session=False
+    )
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        _, bot_message = _find_request_messages(client_request_id)
+        if bot_message is None:
+            raise
+    return bot_message
+
+
 @app.route('/api/chat/send-message', methods=['POST'])
 @login_required
 def send_chat_message():
     """Handle chat messages with both text and image"""
     try:
-        data = request.get_json()
+        try:
+            data, image_bytes = _parse_chat_request()
+        except ChatImageTooLarge:
+            return _image_too_large_response()
         message_text = data.get('message', '')
-        image_data = data.get('image', None)
-        conversation_id = data.get('conversation_id')
+        conversation_id = data.get('conversation_id') or None
+        client_request_id = _get_client_request_id(data)
+        # Ảnh đã gửi qua upload-image và đang phân tích ở job nền -> không cần gửi lại ảnh
+        analysis_job_id = data.get('analysis_job_id') or None
+        has_image = image_bytes is not None or bool(analysis_job_id)
 
         # Validate input
-        if not message_text and not image_data:
+        if not message_text and not has_image:
             return jsonify({'error': 'Message or image is required'}), 400
 
-        # Tìm hoặc tạo conversation
-        if conversation_id:
-            conversation = ChatConversation.query.filter_by(
-                conversation_id=conversation_id,
-                user_id=current_user.user_id
-            ).first()
-            if not conversation:
+        # Client gửi lại request đã trả lời xong -> trả câu trả lời cũ, không tạo tin trùng
+        # (kiểm tra trước job vì job có thể đã bị xóa khi hết hạn)
+        user_message, bot_message = _find_request_messages(client_request_id)
+        if bot_message is not None:
+            return jsonify(_replayed_response(user_message, bot_message))
+
+        analysis_job_id, image_bytes, job_missing = _resolve_analysis_job(analysis_job_id, image_bytes)
+        if job_missing:
+            return job_missing
+
+        rag_chatbot, cv_model, not_ready = _get_chat_models(image_bytes is not None)
+        if not_ready:
+            return not_ready
+
+        # Lần gửi trước đã lưu tin user thì dùng hội thoại của nó; conversation mới chỉ được
+        # tạo trong transaction 1, sau các bước chậm
+        saved_image_url = None
+        if user_message is not None:
+            conversation_id = user_message.conversation_id
+            saved_image_url = user_message.image_url
+        elif conversation_id:
+            conversation_id = _find_conversation_id(conversation_id)
+            if conversation_id is None:
                 return jsonify({'error': 'Conversation not found'}), 404
-        else:
-            # Tạo conversation mới với title từ message đầu tiên
-            title = message_text[:50] + "..." if message_text else "Cuộc trò chuyện mới"
-            conversation = ChatConversation(
-                user_id=current_user.user_id,
-                title=title
-            )
-            db.session.add(conversation)
-            db.session.flush()
+        retrying = user_message is not None
+        _end_read_transaction()
 
-        # Lưu thông tin ảnh nếu có
-        has_image = bool(image_data)
-        image_url = None
+        started_at = time.perf_counter()
+        timings = {}
 
-        # Upload ảnh lên cloudinary nếu có
-        if image_data:
-            try:
-                image_bytes = base64.b64decode(image_data.split(',')[1])
-                upload_result = cloudinary.uploader.upload(
-                    image_bytes,
-                    folder="chat_images"
-                )
-                image_url = upload_result['secure_url']
-            except Exception as e:
-                app.logger.error(f"Image upload error: {e}")
+        # image_bytes là buffer duy nhất, dùng chung cho upload và CNN
+        futures = _submit_chat_stages(rag_chatbot, cv_model, image_bytes, message_text,
+                                      upload=not retrying)
 
-        # Lưu tin nhắn người dùng với URL ảnh
-        user_message = ChatMessage(
-            conversation_id=conversation.conversation_id,
-            user_id=current_user.user_id,
-            content=message_text,
-            message_type='user',
-            has_image=has_image,
-            image_url=image_url
-        )
-        db.session.add(user_message)
-        db.session.flush()
+        image_url = saved_image_url if retrying else _stage_result(futures, 'upload', timings)
 
-        response_text = ""
         cv_prediction = None
         raw_disease_name = None
         confidence = None
+        prediction = None
 
         # Xử lý hình ảnh nếu có
-        if image_data:
-            try:
-                image_bytes = base64.b64decode(image_data.split(',')[1])
-
-                # Dự đoán bằng CNN model
-                disease_name, conf, raw_disease_name = cv_model.predict(image_bytes)
-                confidence = float(conf) if conf else 0.0
-
-                if disease_name and confidence > 0.2:
-                    cv_prediction = f"Phân tích hình ảnh cho thấy dấu hiệu của: **{disease_name}** (độ tin cậy: {confidence:.1%})."
-                else:
-                    cv_prediction = "Không thể xác định rõ tình trạng da từ hình ảnh. Vui lòng thử lại với hình ảnh rõ hơn hoặc mô tả thêm triệu chứng."
-
-                # Lưu hình ảnh và kết quả dự đoán vào database
-                try:
-                    symptom = Symptom(
-                        user_id=current_user.user_id,
-                        description_text=message_text if message_text else f"Phân tích hình ảnh da - {disease_name or 'Không xác định'}"
-                    )
-                    db.session.add(symptom)
-                    db.session.flush()
-
-                    skin_image = SkinImage(
-                        user_id=current_user.user_id,
-                        symptom_id=symptom.symptom_id,
-                        image_path=image_url if image_url else "unknown"
-                    )
-                    db.session.add(skin_image)
-                    db.session.flush()
-
-                    if disease_name:
-                        cv_pred = CVPrediction(
-                            skinimage_id=skin_image.skinimage_id,
-                            confidence=confidence,
-                            disease_name=raw_disease_name
-                        )
-                        db.session.add(cv_pred)
-
-                except Exception as e:
-                    app.logger.error(f"Error saving image data: {e}")
-
-            except Exception as e:
-                app.logger.error(f"Image processing error: {e}")
-                cv_prediction = "Có lỗi xảy ra khi xử lý hình ảnh. Vui lòng thử lại."
-
-        # Tạo câu hỏi tổng hợp cho RAG
-        combined_query = message_text
-        if cv_prediction:
-            combined_query = f"{message_text}. {cv_prediction}" if message_text else cv_prediction
+        if analysis_job_id:
+            job_image_url, prediction = _wait_image_analysis(analysis_job_id, timings)
+            image_url = image_url or job_image_url
+            cv_prediction, raw_disease_name, confidence = _describe_prediction(prediction)
+        elif image_bytes is not None:
+            prediction = _stage_result(futures, 'predict', timings)
+            cv_prediction, raw_disease_name, confidence = _describe_prediction(prediction)
+
+        # Lưu tin nhắn người dùng + phân tích ảnh và commit trước khi gọi LLM
+        if not retrying:
+            conversation_id = _commit_chat_inputs(
+                conversation_id, message_text, has_image, image_url, prediction, client_request_id)
+            if conversation_id is None:
+                return jsonify({'success': False, 'error': 'Tin nhắn này đang được xử lý'}), 409
+        if analysis_job_id:
+            # Ảnh đã gắn vào tin nhắn -> purge job không xóa ảnh trên Cloudinary
+            job_runner.consume(analysis_job_id)
+
+        combined_query = _build_combined_query(message_text, cv_prediction)
+        context_docs = _stage_result(futures, 'retrieval', timings)
 
         # Lấy response từ RAG
         rag_response_content = ""
         if combined_query.strip():
+            llm_started_at = time.perf_counter()
             try:
-                rag_response = rag_chatbot.get_rag_response(combined_query, conversation.conversation_id)
-                rag_response_content = rag_response
+                chat_history = _load_chat_history(rag_chatbot, conversation_id)
+                rag_response_content = rag_chatbot.get_rag_response(
+                    combined_query, conversation_id, context_docs=context_docs,
+                    chat_history=chat_history
+                )
             except Exception as e:
                 app.logger.error(f"RAG Error: {e}")
-                rag_response_content = "Xin lỗi, có lỗi xảy ra khi xử lý yêu cầu của bạn. Vui lòng thử lại."
+                rag_response_content = RAG_ERROR_MESSAGE
+            timings['rag_ms'] = round((time.perf_counter() - llm_started_at) * 1000, 1)
         else:
-            rag_response_content = "Xin hãy mô tả vấn đề hoặc gửi hình ảnh để tôi có thể tư vấn."
-
-        # Tạo response text cuối cùng - QUAN TRỌNG: không dùng HTML lồng nhau
-        if cv_prediction and rag_response_content:
-            # Có cả CV và RAG response
-            response_text = f"{cv_prediction}\n\n{rag_response_content}"
-        elif cv_prediction:
-            # Chỉ có CV
-            response_text = cv_prediction
-        else:
-            # Chỉ có RAG
-            response_text = rag_response_content
+            rag_response_content = EMPTY_QUERY_MESSAGE
 
-        # Lưu tin nhắn bot KHÔNG đánh dấu HTML (vì đã xử lý plain text)
-        bot_message = ChatMessage(
-            conversation_id=conversation.conversation_id,
-            user_id=current_user.user_id,
-            content=response_text,
-            message_type='bot',
-            is_html=False  # Để frontend tự format
-        )
-        db.session.add(bot_message)
-
-        # Cập nhật thời gian conversation
-        conversation.updated_at = datetime.datetime.utcnow()
-        db.session.commit()
+        response_text = _compose_response_text(cv_prediction, rag_response_content)
+        bot_message = _save_bot_message(conversation_id, response_text, client_request_id)
+        if bot_message.content != response_text:
+            # 1 lần gửi song song đã lưu câu trả lời trước -> trả đúng bản đã lưu
+            return jsonify(_replayed_response(user_message, bot_message))
+        timings['total_ms'] = round((time.perf_counter() - started_at) * 1000, 1)
 
         return jsonify({
             'success': True,
-            'conversation_id': conversation.conversation_id,
+            'conversation_id': conversation_id,
             'response': response_text,  # Plain text, không HTML
             'cv_prediction': cv_prediction,  # CV result riêng
             'disease_name': raw_disease_name,
             'confidence': confidence,
-            'image_url': image_url  # Trả về URL ảnh để frontend hiển thị ngay
+            'image_url': image_url,  # Trả về URL ảnh để frontend hiển thị ngay
+            'timings': timings  # Thời gian từng bước (ms)
         })
 
     except Exception as e:
@@ -537,12 +998,189 @@ def send_chat_message():
         }), 500
 
 
+def _sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _complete_after_disconnect(events):
+    """
+    Gửi các event của stream. Client ngắt kết nối giữa chừng (server gọi close() ->
+    GeneratorExit) thì vẫn chạy nốt stream (LLM + lưu câu trả lời của bot) và bỏ các event
+    còn lại, để client gửi lại cùng client_request_id thì nhận được câu trả lời đã lưu
+    """
+    # Không dùng yield from: nó sẽ close() luôn stream bên trong khi client ngắt kết nối
+    try:
+        for event in events:
+            yield event
+    except GeneratorExit:
+        for _ in events:
+            pass
+        raise
+
+
+def _serialize_sources(docs):
+    return [{
+        'source': doc.metadata.get('source'),
+        'score': doc.metadata.get('rerank_score'),
+        'snippet': doc.page_content[:200]
+    } for doc in docs]
+
+
+@app.route('/api/chat/send-message/stream', methods=['POST'])
+@login_required
+def stream_chat_message():
+    """
+    Như send-message nhưng trả về Server-Sent Events theo từng bước:
+    conversation -> cv (nếu có ảnh) -> sources -> token... -> done (hoặc error)
+    """
+    try:
+        data, image_bytes = _parse_chat_request()
+    except ChatImageTooLarge:
+        return _image_too_large_response()
+    message_text = data.get('message', '')
+    conversation_id = data.get('conversation_id') or None
+    client_request_id = _get_client_request_id(data)
+    analysis_job_id = data.get('analysis_job_id') or None
+    has_image = image_bytes is not None or bool(analysis_job_id)
+
+    if not message_text and not has_image:
+        return jsonify({'error': 'Message or image is required'}), 400
+
+    user_message, bot_message = _find_request_messages(client_request_id)
+    if bot_message is not None:
+        replayed = _replayed_response(user_message, bot_message)
+
+        def replay():
+            yield _sse_event('conversation', {'conversation_id': replayed['conversation_id']})
+            yield _sse_event('done', replayed)
+
+        return Response(replay(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    analysis_job_id, image_bytes, job_missing = _resolve_analysis_job(analysis_job_id, image_bytes)
+    if job_missing:
+        return job_missing
+
+    rag_chatbot, cv_model, not_ready = _get_chat_models(image_bytes is not None)
+    if not_ready:
+        return not_ready
+
+    saved_image_url = None
+    if user_message is not None:
+        conversation_id = user_message.conversation_id
+        saved_image_url = user_message.image_url
+    elif conversation_id:
+        conversation_id = _find_conversation_id(conversation_id)
+        if conversation_id is None:
+            return jsonify({'error': 'Conversation not found'}), 404
+    retrying = user_message is not None
+    _end_read_transaction()
+
+    def generate(conversation_id):
+        try:
+            started_at = time.perf_counter()
+            timings = {}
+
+            futures = _submit_chat_stages(rag_chatbot, cv_model, image_bytes, message_text,
+                                          upload=not retrying)
+
+            image_url = saved_image_url if retrying else _stage_result(futures, 'upload', timings)
+
+            cv_prediction = None
+            raw_disease_name = None
+            confidence = None
+            prediction = None
+            if analysis_job_id:
+                job_image_url, prediction = _wait_image_analysis(analysis_job_id, timings)
+                image_url = image_url or job_image_url
+                cv_prediction, raw_disease_name, confidence = _describe_prediction(prediction)
+            elif image_bytes is not None:
+                prediction = _stage_result(futures, 'predict', timings)
+                cv_prediction, raw_disease_name, confidence = _describe_prediction(prediction)
+
+            if not retrying:
+                conversation_id = _commit_chat_inputs(
+                    conversation_id, message_text, has_image, image_url, prediction, client_request_id)
+                if conversation_id is None:
+                    yield _sse_event('error', {'success': False, 'error': 'Tin nhắn này đang được xử lý'})
+                    return
+            if analysis_job_id:
+                job_runner.consume(analysis_job_id)
+            # Chỉ báo conversation_id sau khi đã commit
+            yield _sse_event('conversation', {'conversation_id': conversation_id})
+
+            if has_image:
+                yield _sse_event('cv', {
+                    'cv_prediction': cv_prediction,
+                    'disease_name': raw_disease_name,
+                    'confidence': confidence,
+                    'image_url': image_url
+                })
+
+            combined_query = _build_combined_query(message_text, cv_prediction)
+            context_docs = _stage_result(futures, 'retrieval', timings)
+            rag_response_content = EMPTY_QUERY_MESSAGE
+            if combined_query.strip():
+                llm_started_at = time.perf_counter()
+                chat_history = _load_chat_history(rag_chatbot, conversation_id)
+                for kind, value in rag_chatbot.stream_rag_response(
+                        combined_query, conversation_id, context_docs=context_docs,
+                        chat_history=chat_history):
+                    if kind == 'sources':
+                        yield _sse_event('sources', _serialize_sources(value))
+                    elif kind == 'token':
+                        yield _sse_event('token', {'text': value})
+                    else:
+                        rag_response_content = value
+                timings['rag_ms'] = round((time.perf_counter() - llm_started_at) * 1000, 1)
+            else:
+                yield _sse_event('token', {'text': rag_response_content})
+
+            response_text = _compose_response_text(cv_prediction, rag_response_content)
+            bot_message = _save_bot_message(conversation_id, response_text, client_request_id)
+            if bot_message.content != response_text:
+                yield _sse_event('done', _replayed_response(user_message, bot_message))
+                return
+            timings['total_ms'] = round((time.perf_counter() - started_at) * 1000, 1)
+
+            yield _sse_event('done', {
+                'success': True,
+                'conversation_id': conversation_id,
+                'response': response_text,
+                'cv_prediction': cv_prediction,
+                'disease_name': raw_disease_name,
+                'confidence': confidence,
+                'image_url': image_url,
+                'timings': timings
+            })
+
+        except Exception as e:
+            app.logger.error(f"Chat stream error: {e}")
+            db.session.rollback()
+            yield _sse_event('error', {
+                'success': False,
+                'error': 'Có lỗi xảy ra khi xử lý tin nhắn'
+            })
+
+    return Response(
+        stream_with_context(_complete_after_disconnect(generate(conversation_id))),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # để nginx không buffer SSE
+        }
+    )
+
+
 
 @app.route('/api/chat/upload-image', methods=['POST'])
 @login_required
 def upload_chat_image():
     """Upload image for analysis"""
     try:
+        if request.content_length and \
+                request.content_length > app.config['CHAT_IMAGE_MAX_BYTES'] + CHAT_BODY_OVERHEAD_BYTES:
+            return _image_too_large_response()
+
         if 'image' not in request.files:
             return jsonify({'error': 'No image file'}), 400
 
@@ -550,19 +1188,56 @@ def upload_chat_image():
         if image_file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
 
-        # Convert to base64 for frontend preview
-        image_bytes = image_file.read()
-        image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+        try:
+            image_bytes = _read_image_file(image_file)
+        except ChatImageTooLarge:
+            return _image_too_large_response()
+
+        # Upload Cloudinary + CNN chạy ở job nền, gửi job_id kèm tin nhắn (analysis_job_id).
+        # Không trả lại ảnh base64: trình duyệt tự preview bằng object URL
+        job_id = job_runner.submit('analyze_image', {'image_bytes': image_bytes}, owner_id=current_user.user_id)
 
         return jsonify({
             'success': True,
-            'image_data': f"data:image/jpeg;base64,{image_b64}"
+            'job_id': job_id
         })
 
     except Exception as e:
         app.logger.error(f"Image upload error: {e}")
         return jsonify({'error': 'Upload failed'}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """Trạng thái / kết quả 1 job của user hiện tại; ?wait=N để chờ tối đa N giây (long-poll)"""
+    job = _find_user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    wait_s = min(max(request.args.get('wait', 0, type=float), 0), 30)
+    if wait_s and job['status'] not in (DONE, FAILED):
+        job = job_runner.wait(job_id, wait_s)
+        if job is None:
+            # Job bị purge / discard trong lúc chờ
+            return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({
+        'job_id': job['job_id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'result': job['result'],
+        'error': job['error']
+    })
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@login_required
+def discard_job(job_id):
+    """Client bỏ job (đổi / xóa ảnh trước khi gửi): kết quả chưa dùng sẽ được cleanup ở lần purge tới"""
+    if _find_user_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job_runner.discard(job_id)
+    return jsonify({'success': True})
+
 load_dotenv()
 GOOGLE_MAPS_KEY = os.getenv("GOOGLE_MAPS_KEY")
 PLACES_TEXT_URL = "https://places.googleapis.com/v1/places:searchText"
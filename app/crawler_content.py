@@ -1,4 +1,24 @@
+"""
+Crawl bài viết da liễu từ dalieu.vn ra file TXT (phân tách bằng =============================).
+
+Selenium chỉ dùng để bấm "Tải thêm" lấy danh sách bài; nội dung từng bài tải bằng HTTP
+(session có connection pool, nhiều luồng, mỗi host cách nhau --interval giây), cache theo
+ETag/Last-Modified nên crawl lại chỉ tải bài đã đổi. --mode selenium giữ cách cũ (đọc bài bằng trình duyệt).
+
+    python app/crawler_content.py --headless --workers 8
+    python app/crawler_content.py --mode selenium
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
@@ -6,13 +26,23 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
 #Cấu hình
 START_URL = "https://dalieu.vn/chuyen-mon"
 OUTPUT_TXT = "tat_ca_benh_da_lieu.txt"
 MAX_LOAD_MORE = 50
 WAIT_SECONDS = 10 #Để tránh bị chặn
+CACHE_DIR = ".crawl_cache"
+HTTP_WORKERS = 8
+REQUEST_INTERVAL = 0.5 #Khoảng cách tối thiểu (giây) giữa 2 request tới cùng 1 host
+USER_AGENT = "Mozilla/5.0 (compatible; SkinboxCrawler/1.0)"
 
 
 #Khởi tạo Chrome driver
@@ -30,9 +60,6 @@ def make_driver(headless: bool = False) -> webdriver.Chrome:
 def click_load_more_until_end(driver: webdriver.Chrome):
     wait = WebDriverWait(driver, WAIT_SECONDS)
     for i in range(MAX_LOAD_MORE):
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(1.5)
-
         # Nếu xuất hiện thông báo "Bạn đã xem hết bài viết" thì dừng
         try:
             end_text = driver.find_element(By.XPATH, "//p[contains(text(), 'Bạn đã xem hết bài viết')]")
@@ -42,12 +69,13 @@ def click_load_more_until_end(driver: webdriver.Chrome):
         except:
             pass
 
-        # Bấm nút "Tải thêm" nếu có
+        # Bấm nút "Tải thêm" nếu có, rồi chờ tới khi có thêm bài (thay vì sleep cố định)
         try:
             btn = wait.until(EC.element_to_be_clickable((By.ID, "btn_loadmore")))
+            count = len(driver.find_elements(By.CSS_SELECTOR, "div.cate-left-item"))
             print(f"Đang tải thêm lần {i + 1} ...")
-            driver.execute_script("arguments[0].click();", btn)
-            time.sleep(2.5)
+            driver.execute_script("arguments[0].scrollIntoView(); arguments[0].click();", btn)
+            wait.until(lambda d: len(d.find_elements(By.CSS_SELECTOR, "div.cate-left-item")) > count)
         except:
             print("Không còn nút 'Tải thêm' → dừng.")
             break
@@ -71,50 +99,136 @@ def parse_listing(driver: webdriver.Chrome):
     return links
 
 
-#Lấy nội dung chi tiết bài viết
+#Tách nội dung bài viết từ HTML
+def extract_text(html):
+    # Chỉ parse div nội dung thay vì cả trang
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer("div", class_="detail-content"))
+    content_div = soup.select_one("div.detail-content")
+
+    if not content_div:
+        return ""
+
+    # Xóa phần “TÀI LIỆU THAM KHẢO” trở đi
+    for tag in content_div.find_all(string=lambda t: t and "TÀI LIỆU THAM KHẢO" in t.upper()):
+        parent = tag.find_parent()
+        if parent:
+            for sib in list(parent.next_siblings):
+                sib.extract()
+            parent.extract()
+            break
+
+    return content_div.get_text("\n", strip=True)
+
+
+#Lấy nội dung chi tiết bài viết bằng trình duyệt (--mode selenium)
 def extract_content(driver: webdriver.Chrome, url: str):
     try:
         driver.get(url)
         WebDriverWait(driver, WAIT_SECONDS).until(
             EC.presence_of_element_located((By.CSS_SELECTOR, "div.detail-content"))
         )
-        html = driver.page_source
-        soup = BeautifulSoup(html, "html.parser")
-        content_div = soup.select_one("div.detail-content")
-
-        if not content_div:
-            return ""
-
-        # Xóa phần “TÀI LIỆU THAM KHẢO” trở đi
-        for tag in content_div.find_all(string=lambda t: t and "TÀI LIỆU THAM KHẢO" in t.upper()):
-            parent = tag.find_parent()
-            if parent:
-                for sib in list(parent.next_siblings):
-                    sib.extract()
-                parent.extract()
-                break
-
-        text = content_div.get_text("\n", strip=True)
-        return text
+        return extract_text(driver.page_source)
     except Exception as e:
         print(f"Lỗi khi đọc {url}: {e}")
         return ""
 
 
-#Ghi tất cả nội dung vào file TXT
-def save_all_to_txt(articles, output_path):
-    with open(output_path, "w", encoding="utf-8") as f:
-        for i, (title, content) in enumerate(articles, 1):
-            f.write(f"=============================\n")
-            f.write(f"{i}. {title}\n")
-            f.write(f"=============================\n\n")
-            f.write(content.strip() if content else "Không có nội dung")
-            f.write("\n\n\n")
-    print(f"Đã lưu toàn bộ {len(articles)} bài viết vào file: {output_path}")
+class ResponseCache:
+    """Cache nội dung đã tách theo URL kèm ETag/Last-Modified để gửi request có điều kiện"""
 
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
 
-def main():
-    driver = make_driver(headless=False)
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, entry):
+        tmp_path = self._path(url) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(url))
+
+
+class HostRateLimiter:
+    """Giãn các request tới cùng 1 host ít nhất interval giây, dùng chung giữa các luồng"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_at = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if self.interval <= 0:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            scheduled = max(now, self._next_at.get(host, now))
+            self._next_at[host] = scheduled + self.interval
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+#Lấy nội dung chi tiết bài viết bằng HTTP, 304 thì dùng lại bản trong cache
+def fetch_content(session, cache, url, rate_limiter=None):
+    cached = cache.get(url) if cache else None
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        if rate_limiter:
+            rate_limiter.wait(url)
+        resp = session.get(url, headers=headers, timeout=WAIT_SECONDS)
+        if resp.status_code == 304 and cached:
+            return cached["content"], True
+        resp.raise_for_status()
+        content = extract_text(resp.content)
+    except Exception as e:
+        print(f"Lỗi khi đọc {url}: {e}")
+        # Mạng lỗi nhưng đã có bản cũ thì vẫn dùng
+        return (cached["content"], True) if cached else ("", False)
+
+    if cache and (resp.headers.get("ETag") or resp.headers.get("Last-Modified")):
+        cache.put(url, {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "content": content,
+        })
+    return content, False
+
+
+#Ghi từng bài vào file TXT ngay khi có (không giữ toàn bộ nội dung trong RAM)
+def write_article(f, index, title, content):
+    f.write(f"=============================\n")
+    f.write(f"{index}. {title}\n")
+    f.write(f"=============================\n\n")
+    f.write(content.strip() if content else "Không có nội dung")
+    f.write("\n\n\n")
+    f.flush()
+
+
+def fetch_listing(headless):
+    driver = make_driver(headless=headless)
     try:
         driver.get(START_URL)
         WebDriverWait(driver, WAIT_SECONDS).until(
@@ -125,19 +239,57 @@ def main():
         click_load_more_until_end(driver)
         links = parse_listing(driver)
         print(f"Thu được {len(links)} bài viết.")
+        return links
+    finally:
+        driver.quit()
+
 
-        results = []
-        for i, (title, href) in enumerate(links, 1):
-            print(f"[{i}/{len(links)}] Đang đọc: {title}")
-            content = extract_content(driver, href)
-            results.append((title, content))
-            time.sleep(1.0)
+def crawl_http(links, output_path, workers=HTTP_WORKERS, cache_dir=CACHE_DIR, interval=REQUEST_INTERVAL):
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    session = make_session(workers)
+    rate_limiter = HostRateLimiter(interval)
+    cached_count = 0
+    with open(output_path, "w", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        # map giữ đúng thứ tự bài, kết quả được ghi ngay khi tới lượt
+        results = pool.map(lambda link: fetch_content(session, cache, link[1], rate_limiter), links)
+        for i, ((title, _), (content, from_cache)) in enumerate(zip(links, results), 1):
+            cached_count += from_cache
+            print(f"[{i}/{len(links)}] {'(cache) ' if from_cache else ''}{title}")
+            write_article(f, i, title, content)
+    print(f"Đã lưu {len(links)} bài viết vào file: {output_path} ({cached_count} bài không đổi)")
 
-        save_all_to_txt(results, OUTPUT_TXT)
-        print("Crawl xong")
 
+def crawl_selenium(links, output_path, headless):
+    driver = make_driver(headless=headless)
+    try:
+        with open(output_path, "w", encoding="utf-8") as f:
+            for i, (title, href) in enumerate(links, 1):
+                print(f"[{i}/{len(links)}] Đang đọc: {title}")
+                write_article(f, i, title, extract_content(driver, href))
+                time.sleep(1.0)
     finally:
         driver.quit()
+    print(f"Đã lưu toàn bộ {len(links)} bài viết vào file: {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl bài viết da liễu")
+    parser.add_argument("--mode", choices=["http", "selenium"], default="http")
+    parser.add_argument("--output", default=OUTPUT_TXT)
+    parser.add_argument("--workers", type=int, default=HTTP_WORKERS, help="Số request HTTP song song")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Rỗng để tắt cache")
+    parser.add_argument("--interval", type=float, default=REQUEST_INTERVAL,
+                        help="Số giây tối thiểu giữa 2 request tới cùng 1 host (0 để tắt)")
+    parser.add_argument("--headless", action="store_true")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    links = fetch_listing(args.headless)
+    if args.mode == "http":
+        crawl_http(links, args.output, args.workers, args.cache_dir, args.interval)
+    else:
+        crawl_selenium(links, args.output, args.headless)
+    print(f"Crawl xong sau {time.perf_counter() - started:.1f}s")
 
 
 if __name__ == "__main__":
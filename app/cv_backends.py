@@ -0,0 +1,136 @@
+# Các runtime chạy CNN: keras (đầy đủ TensorFlow) hoặc bản đã export (TFLite / ONNX).
+# Mỗi backend nhận batch float32 (N, H, W, 3) và trả về xác suất (N, số lớp).
+import threading
+
+import numpy as np
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path):
+        from app.cv_keras_compat import load_keras_model
+
+        self.keras_model = load_keras_model(model_path)
+
+    def run(self, batch):
+        return np.asarray(self.keras_model(batch, training=False))
+
+
+def _padded_batch_size(n, max_batch_size):
+    """Lũy thừa của 2 nhỏ nhất >= n, không vượt max_batch_size"""
+    size = 1
+    while size < n:
+        size *= 2
+    return min(size, max_batch_size)
+
+
+class TFLiteBackend:
+    """
+    Batch được pad lên 1 trong vài kích thước cố định (1, 2, 4, ... max_batch_size), mỗi kích
+    thước có 1 interpreter đã allocate sẵn, nên batch của micro-batcher dao động cũng không
+    phải resize_tensor_input + allocate_tensors mỗi lần. Batch lớn hơn thì chia nhỏ.
+    """
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=None, max_batch_size=32):
+        try:
+            # tflite-runtime nhẹ hơn nhiều so với cài cả tensorflow
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self._interpreter_cls = Interpreter
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.max_batch_size = _padded_batch_size(max_batch_size, float('inf'))
+        self._interpreters = {}
+        # Interpreter không thread-safe
+        self._lock = threading.Lock()
+        # Batch 1 (predict từng ảnh) dùng nhiều nhất, load luôn để model lỗi thì báo ngay
+        _, self._input, self._output = self._interpreter(1)
+
+    def _interpreter(self, batch_size):
+        """Interpreter đã allocate cho đúng batch_size, tạo lần đầu rồi giữ lại"""
+        cached = self._interpreters.get(batch_size)
+        if cached is not None:
+            return cached
+        interpreter = self._interpreter_cls(model_path=self.model_path, num_threads=self.num_threads)
+        input_details = interpreter.get_input_details()[0]
+        if input_details['shape'][0] != batch_size:
+            interpreter.resize_tensor_input(
+                input_details['index'], [batch_size, *input_details['shape'][1:]]
+            )
+        interpreter.allocate_tensors()
+        cached = (interpreter, interpreter.get_input_details()[0], interpreter.get_output_details()[0])
+        self._interpreters[batch_size] = cached
+        return cached
+
+    def _quantize_input(self, batch):
+        dtype = self._input['dtype']
+        if dtype == np.float32:
+            return batch.astype(np.float32, copy=False)
+        scale, zero_point = self._input['quantization']
+        return np.clip(np.round(batch / scale + zero_point), np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+
+    def _dequantize_output(self, output):
+        if output.dtype == np.float32:
+            return output
+        scale, zero_point = self._output['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def _run_padded(self, chunk):
+        size = _padded_batch_size(len(chunk), self.max_batch_size)
+        interpreter, input_details, output_details = self._interpreter(size)
+        if len(chunk) < size:
+            padded = np.zeros((size, *chunk.shape[1:]), dtype=chunk.dtype)
+            padded[:len(chunk)] = chunk
+            chunk_input = padded
+        else:
+            chunk_input = chunk
+        interpreter.set_tensor(input_details['index'], self._quantize_input(chunk_input))
+        interpreter.invoke()
+        output = interpreter.get_tensor(output_details['index'])
+        return self._dequantize_output(output[:len(chunk)])
+
+    def run(self, batch):
+        with self._lock:
+            outputs = [
+                self._run_padded(batch[start:start + self.max_batch_size])
+                for start in range(0, len(batch), self.max_batch_size)
+            ]
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs, axis=0)
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def run(self, batch):
+        return self.session.run(None, {self._input_name: batch.astype(np.float32, copy=False)})[0]
+
+
+BACKENDS = {
+    'keras': (KerasBackend, 'best_skin_disease_model_final.h5'),
+    'tflite': (TFLiteBackend, 'best_skin_disease_model_final.tflite'),
+    'onnx': (OnnxBackend, 'best_skin_disease_model_final.onnx'),
+}
+
+
+def load_backend(name, model_path):
+    if name not in BACKENDS:
+        raise ValueError(f"CV backend không hợp lệ: {name} (chọn 1 trong {', '.join(BACKENDS)})")
+    backend_cls, _ = BACKENDS[name]
+    return backend_cls(model_path)
+
+
+def default_model_filename(name):
+    return BACKENDS[name][1]
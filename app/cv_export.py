@@ -0,0 +1,100 @@
+"""
+Export CNN da liễu (.h5) sang runtime nhẹ cho CPU, dùng với CV_BACKEND=tflite|onnx
+
+    python -m app.cv_export --format tflite --quantize dynamic
+    python -m app.cv_export --format tflite --quantize int8 --calibration-dir ./sample_images
+    python -m app.cv_export --format onnx --quantize dynamic
+"""
+import argparse
+import os
+
+from app import app
+from app.cv_backends import default_model_filename
+from app.cv_keras_compat import load_keras_model
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def list_images(folder, limit=None):
+    paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit] if limit else paths
+
+
+def _representative_dataset(calibration_dir, preprocess, limit=200):
+    """Ảnh mẫu để TFLite hiệu chỉnh dải giá trị activation khi lượng tử hóa int8"""
+    def generator():
+        for path in list_images(calibration_dir, limit):
+            with open(path, 'rb') as f:
+                yield [preprocess(f.read())]
+    return generator
+
+
+def export_tflite(keras_model, output_path, quantize=None, calibration_dir=None, preprocess=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantize in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'int8':
+        if not calibration_dir:
+            raise ValueError("Lượng tử hóa int8 cần --calibration-dir chứa ảnh mẫu")
+        converter.representative_dataset = _representative_dataset(calibration_dir, preprocess)
+        # Giữ input/output float32 để SkinDiseaseModel dùng chung bước tiền xử lý
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS
+        ]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+def export_onnx(keras_model, output_path, quantize=None, img_size=(224, 224)):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = [tf.TensorSpec((None, img_size[0], img_size[1], 3), tf.float32, name='input')]
+    if quantize == 'int8':
+        raise ValueError("ONNX chỉ hỗ trợ --quantize dynamic, dùng tflite cho int8")
+
+    float_path = output_path + '.float.onnx' if quantize == 'dynamic' else output_path
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, output_path=float_path)
+
+    if quantize == 'dynamic':
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(float_path, output_path, weight_type=QuantType.QInt8)
+        os.remove(float_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export CNN da liễu sang TFLite / ONNX")
+    parser.add_argument('--format', choices=['tflite', 'onnx'], default='tflite')
+    parser.add_argument('--quantize', choices=['none', 'dynamic', 'int8'], default='dynamic')
+    parser.add_argument('--calibration-dir', help="Thư mục ảnh mẫu cho int8")
+    parser.add_argument('--model-path', default=os.path.join(app.root_path, 'model_cv', default_model_filename('keras')))
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    quantize = None if args.quantize == 'none' else args.quantize
+    output = args.output or os.path.join(app.root_path, 'model_cv', default_model_filename(args.format))
+    keras_model = load_keras_model(args.model_path)
+
+    if args.format == 'tflite':
+        from app.cv_model import load_image_array
+
+        export_tflite(keras_model, output, quantize, args.calibration_dir, load_image_array)
+    else:
+        export_onnx(keras_model, output, quantize)
+
+    size_mb = os.path.getsize(output) / 1024 / 1024
+    print(f"Đã export {args.format} ({args.quantize}) -> {output} ({size_mb:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
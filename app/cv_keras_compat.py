@@ -0,0 +1,50 @@
+# Shim để load file .h5 cũ bằng Keras mới, chỉ cần khi chạy backend keras
+from tensorflow.keras.layers import InputLayer
+from tensorflow.keras.saving import register_keras_serializable
+
+
+# Vá InputLayer để xử lý batch_shape
+@register_keras_serializable()
+class PatchedInputLayer(InputLayer):
+    def __init__(self, **kwargs):
+        if 'batch_shape' in kwargs:
+            batch_shape = kwargs.pop('batch_shape')
+            kwargs['batch_size'] = batch_shape[0] if batch_shape else None
+            kwargs['input_shape'] = batch_shape[1:] if batch_shape else None
+        super().__init__(**kwargs)
+
+# Vá DTypePolicy để xử lý compute_dtype và variable_dtype
+@register_keras_serializable()
+class PatchedDTypePolicy:
+    def __init__(self, name='float32'):
+        self.name = name
+        self._compute_dtype = name
+        self._variable_dtype = name
+
+    @property
+    def compute_dtype(self):
+        return self._compute_dtype
+
+    @property
+    def variable_dtype(self):
+        return self._variable_dtype
+
+    def get_config(self):
+        return {'name': self.name}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+
+def load_keras_model(model_path):
+    import tensorflow as tf
+
+    return tf.keras.models.load_model(
+        model_path,
+        compile=False,
+        custom_objects={
+            'InputLayer': PatchedInputLayer,
+            'DTypePolicy': PatchedDTypePolicy
+        }
+    )
@@ -1,51 +1,57 @@
 # app/cv_model.py
-import tensorflow as tf
 import numpy as np
-from tensorflow.keras.preprocessing import image
 from PIL import Image
 import io
 import os
+import threading
 from app import app
-from tensorflow.keras.layers import InputLayer, Conv2D
-from tensorflow.keras.saving import register_keras_serializable
-
-# Vá InputLayer để xử lý batch_shape
-@register_keras_serializable()
-class PatchedInputLayer(InputLayer):
-    def __init__(self, **kwargs):
-        if 'batch_shape' in kwargs:
-            batch_shape = kwargs.pop('batch_shape')
-            kwargs['batch_size'] = batch_shape[0] if batch_shape else None
-            kwargs['input_shape'] = batch_shape[1:] if batch_shape else None
-        super().__init__(**kwargs)
-
-# Vá DTypePolicy để xử lý compute_dtype và variable_dtype
-@register_keras_serializable()
-class PatchedDTypePolicy:
-    def __init__(self, name='float32'):
-        self.name = name
-        self._compute_dtype = name
-        self._variable_dtype = name
-
-    @property
-    def compute_dtype(self):
-        return self._compute_dtype
-
-    @property
-    def variable_dtype(self):
-        return self._variable_dtype
-
-    def get_config(self):
-        return {'name': self.name}
-
-    @classmethod
-    def from_config(cls, config):
-        return cls(**config)
+from app.batching import MicroBatcher
+from app.cv_backends import load_backend, default_model_filename
+
+IMG_SIZE = (224, 224)
+
+
+def decode_image(img_data, img_size=IMG_SIZE, fast=True):
+    """
+    bytes / file-like -> ảnh PIL RGB đúng img_size.
+    fast=True: với JPEG dùng draft mode để libjpeg decode thẳng ở tỉ lệ 1/2, 1/4, 1/8
+    (vẫn >= 2 lần img_size) thay vì decode full ảnh 12MP rồi mới resize
+    """
+    if hasattr(img_data, 'read'):
+        img = Image.open(img_data)
+    else:
+        img = Image.open(io.BytesIO(img_data))
+
+    if fast and img.format == 'JPEG':
+        img.draft('RGB', (img_size[0] * 2, img_size[1] * 2))
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    return img.resize(img_size)
+
+
+def load_image_array(img_data, img_size=IMG_SIZE, out=None, fast=True):
+    """
+    bytes / file-like -> mảng float32 đã chuẩn hóa về [0, 1].
+    Nếu có out (float32, shape (H, W, 3)) thì ghi thẳng vào out, không tạo mảng trung gian;
+    nếu không trả về mảng mới shape (1, H, W, 3)
+    """
+    img = decode_image(img_data, img_size, fast)
+    if out is None:
+        batch = np.empty((1, img_size[1], img_size[0], 3), dtype=np.float32)
+        np.divide(np.asarray(img), 255.0, out=batch[0], dtype=np.float32)
+        return batch
+    np.divide(np.asarray(img), 255.0, out=out, dtype=np.float32)
+    return out
+
 
 class SkinDiseaseModel:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, backend=None):
+        # backend: 'keras' (file .h5 gốc) hoặc bản export nhẹ hơn 'tflite' / 'onnx' (xem cv_export.py)
+        self.backend = backend or app.config['CV_BACKEND']
         if model_path is None:
-            model_path = os.path.join(app.root_path, 'model_cv', 'best_skin_disease_model_final.h5')
+            model_path = os.path.join(app.root_path, 'model_cv', default_model_filename(self.backend))
 
         print("app.root_path =", app.root_path)
         print("model_path =", model_path)
@@ -59,21 +65,14 @@ class SkinDiseaseModel:
         print("Tìm thấy model, đang load...")
 
         try:
-            self.model = tf.keras.models.load_model(
-                model_path,
-                compile=False,
-                custom_objects={
-                    'InputLayer': PatchedInputLayer,
-                    'DTypePolicy': PatchedDTypePolicy
-                }
-            )
-            app.logger.info(f"Model load thành công từ: {model_path}")
+            self.model = load_backend(self.backend, model_path)
+            app.logger.info(f"Model load thành công từ: {model_path} (backend: {self.backend})")
         except Exception as e:
             app.logger.error(f"Lỗi khi load model: {e}")
             self.model = None
             return
 
-        self.img_size = (224, 224)
+        self.img_size = IMG_SIZE
 
         self.raw_class_names = [
             'Eczema',
@@ -101,26 +100,58 @@ class SkinDiseaseModel:
             'Tinea, Ringworm, Candidiasis and other Fungal Infections': 'Nấm da, Nấm candida, Hắc lào'
         }
 
-    def preprocess_image(self, img_data):
-        try:
-            if hasattr(img_data, 'read'):
-                img = Image.open(img_data)
-            else:
-                img = Image.open(io.BytesIO(img_data))
+        # Buffer ảnh (1, H, W, 3) riêng cho mỗi thread, predict ghi đè thay vì cấp phát mới
+        self._buffers = threading.local()
+
+        # Gom các request predict đồng thời thành 1 forward pass
+        self._batcher = None
+        if app.config['CV_BATCHING_ENABLED']:
+            self._batcher = MicroBatcher(
+                self._forward,
+                max_batch_size=app.config['CV_BATCH_MAX_SIZE'],
+                max_wait_ms=app.config['CV_BATCH_WAIT_MS'],
+                name="cv-batcher"
+            )
 
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
+    def _thread_buffer(self):
+        buffer = getattr(self._buffers, 'image', None)
+        if buffer is None:
+            width, height = self.img_size
+            buffer = self._buffers.image = np.empty((1, height, width, 3), dtype=np.float32)
+        return buffer
 
-            img = img.resize(self.img_size)
-            img_array = image.img_to_array(img)
-            img_array = img_array / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
-            return img_array
+    def preprocess_image(self, img_data):
+        """
+        Trả về mảng (1, H, W, 3) nằm trong buffer của thread hiện tại: chỉ dùng được đến lần
+        gọi tiếp theo trên cùng thread (predict chờ forward xong mới trả về nên không bị ghi đè)
+        """
+        try:
+            buffer = self._thread_buffer()
+            load_image_array(img_data, self.img_size, out=buffer[0], fast=app.config['CV_FAST_PREPROCESS'])
+            return buffer
 
         except Exception as e:
             app.logger.error(f"Lỗi xử lý ảnh: {e}")
             return None
 
+    def _forward(self, arrays):
+        """
+        1 forward pass cho cả batch. Backend keras gọi thẳng model(...) thay vì model.predict(...)
+        để tránh chi phí cố định (tạo data adapter, callbacks...) của predict mỗi lần gọi
+        """
+        if len(arrays) == 1:
+            return list(self.model.run(arrays[0]))
+        return list(self.model.run(np.concatenate(arrays, axis=0)))
+
+    def _decode_prediction(self, probs):
+        class_idx = int(np.argmax(probs))
+        confidence = float(np.max(probs))  #Lấy max
+
+        raw_class = self.raw_class_names[class_idx]
+        friendly_name = self.friendly_class_names.get(raw_class, raw_class)
+
+        return friendly_name, confidence, raw_class
+
     def predict(self, img_data):
         try:
             if self.model is None:
@@ -130,21 +161,49 @@ class SkinDiseaseModel:
             if processed_img is None:
                 return None, 0.0, None
 
-            prediction = self.model.predict(processed_img)
-            class_idx = np.argmax(prediction)
-            confidence = float(np.max(prediction))  #Lấy max
-
-            raw_class = self.raw_class_names[class_idx]
-            friendly_name = self.friendly_class_names.get(raw_class, raw_class)
+            if self._batcher is not None:
+                probs = self._batcher.submit(processed_img)
+            else:
+                probs = self._forward([processed_img])[0]
 
-            return friendly_name, confidence, raw_class
+            return self._decode_prediction(probs)
 
         except Exception as e:
             app.logger.error(f"Lỗi dự đoán: {e}")
             return None, 0.0, None
 
-try:
-    cv_model = SkinDiseaseModel()
-except Exception as e:
-    app.logger.error(f"Không thể khởi tạo CV model: {e}")
-    cv_model = None
\ No newline at end of file
+    def predict_batch(self, images, batch_size=32):
+        """
+        Chấm điểm offline nhiều ảnh (bytes hoặc file-like), trả về list kết quả cùng thứ tự
+        với predict(); ảnh lỗi trả về (None, 0.0, None)
+        """
+        if self.model is None:
+            return [("Model không khả dụng", 0.0, None) for _ in images]
+
+        results = [(None, 0.0, None)] * len(images)
+        # Ảnh được ghi thẳng vào buffer batch cấp phát sẵn, không concatenate
+        width, height = self.img_size
+        buffer = np.empty((batch_size, height, width, 3), dtype=np.float32)
+        positions = []
+
+        def flush():
+            if not positions:
+                return
+            probs = self.model.run(buffer[:len(positions)])
+            for idx, row in zip(positions, probs):
+                results[idx] = self._decode_prediction(row)
+            positions.clear()
+
+        for idx, img_data in enumerate(images):
+            try:
+                load_image_array(img_data, self.img_size, out=buffer[len(positions)],
+                                 fast=app.config['CV_FAST_PREPROCESS'])
+            except Exception as e:
+                app.logger.error(f"Lỗi xử lý ảnh: {e}")
+                continue
+            positions.append(idx)
+            if len(positions) == batch_size:
+                flush()
+        flush()
+
+        return results
@@ -1,20 +1,75 @@
-import hashlib
+import threading
+from cachetools import TTLCache
+from flask import g, has_request_context
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from app import app
+from app.extensions import db
 from app.models import User, RoleEnum
+from app.passwords import password_hasher
 from flask_login import current_user
 
+# Cache user theo 2 tầng: g (trong 1 request) + TTLCache trong process (giữa các request).
+# Tầng process lưu giá trị các cột chứ không lưu object ORM, vì object gắn với session
+# của request đã load nó và bị expire khi request đó commit.
+_user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+_user_cache_lock = threading.Lock()
+
+
+def _user_snapshot(user):
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+
+def _user_from_snapshot(values):
+    # Session đã có user này (vd. vừa sửa trong request) thì dùng luôn, không ghi đè.
+    # Object dựng từ snapshot có thể cũ tới USER_CACHE_TTL giây, nên các chỗ ghi / kiểm tra
+    # mật khẩu phải đọc lại bằng populate_existing
+    existing = db.session.identity_map.get(identity_key(User, values['user_id']))
+    if existing is not None:
+        return existing
+    # Gắn vào session hiện tại như 1 object đã load, không phát sinh SELECT
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
 
 def get_info_by_id(id):
-    return User.query.get(id)
+    """Lấy user theo id, mỗi request tối đa 1 query (0 nếu còn trong cache của process)"""
+    user_id = int(id)
+    request_users = g.setdefault('_users', {}) if has_request_context() else {}
+    if user_id in request_users:
+        return request_users[user_id]
+
+    with _user_cache_lock:
+        values = _user_cache.get(user_id)
+    if values is not None:
+        user = _user_from_snapshot(values)
+    else:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            with _user_cache_lock:
+                _user_cache[user_id] = _user_snapshot(user)
+
+    request_users[user_id] = user
+    return user
+
+
+def invalidate_user_cache(user_id):
+    """Gọi sau khi đổi thông tin user; worker khác tự hết hạn sau USER_CACHE_TTL giây"""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+    if has_request_context():
+        g.setdefault('_users', {}).pop(int(user_id), None)
 
 
 def auth_user(username, password):
-    password = str(hashlib.md5(password.strip().encode('utf-8')).hexdigest())
-    user = User.query.filter(User.username.__eq__(username.strip()),
-                             User.password.__eq__(password)).first()
-    return user if user and user.is_active else None
+    user = User.query.filter(User.username.__eq__(username.strip())).execution_options(
+        populate_existing=True).first()
+    return user if user and user.is_active and check_password(user, password) else None
 
 def get_user_by_username(username):
-    return User.query.filter_by(username=username).first()
+    return User.query.filter_by(username=username).execution_options(populate_existing=True).first()
 
 
 # Phần cho validate
@@ -22,11 +77,22 @@ def check_username_exists(username):
     return User.query.filter_by(username=username).first() is not None
 
 
-def check_password_md5(user, password):
-    if user and user.password:  # Đảm bảo user tồn tại và có trường password
-        hashed_password = hashlib.md5(password.encode('utf-8')).hexdigest()
-        return hashed_password == user.password
-    return False
+def check_password(user, password):
+    """Kiểm tra mật khẩu; hash cũ (MD5 / cost khác cấu hình) thì hash lại luôn khi đúng"""
+    if not user or not user.password:  # User OAuth không có mật khẩu
+        return False
+    if not password_hasher.verify(user.password, password):
+        return False
+    if password_hasher.needs_rehash(user.password):
+        try:
+            user.password = password_hasher.hash(password)
+            db.session.commit()
+            invalidate_user_cache(user.user_id)
+        except Exception as ex:
+            # Lần sau đăng nhập sẽ thử lại, không chặn user vì lỗi này
+            db.session.rollback()
+            app.logger.error(f"Không hash lại được mật khẩu user {user.user_id}: {ex}")
+    return True
 
 def check_email_exists(email):
     return User.query.filter_by(email=email).first() is not None
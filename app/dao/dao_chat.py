@@ -0,0 +1,32 @@
+from app.models import ChatConversation, ChatMessage
+from app.dao.pagination import keyset_page
+
+
+def get_conversation(conversation_id, user_id):
+    return ChatConversation.query.filter_by(conversation_id=conversation_id, user_id=user_id).first()
+
+
+def get_conversations(user_id, limit=30, cursor=None):
+    """
+    Các cuộc trò chuyện mới tạo trước, trả về (conversations, next_cursor). Không phân trang
+    theo updated_at vì giá trị này đổi mỗi lần có tin nhắn mới (trùng / sót khi lật trang)
+    """
+    return keyset_page(
+        ChatConversation.query.filter_by(user_id=user_id),
+        ChatConversation.created_at, ChatConversation.conversation_id,
+        limit, cursor
+    )
+
+
+def get_messages(conversation_id, limit=50, cursor=None):
+    """
+    Trang tin nhắn mới nhất (cursor=None) hoặc cũ hơn cursor, trả về (messages theo thứ tự
+    thời gian tăng dần để hiển thị, next_cursor để lấy tiếp các tin cũ hơn)
+    """
+    messages, next_cursor = keyset_page(
+        ChatMessage.query.filter_by(conversation_id=conversation_id),
+        ChatMessage.timestamp, ChatMessage.message_id,
+        limit, cursor
+    )
+    messages.reverse()
+    return messages, next_cursor
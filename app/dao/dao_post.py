@@ -1,6 +1,9 @@
 from app.extensions import db
 from app.models import Post, Comment, Like, Follow, PostImage
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from app.dao.pagination import keyset_page
 
 #Post
 def create_post(user_id, title, content, image_urls=None):
@@ -21,8 +24,18 @@ def create_post(user_id, title, content, image_urls=None):
     return post
 
 
-def get_all_posts():
-    return Post.query.order_by(Post.created_at.desc()).all()
+def get_all_posts(limit=5, cursor=None):
+    """
+    1 trang feed (mới nhất trước) theo cursor, trả về (posts, next_cursor).
+    Số query cố định: post JOIN user + ảnh (selectin); số like / comment là cột đếm sẵn.
+    """
+    query = Post.query.options(joinedload(Post.user), selectinload(Post.images))
+    return keyset_page(query, Post.created_at, Post.post_id, limit, cursor)
+
+
+def _bump_counter(post_id, column, delta):
+    # Tăng/giảm ngay trong SQL để 2 request đồng thời không ghi đè nhau
+    Post.query.filter_by(post_id=post_id).update({column: column + delta}, synchronize_session=False)
 
 
 def get_post_by_id(post_id):
@@ -46,30 +59,61 @@ def add_comment(post_id, user_id, content):
         created_at=datetime.now()
     )
     db.session.add(comment)
+    _bump_counter(post_id, Post.comment_count, 1)
     db.session.commit()
     return comment
 
 
-def get_comments_by_post(post_id):
-    return Comment.query.filter_by(post_id=post_id).order_by(Comment.created_at.asc()).all()
+def get_comments_by_post(post_id, limit=20, cursor=None):
+    """Bình luận cũ trước, trả về (comments, next_cursor)"""
+    query = Comment.query.options(joinedload(Comment.user)).filter_by(post_id=post_id)
+    return keyset_page(query, Comment.created_at, Comment.comment_id, limit, cursor, descending=False)
 
 
 #Like
-def toggle_like(post_id, user_id):
-    like = Like.query.filter_by(post_id=post_id, user_id=user_id).first()
-    if like:
-        db.session.delete(like)  # Bỏ like nếu đã like
-        db.session.commit()
+def _apply_like(post_id, user_id, liked):
+    """
+    Thêm / xóa like và cập nhật like_count trong transaction hiện tại (chưa commit).
+    Trả về True nếu trạng thái thực sự thay đổi. Unique (post_id, user_id) + rowcount của
+    DELETE đảm bảo like_count không lệch khi bấm liên tục / nhiều tab cùng lúc.
+    """
+    if not liked:
+        deleted = Like.query.filter_by(post_id=post_id, user_id=user_id).delete(synchronize_session=False)
+        if deleted:
+            _bump_counter(post_id, Post.like_count, -deleted)
+        return bool(deleted)
+
+    try:
+        db.session.add(Like(post_id=post_id, user_id=user_id, created_at=datetime.now()))
+        db.session.flush()
+    except IntegrityError:
+        # Request khác vừa like trước
+        db.session.rollback()
         return False
-    else:
-        like = Like(post_id=post_id, user_id=user_id, created_at=datetime.now())
-        db.session.add(like)
-        db.session.commit()
-        return True
+    _bump_counter(post_id, Post.like_count, 1)
+    return True
+
+
+def set_like(post_id, user_id, liked):
+    """Đặt trạng thái like (idempotent). Trả về True nếu trạng thái thực sự thay đổi."""
+    changed = _apply_like(post_id, user_id, liked)
+    db.session.commit()
+    return changed
+
+
+def toggle_like(post_id, user_id):
+    """
+    Bỏ like nếu đã like, ngược lại thì like. Trả về trạng thái sau khi toggle.
+    Đọc trạng thái, đổi like và like_count trong cùng 1 transaction, 1 lần commit.
+    """
+    liked = Like.query.filter_by(post_id=post_id, user_id=user_id).first() is None
+    _apply_like(post_id, user_id, liked)
+    db.session.commit()
+    return liked
 
 
 def count_likes(post_id):
-    return Like.query.filter_by(post_id=post_id).count()
+    return db.session.query(Post.like_count).filter_by(post_id=post_id).scalar() or 0
 
 
 def user_liked_post(post_id, user_id):
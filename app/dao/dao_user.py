@@ -1,8 +1,8 @@
-import hashlib
 from app.models import User, RoleEnum
 from app.extensions import db
 from datetime import datetime
 from app.dao import dao_authen
+from app.passwords import password_hasher, PasswordHasherBusy
 
 
 def create_user_with_role(username, email, password, first_name, last_name,
@@ -13,7 +13,10 @@ def create_user_with_role(username, email, password, first_name, last_name,
     if dao_authen.check_username_exists(username) or dao_authen.check_email_exists(email) or dao_authen.check_phone_exists(phone_number):
         return None
 
-    hashed_password = hashlib.md5(password.strip().encode("utf-8")).hexdigest()
+    try:
+        hashed_password = password_hasher.hash(password)
+    except PasswordHasherBusy:
+        return None
 
     user = User(
         username=username,
@@ -45,7 +48,8 @@ def update_user_profile(user_id, first_name, last_name, email, phone_number,
                        address, date_of_birth=None, gender=None, avatar_url=None):
     """Cập nhật thông tin hồ sơ của user"""
     try:
-        user = User.query.get(user_id)
+        # Đọc lại từ DB: bản trong session có thể dựng từ cache user (get_info_by_id) đã cũ
+        user = db.session.get(User, user_id, populate_existing=True)
         if not user:
             return False, "Người dùng không tồn tại"
         
@@ -71,6 +75,7 @@ def update_user_profile(user_id, first_name, last_name, email, phone_number,
         user.updated_at = datetime.now()
         
         db.session.commit()
+        dao_authen.invalidate_user_cache(user_id)
         return True, "Cập nhật thông tin thành công"
     
     except Exception as ex:
@@ -82,20 +87,21 @@ def update_user_profile(user_id, first_name, last_name, email, phone_number,
 def change_password(user_id, old_password, new_password):
     """Đổi mật khẩu user"""
     try:
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id, populate_existing=True)
         if not user:
             return False, "Người dùng không tồn tại"
         
         # Kiểm tra mật khẩu cũ
-        if not dao_authen.check_password_md5(user, old_password):
+        if not dao_authen.check_password(user, old_password):
             return False, "Mật khẩu hiện tại không đúng"
         
         # Cập nhật mật khẩu mới
-        hashed_password = hashlib.md5(new_password.strip().encode('utf-8')).hexdigest()
+        hashed_password = password_hasher.hash(new_password)
         user.password = hashed_password
         user.updated_at = datetime.now()
         
         db.session.commit()
+        dao_authen.invalidate_user_cache(user_id)
         return True, "Đổi mật khẩu thành công"
     
     except Exception as ex:
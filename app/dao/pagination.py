@@ -0,0 +1,66 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(sort_value, row_id):
+    """Cursor = (giá trị cột sắp xếp, id) của dòng cuối trang, mã hóa base64 cho gọn URL"""
+    raw = json.dumps([sort_value.isoformat() if sort_value is not None else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Trả về (datetime hoặc None, id); cursor sai định dạng thì raise ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return (datetime.fromisoformat(sort_value) if sort_value is not None else None), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}") from e
+
+
+def keyset_page(query, sort_column, id_column, limit, cursor=None, descending=True):
+    """
+    Phân trang theo (sort_column, id_column) thay vì OFFSET: trang sau chỉ lấy các dòng
+    đứng sau cursor nên chi phí không tăng theo số trang và không trùng/sót khi có dòng mới.
+    Trả về (items, next_cursor); next_cursor là None khi đã hết.
+    sort_column nên là cột không đổi sau khi tạo (vd. created_at): sửa giá trị trong lúc
+    client đang lật trang sẽ làm dòng đó bị trùng hoặc bị sót.
+    Dòng có sort_column NULL được coi là nhỏ nhất (như thứ tự của MySQL / SQLite).
+    """
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        if sort_value is None:
+            same_value = and_(sort_column.is_(None), id_column < row_id if descending else id_column > row_id)
+            # Giảm dần: NULL nằm cuối nên chỉ còn các dòng NULL; tăng dần: NULL nằm đầu
+            query = query.filter(same_value if descending else or_(same_value, sort_column.isnot(None)))
+        elif descending:
+            query = query.filter(or_(sort_column < sort_value,
+                                     and_(sort_column == sort_value, id_column < row_id),
+                                     sort_column.is_(None)))
+        else:
+            query = query.filter(or_(sort_column > sort_value,
+                                     and_(sort_column == sort_value, id_column > row_id)))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    # Lấy dư 1 dòng để biết còn trang sau hay không
+    items = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return items, next_cursor
+
+
+def clamp_limit(limit, default, maximum=100):
+    """limit từ query string: thiếu thì dùng default, luôn nằm trong [1, maximum]"""
+    if not limit:
+        return default
+    return max(1, min(limit, maximum))
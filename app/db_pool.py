@@ -0,0 +1,143 @@
+"""
+Pool kết nối DB có đo đạc: số lần checkout/checkin, thời gian chờ lấy connection
+(gồm cả lúc phải mở connection mới), số lần vượt pool_size (overflow) / hết thời gian chờ,
+và thời gian mỗi request giữ connection. Số liệu tính riêng cho từng process.
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.overflow_checkouts = 0
+            self.overflow_peak = 0
+            self.wait_total_s = 0.0
+            self.wait_max_s = 0.0
+            self.waits = 0
+            self.hold_total_s = 0.0
+            self.hold_max_s = 0.0
+
+    def record_wait(self, seconds, overflow=0, timed_out=False):
+        with self._lock:
+            self.waits += 1
+            self.wait_total_s += seconds
+            self.wait_max_s = max(self.wait_max_s, seconds)
+            if timed_out:
+                self.timeouts += 1
+            elif overflow > 0:
+                self.overflow_checkouts += 1
+                self.overflow_peak = max(self.overflow_peak, overflow)
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+
+    def record_checkin(self, held_s):
+        with self._lock:
+            self.checkins += 1
+            if held_s is not None:
+                self.hold_total_s += held_s
+                self.hold_max_s = max(self.hold_max_s, held_s)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidate(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            data = {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'overflow_checkouts': self.overflow_checkouts,
+                'overflow_peak': self.overflow_peak,
+                'wait_avg_ms': round(self.wait_total_s / self.waits * 1000, 3) if self.waits else 0.0,
+                'wait_max_ms': round(self.wait_max_s * 1000, 3),
+                'hold_avg_ms': round(self.hold_total_s / self.checkins * 1000, 3) if self.checkins else 0.0,
+                'hold_max_ms': round(self.hold_max_s * 1000, 3),
+            }
+        if isinstance(pool, QueuePool):
+            data['pool'] = {
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+                'max_overflow': pool._max_overflow,
+                'timeout_s': pool.timeout(),
+            }
+        return data
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool ghi lại thời gian chờ lấy connection vào pool_metrics"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started, overflow=self.overflow())
+        return connection
+
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    pool_metrics.record_connect()
+
+
+@event.listens_for(InstrumentedQueuePool, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['checked_out_at'] = time.perf_counter()
+    pool_metrics.record_checkout()
+
+
+@event.listens_for(InstrumentedQueuePool, 'checkin')
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop('checked_out_at', None)
+    pool_metrics.record_checkin(time.perf_counter() - started if started is not None else None)
+
+
+@event.listens_for(InstrumentedQueuePool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.record_invalidate()
+
+
+def engine_options(database_url, pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping):
+    """SQLALCHEMY_ENGINE_OPTIONS; SQLite không dùng QueuePool nên chỉ giữ pre-ping / recycle"""
+    options = {
+        'pool_pre_ping': pool_pre_ping,
+        'pool_recycle': pool_recycle,
+    }
+    if not (database_url or '').startswith('sqlite'):
+        options.update({
+            'poolclass': InstrumentedQueuePool,
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+        })
+    return options
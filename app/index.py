@@ -4,14 +4,19 @@ from app.dao import dao_authen
 from app import controllers
 from app.extensions import db
 from app.api import post_controller
+from app.model_registry import model_registry
+
+# Chỉ web server mới preload model; script import app (ingest, cv_export...) thì không
+if app.config['MODEL_PRELOAD'] == 'background':
+    model_registry.start_background()
 
 # Hàm này luôn truyền các info vào -> .html nao cung co
 @app.context_processor
 def common_attr():
     if current_user.is_authenticated:
-        user = dao_authen.get_info_by_id(current_user.user_id)
+        # current_user đã được user_load lấy sẵn trong request này, không query lại
         return {
-            'user': user,
+            'user': current_user._get_current_object(),
         }
     return {}
 
@@ -0,0 +1,339 @@
+"""
+Nạp các file bài viết (crawler_content.py / preprocess_models.py, phân tách bằng dòng
+=============================) vào collection Qdrant của RAG.
+
+Chạy tăng dần: id của mỗi chunk sinh từ hash nội dung, chunk đã có trong collection thì
+bỏ qua nên crawl lại chỉ tốn embed cho bài thay đổi. Embed theo batch lớn ở nhiều process,
+upsert song song nhiều batch. Có point được nạp / xóa thì đổi version của collection
+(rag_utils.bump_ingest_version) để semantic cache câu trả lời của RAG bị xóa.
+
+Lần đầu chạy trên collection đã nạp bằng notebook core_rag/trials.ipynb: notebook dùng id
+ngẫu nhiên và không có metadata.content_hash nên không chunk nào khớp, mọi bài bị nạp thêm 1
+lần nữa (collection trùng lặp). Lần đầu hãy chạy với --recreate (xóa collection rồi nạp lại,
+RAG không có dữ liệu trong lúc nạp) hoặc --prune (nạp xong mới xóa các point cũ không có
+content_hash); không dùng cờ nào mà collection còn point cũ thì script chỉ cảnh báo.
+
+metadata.source của mỗi chunk là đường dẫn file tính từ --root (mặc định thư mục hiện tại),
+nên 2 file cùng tên ở 2 thư mục khác nhau không bị --prune lẫn với nhau; hãy luôn chạy với
+cùng 1 root. Collection nạp trước đây dùng tên file làm source: chunk cũ của bài đã sửa sẽ
+không được --prune nhận ra, chạy lại 1 lần với --recreate để dọn.
+
+    python -m app.ingest tat_ca_benh_da_lieu.txt output_benh_da_lieu/benh_da_lieu_ai_full.txt --recreate
+    python -m app.ingest data/*.txt --embed-workers 4 --batch-size 256 --prune
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app import app
+from app.rag_embeddings import normalize_text
+from app.rag_utils import EMBEDDING_MODEL_NAME, bump_ingest_version
+
+ARTICLE_DELIMITER = "============================="
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 20
+
+_worker_embeddings = None
+
+
+def clean_text(text):
+    """Làm sạch giống bước preprocess_data trong core_rag/trials.ipynb"""
+    text = re.sub(r'(https?://\S+|www\.\S+)', '', text)
+    text = re.sub(r'^[=\-]{2,}\s*$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\|.*?\|', '', text)
+    text = re.sub(r'[^\w\s,.!?à-ỹÀ-Ỹ\-–]', '', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _iter_sections(path):
+    """Đọc từng dòng, yield list dòng giữa 2 dòng phân tách (không load cả file vào RAM)"""
+    section = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip() == ARTICLE_DELIMITER:
+                yield section
+                section = []
+            else:
+                section.append(line.rstrip('\n'))
+    yield section
+
+
+def iter_articles(path):
+    """
+    Yield (title, content) của từng bài. Hỗ trợ 2 định dạng:
+    crawler: ===/"1. Tiêu đề"/=== rồi nội dung; preprocess_models: ===/"Tên bệnh: X"/nội dung
+    """
+    pending_title = None
+    for section in _iter_sections(path):
+        lines = [line for line in section if line.strip()]
+        if not lines:
+            continue
+        if len(lines) == 1 and pending_title is None:
+            # Dòng tiêu đề nằm giữa 2 dòng === của crawler
+            pending_title = re.sub(r'^\d+\.\s*', '', lines[0].strip())
+            continue
+        if pending_title is not None:
+            title, body = pending_title, lines
+        else:
+            title, body = re.sub(r'^Tên bệnh:\s*', '', lines[0].strip()), lines[1:]
+        pending_title = None
+        yield title, "\n".join(body)
+
+
+def chunk_id(text):
+    """Id ổn định theo nội dung: cùng chunk -> cùng point id, không phụ thuộc thứ tự file"""
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return digest, str(uuid.UUID(digest[:32]))
+
+
+def source_key(path, root):
+    """Khóa metadata.source của 1 file: đường dẫn tương đối từ root, dạng a/b.txt trên mọi OS"""
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(root)).replace(os.sep, '/')
+
+
+def iter_chunks(paths, root='.'):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+    for path in paths:
+        source = source_key(path, root)
+        for title, content in iter_articles(path):
+            cleaned = clean_text(content)
+            if not cleaned:
+                continue
+            for text in splitter.split_text(cleaned):
+                digest, point_id = chunk_id(text)
+                yield point_id, text, {'source': source, 'title': title, 'content_hash': digest}
+
+
+def _init_embed_worker(model_name):
+    global _worker_embeddings
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    _worker_embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+
+def _embed_batch(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+
+class Ingestor:
+    def __init__(self, client, collection_name, batch_size=256, embed_workers=2, upsert_workers=4,
+                 upsert_batch_size=128, root='.'):
+        self.client = client
+        self.root = root
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.upsert_batch_size = upsert_batch_size
+        self.stats = {'chunks': 0, 'skipped': 0, 'embedded': 0, 'upserted': 0}
+        self.seen_ids = set()
+        self._collection_exists = False
+
+    def _existing_ids(self, ids):
+        if not self._collection_exists:
+            return set()
+        points = self.client.retrieve(self.collection_name, ids=ids, with_payload=False, with_vectors=False)
+        return {str(point.id) for point in points}
+
+    def _ensure_collection(self, dim):
+        from qdrant_client.models import Distance, VectorParams
+
+        if not self.client.collection_exists(self.collection_name):
+            self.client.create_collection(
+                self.collection_name,
+                vectors_config=VectorParams(size=dim, distance=Distance.COSINE)
+            )
+
+    def _upsert(self, batch, vectors):
+        from qdrant_client.models import PointStruct
+
+        # Payload giống QdrantVectorStore (page_content / metadata) để retriever đọc được
+        points = [
+            PointStruct(id=point_id, vector=vector, payload={'page_content': text, 'metadata': metadata})
+            for (point_id, text, metadata), vector in zip(batch, vectors)
+        ]
+        for start in range(0, len(points), self.upsert_batch_size):
+            self.client.upsert(self.collection_name, points=points[start:start + self.upsert_batch_size], wait=True)
+        return len(points)
+
+    def _batches(self, paths):
+        batch = []
+        for point_id, text, metadata in iter_chunks(paths, self.root):
+            self.stats['chunks'] += 1
+            if point_id in self.seen_ids:
+                # Cùng nội dung xuất hiện 2 lần trong lượt này
+                self.stats['skipped'] += 1
+                continue
+            self.seen_ids.add(point_id)
+            batch.append((point_id, text, metadata))
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run(self, paths):
+        started = time.perf_counter()
+        self._collection_exists = self.client.collection_exists(self.collection_name)
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.embed_workers, mp_context=ctx, initializer=_init_embed_worker,
+                                 initargs=(EMBEDDING_MODEL_NAME,)) as embed_pool, \
+                ThreadPoolExecutor(self.upsert_workers) as upsert_pool:
+            embedding = {}
+            upserts = set()
+
+            def drain(block):
+                if block:
+                    done, _ = wait(embedding, return_when=FIRST_COMPLETED)
+                else:
+                    done = [future for future in embedding if future.done()]
+                for future in done:
+                    batch = embedding.pop(future)
+                    vectors = future.result()
+                    self.stats['embedded'] += len(vectors)
+                    if not self._collection_exists:
+                        self._ensure_collection(len(vectors[0]))
+                        self._collection_exists = True
+                    upserts.add(upsert_pool.submit(self._upsert, batch, vectors))
+                collect_upserts(block=len(upserts) >= self.upsert_workers * 2)
+
+            def collect_upserts(block):
+                if block:
+                    done, _ = wait(upserts, return_when=FIRST_COMPLETED)
+                else:
+                    done = [future for future in upserts if future.done()]
+                for future in done:
+                    upserts.discard(future)
+                    self.stats['upserted'] += future.result()
+
+            for batch in self._batches(paths):
+                existing = self._existing_ids([point_id for point_id, _, _ in batch])
+                fresh = [item for item in batch if item[0] not in existing]
+                self.stats['skipped'] += len(batch) - len(fresh)
+                if not fresh:
+                    continue
+                # Giới hạn số batch đang embed để không đọc hết file vào RAM
+                while len(embedding) >= self.embed_workers * 2:
+                    drain(block=True)
+                embedding[embed_pool.submit(_embed_batch, [text for _, text, _ in fresh])] = fresh
+                drain(block=False)
+
+            while embedding:
+                drain(block=True)
+            for future in upserts:
+                self.stats['upserted'] += future.result()
+
+        self.stats['elapsed_s'] = time.perf_counter() - started
+        return self.stats
+
+    def recreate(self):
+        """Xóa hẳn collection (lần nạp đầu thay cho dữ liệu của notebook)"""
+        if self.client.collection_exists(self.collection_name):
+            self.client.delete_collection(self.collection_name)
+
+    def _legacy_filter(self):
+        from qdrant_client.models import Filter, IsEmptyCondition, PayloadField
+
+        # Point không do script này nạp (vd. notebook): không có content_hash
+        return Filter(must=[IsEmptyCondition(is_empty=PayloadField(key='metadata.content_hash'))])
+
+    def count_legacy(self):
+        if not self.client.collection_exists(self.collection_name):
+            return 0
+        return self.client.count(self.collection_name, count_filter=self._legacy_filter(), exact=True).count
+
+    def prune_legacy(self):
+        """Xóa các point không có content_hash, trả về số point đã xóa"""
+        from qdrant_client.models import FilterSelector
+
+        removed = self.count_legacy()
+        if removed:
+            self.client.delete(self.collection_name, points_selector=FilterSelector(filter=self._legacy_filter()))
+        return removed
+
+    def prune(self, paths):
+        """Xóa chunk cũ của các file vừa nạp mà không còn trong lượt này (bài đã sửa / bị xóa)"""
+        from qdrant_client.models import FieldCondition, Filter, MatchValue, PointIdsList
+
+        if not self.client.collection_exists(self.collection_name):
+            return 0
+        removed = 0
+        for source in {source_key(path, self.root) for path in paths}:
+            stale = []
+            offset = None
+            while True:
+                points, offset = self.client.scroll(
+                    self.collection_name,
+                    scroll_filter=Filter(must=[FieldCondition(key='metadata.source', match=MatchValue(value=source))]),
+                    limit=1000, offset=offset, with_payload=False, with_vectors=False
+                )
+                stale.extend(point.id for point in points if str(point.id) not in self.seen_ids)
+                if offset is None:
+                    break
+            if stale:
+                self.client.delete(self.collection_name, points_selector=PointIdsList(points=stale))
+                removed += len(stale)
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nạp bài viết da liễu vào Qdrant (tăng dần theo hash)")
+    parser.add_argument('files', nargs='+', help="File .txt phân tách bằng =============================")
+    parser.add_argument('--collection', default=app.config['COLLECTION_NAME'])
+    parser.add_argument('--batch-size', type=int, default=256, help="Số chunk mỗi lần embed")
+    parser.add_argument('--embed-workers', type=int, default=2, help="Số process embed")
+    parser.add_argument('--upsert-workers', type=int, default=4)
+    parser.add_argument('--root', default='.',
+                        help="Thư mục gốc để tính metadata.source (đường dẫn tương đối) của mỗi file")
+    parser.add_argument('--prune', action='store_true',
+                        help="Xóa chunk cũ của các file này không còn xuất hiện và point cũ không có content_hash")
+    parser.add_argument('--recreate', action='store_true',
+                        help="Xóa collection trước khi nạp (lần đầu, thay dữ liệu nạp bằng notebook)")
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(url=app.config['QDRANT_URL'], api_key=app.config['QDRANT_API_KEY'])
+    ingestor = Ingestor(client, args.collection, batch_size=args.batch_size,
+                        embed_workers=args.embed_workers, upsert_workers=args.upsert_workers, root=args.root)
+    if args.recreate:
+        ingestor.recreate()
+        print(f"Đã xóa collection {args.collection}, nạp lại từ đầu")
+    else:
+        legacy = ingestor.count_legacy()
+        if legacy and not args.prune:
+            print(f"Cảnh báo: collection có {legacy} point không có content_hash (vd. nạp bằng notebook), "
+                  f"các bài này sẽ bị trùng. Chạy với --prune hoặc --recreate để dọn.")
+    stats = ingestor.run(args.files)
+
+    elapsed = stats['elapsed_s']
+    print(f"{stats['chunks']} chunk, bỏ qua {stats['skipped']} (đã có), embed {stats['embedded']}, "
+          f"upsert {stats['upserted']} trong {elapsed:.1f}s")
+    print(f"Throughput: {stats['chunks'] / elapsed:.1f} chunk/s tổng, "
+          f"{stats['embedded'] / elapsed:.1f} chunk/s embed + upsert")
+    changed = args.recreate or stats['upserted'] > 0
+    if args.prune:
+        removed = ingestor.prune(args.files)
+        print(f"Đã xóa {removed} chunk cũ")
+        legacy_removed = ingestor.prune_legacy()
+        if legacy_removed:
+            print(f"Đã xóa {legacy_removed} point cũ không có content_hash")
+        changed = changed or removed > 0 or legacy_removed > 0
+    if changed:
+        version = bump_ingest_version(client, args.collection)
+        print(f"Version collection mới: {version} (cache câu trả lời RAG sẽ được làm mới)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+"""
+Job chạy nền cho các việc nặng trong web request (vd. phân tích ảnh chat: upload Cloudinary
++ CNN). Request chỉ submit rồi trả job id ngay, client poll GET /api/jobs/<id> (có thể
+long-poll bằng ?wait=giây) để lấy kết quả.
+
+Backend hàng đợi (JOB_BACKEND):
+- sqlite: bảng job trong 1 file SQLite, dùng chung giữa các worker trên cùng máy (mặc định).
+  Job đang chạy giữ 1 lease (owner_pid + heartbeat_at, gia hạn định kỳ); process chết thì lease
+  hết hạn sau lease_timeout giây và job được process bất kỳ chạy lại.
+- inprocess: queue trong bộ nhớ, job chỉ thấy được ở process đã tạo nó, nên chỉ dùng khi
+  chạy 1 process (flask run, test). Nhiều máy chạy web thì cần backend dùng chung khác.
+Worker là thread pool trong process web, mỗi job chạy trong app context.
+
+Kết quả job chưa được dùng (consume) mà bị bỏ (discard) hoặc hết hạn result_ttl thì
+chạy hàm cleanup của kind đó khi purge (vd. xóa ảnh đã upload nhưng tin nhắn không được gửi).
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from app import app
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class InProcessJobBackend:
+    def __init__(self):
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+    def enqueue(self, job_id, kind, payload, owner_id):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id, 'kind': kind, 'owner_id': owner_id, 'status': QUEUED,
+                'result': None, 'error': None, 'consumed': False, 'discarded': False,
+                'created_at': now, 'updated_at': now
+            }
+        self._queue.put((job_id, kind, payload))
+
+    def dequeue(self, timeout):
+        try:
+            job_id, kind, payload = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job['status'] = RUNNING
+            job['updated_at'] = time.time()
+        return job_id, kind, payload
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(status=status, result=result, error=error, updated_at=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _mark(self, job_id, flag):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job[flag] = True
+
+    def consume(self, job_id):
+        self._mark(job_id, 'consumed')
+
+    def discard(self, job_id):
+        self._mark(job_id, 'discarded')
+
+    def purge(self, older_than):
+        """Xóa và trả về các job đã xong mà hết hạn hoặc bị bỏ"""
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['status'] in (DONE, FAILED) and (job['updated_at'] < older_than or job['discarded'])
+            ]
+            return [self._jobs.pop(job_id) for job_id in expired]
+
+
+def encode_payload(payload):
+    """
+    payload -> (JSON các tham số, bytes). Không dùng pickle để file job bị sửa cũng không
+    chạy được code trong process web; chỉ cho phép tối đa 1 tham số kiểu bytes (vd. ảnh)
+    """
+    params = {}
+    blob_key, blob = None, None
+    for key, value in payload.items():
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            if blob_key is not None:
+                raise ValueError("Job chỉ hỗ trợ 1 tham số kiểu bytes")
+            blob_key, blob = key, bytes(value)
+        else:
+            params[key] = value
+    return json.dumps({'params': params, 'blob_key': blob_key}), blob
+
+
+def decode_payload(params_json, blob):
+    decoded = json.loads(params_json)
+    payload = decoded['params']
+    if decoded['blob_key'] is not None:
+        payload[decoded['blob_key']] = blob
+    return payload
+
+
+class SQLiteJobBackend:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS job (
+        job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, owner_id INTEGER, status TEXT NOT NULL,
+        params TEXT, data BLOB, result TEXT, error TEXT,
+        consumed INTEGER NOT NULL DEFAULT 0, discarded INTEGER NOT NULL DEFAULT 0,
+        owner_pid INTEGER, heartbeat_at REAL,
+        created_at REAL NOT NULL, updated_at REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS ix_job_status_created ON job (status, created_at);
+    """
+
+    def __init__(self, path, poll_interval=0.2, lease_timeout=60):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self._local = threading.local()
+        self._enqueued = threading.Event()
+        self._heartbeat_lock = threading.Lock()
+        self._heartbeat_pid = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connection SQLite không dùng được qua fork (gunicorn --preload) -> mở lại ở process con
+        if conn is None or self._local.pid != os.getpid():
+            # Mỗi thread 1 connection, autocommit; transaction tự mở khi cần khóa
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _start_heartbeat(self):
+        """Thread gia hạn lease các job process này đang chạy, mỗi process 1 thread"""
+        with self._heartbeat_lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            self._heartbeat_pid = os.getpid()
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease_timeout / 3)
+            try:
+                self.renew()
+            except Exception as e:
+                app.logger.error(f"Không gia hạn được lease job: {e}")
+
+    def renew(self):
+        self._conn().execute(
+            "UPDATE job SET heartbeat_at = ? WHERE status = ? AND owner_pid = ?",
+            (time.time(), RUNNING, os.getpid())
+        )
+
+    def enqueue(self, job_id, kind, payload, owner_id):
+        now = time.time()
+        params, data = encode_payload(payload)
+        self._conn().execute(
+            "INSERT INTO job (job_id, kind, owner_id, status, params, data, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, owner_id, QUEUED, params, data, now, now)
+        )
+        self._enqueued.set()
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Lease hết hạn = process đang chạy job đã chết (hoặc treo) -> đưa job về hàng đợi.
+            # Job của process khác còn sống vẫn được gia hạn nên không bị chạy 2 lần
+            conn.execute(
+                "UPDATE job SET status = ?, owner_pid = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, now - self.lease_timeout)
+            )
+            row = conn.execute(
+                "SELECT job_id, kind, params, data FROM job WHERE status = ? ORDER BY created_at LIMIT 1",
+                (QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job SET status = ?, owner_pid = ?, heartbeat_at = ?, updated_at = ? WHERE job_id = ?",
+                    (RUNNING, os.getpid(), now, now, row[0])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        self._start_heartbeat()
+        return row[0], row[1], decode_payload(row[2], row[3])
+
+    def dequeue(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            claimed = self._claim()
+            if claimed is not None:
+                return claimed
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Job do process này thêm thì được đánh thức ngay, process khác thì theo poll_interval
+            self._enqueued.wait(min(remaining, self.poll_interval))
+            self._enqueued.clear()
+
+    def finish(self, job_id, status, result=None, error=None):
+        # Chỉ ghi khi còn giữ lease: job đã bị đưa lại hàng đợi thì để lần chạy sau ghi kết quả
+        self._conn().execute(
+            "UPDATE job SET status = ?, result = ?, error = ?, data = NULL, owner_pid = NULL, "
+            "heartbeat_at = NULL, updated_at = ? WHERE job_id = ? AND status = ? AND owner_pid = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(),
+             job_id, RUNNING, os.getpid())
+        )
+
+    COLUMNS = "job_id, kind, owner_id, status, result, error, consumed, discarded, created_at, updated_at"
+
+    @staticmethod
+    def _row_to_job(row):
+        return {
+            'job_id': row[0], 'kind': row[1], 'owner_id': row[2], 'status': row[3],
+            'result': json.loads(row[4]) if row[4] else None, 'error': row[5],
+            'consumed': bool(row[6]), 'discarded': bool(row[7]),
+            'created_at': row[8], 'updated_at': row[9]
+        }
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            f"SELECT {self.COLUMNS} FROM job WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def consume(self, job_id):
+        self._conn().execute("UPDATE job SET consumed = 1 WHERE job_id = ?", (job_id,))
+
+    def discard(self, job_id):
+        self._conn().execute("UPDATE job SET discarded = 1 WHERE job_id = ?", (job_id,))
+
+    def purge(self, older_than):
+        """Xóa và trả về các job đã xong mà hết hạn hoặc bị bỏ; nhiều process purge cùng lúc
+        thì mỗi job chỉ được 1 process nhận (chọn + xóa trong cùng 1 transaction ghi)"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            where = "status IN (?, ?) AND (updated_at < ? OR discarded = 1)"
+            args = (DONE, FAILED, older_than)
+            rows = conn.execute(f"SELECT {self.COLUMNS} FROM job WHERE {where}", args).fetchall()
+            conn.execute(f"DELETE FROM job WHERE {where}", args)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [self._row_to_job(row) for row in rows]
+
+
+class JobRunner:
+    """
+    Thread pool lấy job từ backend và chạy handler đã register theo kind.
+    Handler nhận payload dạng keyword arguments và trả về kết quả JSON được; cleanup (nếu có)
+    nhận kết quả của job xong mà không được consume, khi job bị discard hoặc hết hạn.
+    """
+
+    def __init__(self, backend, workers=4, result_ttl=3600):
+        self.backend = backend
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._handlers = {}
+        self._cleanups = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._finished = threading.Condition()
+        self._purged_at = time.monotonic()
+
+    def register(self, kind, handler, cleanup=None):
+        self._handlers[kind] = handler
+        if cleanup is not None:
+            self._cleanups[kind] = cleanup
+
+    def start(self):
+        """Khởi động worker (lần đầu submit sẽ tự gọi), không chạy ở các script CLI import app"""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, kind, payload, owner_id=None):
+        if kind not in self._handlers:
+            raise ValueError(f"Không có handler cho job {kind}")
+        job_id = uuid.uuid4().hex
+        self.backend.enqueue(job_id, kind, payload, owner_id)
+        self.start()
+        return job_id
+
+    def get(self, job_id):
+        return self.backend.get(job_id)
+
+    def consume(self, job_id):
+        """Đánh dấu kết quả đã được dùng (vd. ảnh đã gắn vào tin nhắn) -> không cleanup"""
+        self.backend.consume(job_id)
+
+    def discard(self, job_id):
+        """Client bỏ job (đổi / xóa ảnh): cleanup ở lần purge tới thay vì chờ hết result_ttl"""
+        self.backend.discard(job_id)
+
+    def wait(self, job_id, timeout):
+        """Chờ job xong (done/failed) tối đa timeout giây, trả về trạng thái mới nhất"""
+        deadline = time.monotonic() + timeout
+        with self._finished:
+            while True:
+                job = self.backend.get(job_id)
+                if job is None or job['status'] in (DONE, FAILED):
+                    return job
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return job
+                # Job chạy ở process khác (sqlite) không notify được -> kiểm tra lại định kỳ
+                self._finished.wait(min(remaining, 0.25))
+
+    def _run(self, job_id, kind, payload):
+        handler = self._handlers.get(kind)
+        try:
+            if handler is None:
+                raise ValueError(f"Không có handler cho job {kind}")
+            with app.app_context():
+                result = handler(**payload)
+            self.backend.finish(job_id, DONE, result=result)
+        except Exception as e:
+            app.logger.error(f"Job {kind} {job_id} lỗi: {e}")
+            self.backend.finish(job_id, FAILED, error=str(e))
+        with self._finished:
+            self._finished.notify_all()
+
+    def _maybe_purge(self):
+        """Xóa job đã xong quá result_ttl / bị bỏ, tối đa 1 lần/phút (dù worker bận hay rảnh)"""
+        with self._lock:
+            if time.monotonic() - self._purged_at < 60:
+                return
+            self._purged_at = time.monotonic()
+        self.purge()
+
+    def purge(self):
+        for job in self.backend.purge(time.time() - self.result_ttl):
+            cleanup = self._cleanups.get(job['kind'])
+            if cleanup is None or job['consumed'] or job['status'] != DONE or job['result'] is None:
+                continue
+            try:
+                with app.app_context():
+                    cleanup(job['result'])
+            except Exception as e:
+                app.logger.error(f"Cleanup job {job['kind']} {job['job_id']} lỗi: {e}")
+
+    def _work(self):
+        while True:
+            try:
+                claimed = self.backend.dequeue(timeout=1.0)
+                if claimed is not None:
+                    self._run(*claimed)
+                self._maybe_purge()
+            except Exception as e:
+                app.logger.error(f"Job worker lỗi: {e}")
+                time.sleep(1)
+
+
+def _create_backend(name):
+    if name == 'sqlite':
+        return SQLiteJobBackend(app.config['JOB_SQLITE_PATH'], lease_timeout=app.config['JOB_LEASE_TIMEOUT'])
+    return InProcessJobBackend()
+
+
+job_runner = JobRunner(
+    _create_backend(app.config['JOB_BACKEND']),
+    workers=app.config['JOB_WORKERS'],
+    result_ttl=app.config['JOB_RESULT_TTL']
+)
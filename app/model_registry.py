@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+from app import app
+
+PENDING = 'pending'
+LOADING = 'loading'
+READY = 'ready'
+ERROR = 'error'
+
+
+class ModelRegistry:
+    """
+    Quản lý các model nặng (RAG, CNN): load ở thread nền sau khi app khởi động
+    hoặc lần đầu được gọi, để import app / phục vụ /login không phải chờ model
+    """
+
+    def __init__(self, retry_seconds=30):
+        self.retry_seconds = retry_seconds
+        self._factories = {}
+        self._instances = {}
+        self._states = {}
+        self._errors = {}
+        self._failed_at = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """
+        Process con sau fork (vd. gunicorn --preload import app ở master rồi mới fork worker):
+        thread load của process cha không sang theo nên model đang LOADING sẽ kẹt mãi -> load lại
+        """
+        self._lock = threading.Lock()
+        loading = [name for name, state in self._states.items() if state == LOADING]
+        for name in loading:
+            # Kết quả của thread cũ (nếu có) không còn hợp lệ
+            self._states[name] = PENDING
+            self._generations[name] += 1
+        if loading:
+            self.start_background(loading)
+
+    def register(self, name, factory):
+        """Đăng ký (hoặc thay) factory; kết quả của lần load dở với factory cũ sẽ bị bỏ"""
+        with self._lock:
+            self._factories[name] = factory
+            self._states[name] = PENDING
+            self._instances.pop(name, None)
+            self._errors.pop(name, None)
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def _load(self, name):
+        started = time.perf_counter()
+        with self._lock:
+            factory = self._factories[name]
+            generation = self._generations[name]
+        try:
+            instance = factory()
+        except Exception as e:
+            app.logger.error(f"Không thể khởi tạo model {name}: {e}")
+            with self._lock:
+                if self._generations[name] != generation:
+                    return
+                self._states[name] = ERROR
+                self._errors[name] = str(e)
+                self._failed_at[name] = time.monotonic()
+            return
+        with self._lock:
+            if self._generations[name] != generation:
+                return
+            self._instances[name] = instance
+            self._states[name] = READY
+            self._errors.pop(name, None)
+        app.logger.info(f"Model {name} sẵn sàng sau {time.perf_counter() - started:.1f}s")
+
+    def _start_loading(self, name):
+        """Chuyển sang LOADING và load ở thread nền; bỏ qua nếu đang load / đã xong"""
+        with self._lock:
+            state = self._states[name]
+            if state in (LOADING, READY):
+                return
+            if state == ERROR and time.monotonic() - self._failed_at[name] < self.retry_seconds:
+                return
+            self._states[name] = LOADING
+        threading.Thread(target=self._load, args=(name,), name=f"load-{name}", daemon=True).start()
+
+    def start_background(self, names=None):
+        for name in names or list(self._factories):
+            self._start_loading(name)
+
+    def get(self, name):
+        """Trả về model nếu đã sẵn sàng, nếu chưa thì kích hoạt load nền và trả về None"""
+        with self._lock:
+            instance = self._instances.get(name)
+        if instance is None:
+            self._start_loading(name)
+        return instance
+
+    def wait(self, name, timeout):
+        """Chờ model sẵn sàng tối đa timeout giây, chỉ dùng ở job nền (request thì dùng get)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            instance = self.get(name)
+            if instance is not None or self.state(name) == ERROR or time.monotonic() >= deadline:
+                return instance
+            time.sleep(0.5)
+
+    def state(self, name):
+        with self._lock:
+            return self._states[name]
+
+    def is_ready(self):
+        with self._lock:
+            return all(state == READY for state in self._states.values())
+
+    def status(self):
+        with self._lock:
+            return {
+                name: {'state': state, 'error': self._errors.get(name)}
+                for name, state in self._states.items()
+            }
+
+
+model_registry = ModelRegistry()
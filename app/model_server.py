@@ -0,0 +1,343 @@
+"""
+Model server: 1 process giữ RAGSystem + SkinDiseaseModel cho mọi gunicorn worker,
+thay vì mỗi worker tự load TensorFlow / sentence-transformers / LangChain.
+
+    MODEL_SERVING_MODE=server python -m app.model_server
+
+Web worker (MODEL_SERVING_MODE=server) dùng RemoteRAGSystem / RemoteSkinDiseaseModel qua
+model_registry, cùng interface với model trong process nên controller không cần biết.
+Request từ mọi worker đi chung vào MicroBatcher của CNN / embedding nên được gom batch;
+quá MODEL_SERVER_MAX_INFLIGHT request đồng thời thì server trả 'busy' để client lùi lại.
+
+Server và client xác thực bằng MODEL_SERVER_AUTHKEY (bắt buộc, không có mặc định), đặt cùng
+1 giá trị bí mật ở cả hai phía, vd. MODEL_SERVER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))").
+Connection dùng pickle nên ai có authkey là chạy được code trong process server / web worker.
+"""
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from queue import Empty, LifoQueue
+from types import SimpleNamespace
+
+from app import app
+from app.model_registry import model_registry, READY, ERROR
+from app.rag_history import ConversationRAGMixin
+
+
+class ModelServerError(Exception):
+    pass
+
+
+class ModelServerBusy(ModelServerError):
+    pass
+
+
+class ModelServerTimeout(ModelServerError):
+    pass
+
+
+def require_authkey(authkey):
+    if not authkey:
+        raise ModelServerError(
+            "Chưa đặt MODEL_SERVER_AUTHKEY: model server / client không chạy với authkey mặc định"
+        )
+    return authkey
+
+
+def parse_address(address):
+    """'host:port' -> TCP (host, port), còn lại là đường dẫn Unix socket"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return host or 'localhost', int(port)
+    return address
+
+
+class ModelServer:
+    def __init__(self, address, authkey, max_inflight=32):
+        self.address = parse_address(address)
+        self.authkey = require_authkey(authkey)
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._ops = {
+            'predict': ('cv_model', lambda cv, img_data: cv.predict(img_data)),
+            'predict_batch': ('cv_model', lambda cv, images, batch_size=32: cv.predict_batch(images, batch_size)),
+            'retrieve': ('rag_chatbot', lambda rag, query: rag.retrieve(query)),
+            'answer': ('rag_chatbot', lambda rag, *args: rag.answer(*args)),
+            'stream_answer': ('rag_chatbot', lambda rag, *args: rag.stream_answer(*args)),
+            'summarize': ('rag_chatbot', self._summarize),
+            'cache_stats': ('rag_chatbot', lambda rag: rag.cache_stats()),
+            'retrieval_stats': ('rag_chatbot', lambda rag: rag.retrieval_stats()),
+        }
+
+    @staticmethod
+    def _summarize(rag, previous_summary, messages):
+        # Client gửi (message_type, content) thay vì object ChatMessage của SQLAlchemy
+        return rag._summarize_history(previous_summary, [
+            SimpleNamespace(message_type=message_type, content=content)
+            for message_type, content in messages
+        ])
+
+    def serve_forever(self):
+        with Listener(self.address, authkey=self.authkey) as listener:
+            app.logger.info(f"Model server lắng nghe tại {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Sai authkey / client ngắt giữa chừng: bỏ qua connection đó
+                    app.logger.warning(f"Model server từ chối kết nối: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        """Mỗi connection 1 thread, xử lý tuần tự các request của connection đó"""
+        with conn:
+            while True:
+                try:
+                    op, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    self._dispatch(conn, op, args, kwargs)
+                except (EOFError, OSError):
+                    # Client đóng connection giữa lúc stream
+                    return
+
+    def _dispatch(self, conn, op, args, kwargs):
+        if op == 'status':
+            conn.send(('ok', model_registry.status()))
+            return
+        if op not in self._ops:
+            conn.send(('error', f"Không hỗ trợ thao tác {op}"))
+            return
+
+        if not self._slots.acquire(blocking=False):
+            conn.send(('busy', "Model server đang quá tải"))
+            return
+        try:
+            name, handler = self._ops[op]
+            model = model_registry.get(name)
+            if model is None:
+                conn.send(('error', f"Model {name} chưa sẵn sàng"))
+                return
+            try:
+                result = handler(model, *args, **kwargs)
+                if op != 'stream_answer':
+                    conn.send(('ok', result))
+                    return
+                for item in result:
+                    conn.send(('item', item))
+                conn.send(('end', None))
+            except (EOFError, OSError):
+                raise
+            except Exception as e:
+                app.logger.error(f"Model server lỗi khi xử lý {op}: {e}")
+                conn.send(('error', str(e)))
+        finally:
+            self._slots.release()
+
+
+class ModelServerClient:
+    """
+    Client dùng trong web worker. Connection không an toàn khi dùng chung giữa các thread
+    nên giữ 1 pool connection, mỗi request mượn 1 cái.
+    """
+
+    def __init__(self, address, authkey, pool_size=8, timeout=120, busy_retries=3, busy_backoff=0.05):
+        self.address = parse_address(address)
+        self.authkey = require_authkey(authkey)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self._pool = LifoQueue()
+
+    def _connect(self):
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except Exception as e:
+            raise ModelServerError(f"Không kết nối được model server {self.address}: {e}") from e
+
+    def _release(self, conn):
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(conn)
+        else:
+            conn.close()
+
+    def _recv(self, conn):
+        if not conn.poll(self.timeout):
+            conn.close()
+            raise ModelServerTimeout(f"Model server không phản hồi sau {self.timeout}s")
+        try:
+            return conn.recv()
+        except (EOFError, OSError) as e:
+            conn.close()
+            raise ModelServerError(f"Mất kết nối model server: {e}") from e
+
+    def _roundtrip(self, conn, request):
+        try:
+            conn.send(request)
+        except OSError as e:
+            conn.close()
+            raise ModelServerError(f"Mất kết nối model server: {e}") from e
+        return self._recv(conn)
+
+    def _open(self, op, args, kwargs):
+        """Gửi request, trả về (conn, status, value) của message trả lời đầu tiên"""
+        request = (op, args, kwargs)
+        for attempt in range(self.busy_retries + 1):
+            try:
+                conn, pooled = self._pool.get_nowait(), True
+            except Empty:
+                conn, pooled = self._connect(), False
+            try:
+                status, value = self._roundtrip(conn, request)
+            except ModelServerTimeout:
+                raise
+            except ModelServerError:
+                if not pooled:
+                    raise
+                # Connection cũ trong pool đã chết (server restart) -> thử bằng connection mới
+                conn = self._connect()
+                status, value = self._roundtrip(conn, request)
+
+            if status != 'busy':
+                return conn, status, value
+            self._release(conn)
+            time.sleep(self.busy_backoff * (2 ** attempt))
+        raise ModelServerBusy(value)
+
+    def call(self, op, *args, **kwargs):
+        conn, status, value = self._open(op, args, kwargs)
+        self._release(conn)
+        if status == 'error':
+            raise ModelServerError(value)
+        return value
+
+    def stream(self, op, *args, **kwargs):
+        conn, status, value = self._open(op, args, kwargs)
+        finished = False
+        try:
+            while status == 'item':
+                yield value
+                status, value = self._recv(conn)
+            finished = True
+        finally:
+            # Dừng giữa chừng (client SSE ngắt) thì connection còn message chưa đọc -> bỏ
+            if finished:
+                self._release(conn)
+            else:
+                conn.close()
+        if status == 'error':
+            raise ModelServerError(value)
+
+
+class RemoteSkinDiseaseModel:
+    """Cùng interface predict / predict_batch với SkinDiseaseModel"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def predict(self, img_data):
+        try:
+            return self.client.call('predict', img_data)
+        except ModelServerError as e:
+            app.logger.error(f"Lỗi dự đoán: {e}")
+            return None, 0.0, None
+
+    def predict_batch(self, images, batch_size=32):
+        images = [img if isinstance(img, bytes) else img.read() for img in images]
+        return self.client.call('predict_batch', images, batch_size=batch_size)
+
+
+class RemoteRAGSystem(ConversationRAGMixin):
+    """
+    Cùng interface với RAGSystem. Lịch sử hội thoại vẫn đọc từ DB ở web worker
+    (ConversationRAGMixin), chỉ phần embed / retrieve / LLM chạy ở model server.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def retrieve(self, query):
+        try:
+            return self.client.call('retrieve', query)
+        except ModelServerError as e:
+            app.logger.error(f"RAG retrieve error: {e}")
+            return None
+
+    def answer(self, query, chat_history, context_docs=None):
+        return self.client.call('answer', query, chat_history, context_docs)
+
+    def stream_answer(self, query, chat_history, context_docs=None):
+        yield from self.client.stream('stream_answer', query, chat_history, context_docs)
+
+    def _summarize_history(self, previous_summary, messages):
+        return self.client.call(
+            'summarize', previous_summary, [(msg.message_type, msg.content) for msg in messages]
+        )
+
+    def cache_stats(self):
+        return self.client.call('cache_stats')
+
+    def retrieval_stats(self):
+        return self.client.call('retrieval_stats')
+
+
+def _make_client():
+    return ModelServerClient(
+        app.config['MODEL_SERVER_ADDRESS'],
+        app.config['MODEL_SERVER_AUTHKEY'],
+        pool_size=app.config['MODEL_SERVER_POOL_SIZE'],
+        timeout=app.config['MODEL_SERVER_TIMEOUT']
+    )
+
+
+def wait_until_ready(client, name, timeout):
+    """
+    Chờ model server load xong model name. Trong lúc chờ, model_registry của web worker
+    vẫn ở trạng thái LOADING nên controller trả 503 "đang khởi động" như chế độ in-process.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            status = client.call('status').get(name, {})
+        except ModelServerError:
+            status = {}
+        if status.get('state') == READY:
+            return
+        if status.get('state') == ERROR:
+            raise ModelServerError(f"Model server không load được {name}: {status.get('error')}")
+        if time.monotonic() > deadline:
+            raise ModelServerError(f"Hết thời gian chờ model server load {name}")
+        time.sleep(1)
+
+
+def connect_rag_chatbot():
+    client = _make_client()
+    wait_until_ready(client, 'rag_chatbot', app.config['MODEL_SERVER_STARTUP_TIMEOUT'])
+    return RemoteRAGSystem(client)
+
+
+def connect_cv_model():
+    client = _make_client()
+    wait_until_ready(client, 'cv_model', app.config['MODEL_SERVER_STARTUP_TIMEOUT'])
+    return RemoteSkinDiseaseModel(client)
+
+
+def main():
+    from app import register_models
+
+    # Kiểm tra trước khi load model để thiếu authkey thì dừng ngay
+    require_authkey(app.config['MODEL_SERVER_AUTHKEY'])
+    # Process này mới là nơi giữ model thật, kể cả khi .env đặt MODEL_SERVING_MODE=server
+    register_models('inprocess')
+    model_registry.start_background()
+    ModelServer(
+        app.config['MODEL_SERVER_ADDRESS'],
+        app.config['MODEL_SERVER_AUTHKEY'],
+        max_inflight=app.config['MODEL_SERVER_MAX_INFLIGHT']
+    ).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
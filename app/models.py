@@ -103,6 +103,10 @@ class CVPrediction(db.Model):
 
 class ChatConversation(BaseModel):
     __tablename__ = 'chatconversation'
+    __table_args__ = (
+        # Danh sách hội thoại của user, phân trang theo (created_at, id)
+        db.Index('ix_chatconversation_user_created', 'user_id', 'created_at', 'conversation_id'),
+    )
 
     conversation_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
@@ -111,12 +115,21 @@ class ChatConversation(BaseModel):
         nullable=False
     )
     title = db.Column(db.String(255), nullable=False, default="Cuộc trò chuyện mới")
+    # Tóm tắt cuốn chiếu các tin nhắn đã ra khỏi cửa sổ lịch sử gửi cho LLM
+    summary = db.Column(db.Text)
+    summary_message_id = db.Column(db.Integer)  # message_id cuối cùng đã gộp vào summary
 
     messages = db.relationship('ChatMessage', backref='conversation', cascade='all, delete')
 
 
 class ChatMessage(BaseModel):
     __tablename__ = 'chatmessage'
+    __table_args__ = (
+        # Tin nhắn của 1 hội thoại, phân trang theo (timestamp, id)
+        db.Index('ix_chatmessage_conversation_timestamp', 'conversation_id', 'timestamp', 'message_id'),
+        # Mỗi lần gửi của client có tối đa 1 tin user + 1 tin bot, gửi lại (retry) không tạo trùng
+        db.UniqueConstraint('user_id', 'client_request_id', 'message_type', name='uq_chatmessage_client_request'),
+    )
 
     message_id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(
@@ -137,6 +150,7 @@ class ChatMessage(BaseModel):
     has_image = db.Column(db.Boolean, default=False)
     image_url = db.Column(db.String(500))  # URL ảnh từ cloudinary
     is_html = db.Column(db.Boolean, default=False)  # Đánh dấu nội dung có chứa HTML
+    client_request_id = db.Column(db.String(64))  # Id do client sinh cho mỗi lần gửi tin nhắn
 
 
 class PostImage(db.Model):
@@ -151,12 +165,19 @@ class PostImage(db.Model):
 
 class Post(BaseModel):
     __tablename__ = 'post'
+    __table_args__ = (
+        db.Index('ix_post_created', 'created_at', 'post_id'),
+        db.Index('ix_post_user_created', 'user_id', 'created_at'),
+    )
 
     post_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text, nullable=False)
     is_public = db.Column(db.Boolean, default=True)
+    # Đếm sẵn, cập nhật bằng UPDATE ... SET x = x +/- 1 trong cùng transaction với Like/Comment
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     user = db.relationship('User', backref='posts')
     comments = db.relationship('Comment', backref='post', cascade='all, delete')
@@ -165,6 +186,9 @@ class Post(BaseModel):
 
 class Comment(BaseModel):
     __tablename__ = 'comment'
+    __table_args__ = (
+        db.Index('ix_comment_post_created', 'post_id', 'created_at', 'comment_id'),
+    )
 
     comment_id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.post_id', ondelete='CASCADE'))
@@ -175,6 +199,10 @@ class Comment(BaseModel):
 
 class Like(BaseModel):
     __tablename__ = 'like'
+    __table_args__ = (
+        db.UniqueConstraint('post_id', 'user_id', name='uq_like_post_user'),
+        db.Index('ix_like_user_post', 'user_id', 'post_id'),
+    )
 
     like_id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.post_id', ondelete='CASCADE'))
@@ -183,6 +211,11 @@ class Like(BaseModel):
 
 class Follow(BaseModel):
     __tablename__ = 'follow'
+    __table_args__ = (
+        # "A có follow B không" / danh sách đang follow, và chiều ngược lại: người follow B
+        db.Index('ix_follow_follower_followed', 'follower_id', 'followed_id'),
+        db.Index('ix_follow_followed_follower', 'followed_id', 'follower_id'),
+    )
 
     follow_id = db.Column(db.Integer, primary_key=True)
     follower_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'))
@@ -0,0 +1,74 @@
+"""
+Hash / kiểm tra mật khẩu bằng KDF chậm của werkzeug (scrypt hoặc pbkdf2), thay cho MD5.
+
+- Thuật toán + cost cấu hình bằng PASSWORD_HASH_METHOD (vd. "scrypt:32768:8:1",
+  "pbkdf2:sha256:600000"); hash cũ (MD5 hoặc cost khác) được hash lại khi user đăng nhập.
+- Việc hash chạy trên thread pool giới hạn: hashlib.scrypt / pbkdf2 nhả GIL nên các
+  request khác vẫn chạy, và 1 đợt login dồn dập chỉ chiếm tối đa PASSWORD_HASH_WORKERS
+  CPU; quá PASSWORD_HASH_QUEUE request chờ thì báo bận thay vì xếp hàng vô hạn.
+"""
+import hashlib
+import hmac
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import app
+
+_LEGACY_MD5 = re.compile(r'^[0-9a-f]{32}$')
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def is_legacy_md5(stored_hash):
+    return bool(stored_hash) and _LEGACY_MD5.match(stored_hash) is not None
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', max_workers=4, max_pending=64, timeout=10):
+        self.method = method
+        self.timeout = timeout
+        # Prefix thực tế werkzeug ghi vào hash (vd. "scrypt" -> "scrypt:32768:8:1")
+        self.prefix = generate_password_hash('', method).split('$', 1)[0]
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusy("Quá nhiều yêu cầu đăng nhập đang chờ")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password.strip(), self.method)
+
+    def verify(self, stored_hash, password):
+        if not stored_hash or password is None:
+            return False
+        if is_legacy_md5(stored_hash):
+            # Trước đây lúc tạo thì strip, lúc kiểm tra thì không -> chấp nhận cả 2
+            return any(
+                hmac.compare_digest(hashlib.md5(candidate.encode('utf-8')).hexdigest(), stored_hash)
+                for candidate in {password, password.strip()}
+            )
+        return self._run(check_password_hash, stored_hash, password.strip())
+
+    def needs_rehash(self, stored_hash):
+        return is_legacy_md5(stored_hash) or stored_hash.split('$', 1)[0] != self.prefix
+
+
+password_hasher = PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    max_workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_QUEUE'],
+    timeout=app.config['PASSWORD_HASH_TIMEOUT']
+)
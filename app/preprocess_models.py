@@ -1,67 +1,35 @@
+"""
+Sinh bài viết phổ thông cho từng bệnh da liễu bằng LLM (OpenRouter), ghi thẳng vào file tổng.
+
+Chạy song song có giới hạn (token bucket theo số request/giây, retry + backoff khi gặp 429),
+bệnh đã xong được ghi vào file checkpoint nên chạy lại sẽ tiếp tục từ chỗ dừng.
+
+    python app/preprocess_models.py --concurrency 8 --rate 2
+    python app/preprocess_models.py --base-url http://localhost:8000/v1   # server giả để test
+"""
+import argparse
 import os
-import math
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 load_dotenv()
 
 INPUT_CSV = "dalieu_articles.csv"
 TITLE_COLUMN = "title"
 OUTPUT_DIR = "./output_benh_da_lieu"
-BATCH_SIZE = 20
+MERGED_FILENAME = "benh_da_lieu_ai_full.txt"
+CHECKPOINT_FILENAME = "benh_da_lieu_ai_done.txt"
 API_KEY = os.getenv("OPENAI_API_KEY_CRAWLER")
 MODEL = "openai/gpt-oss-20b:free"
+BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-
-#Đọc bệnh
-df = pd.read_csv(INPUT_CSV)
-if TITLE_COLUMN not in df.columns:
-    raise ValueError(f"Không tìm thấy cột '{TITLE_COLUMN}' trong file CSV!")
-
-diseases = df[TITLE_COLUMN].dropna().tolist()
-print(f"Tổng số bệnh nhận diện được: {len(diseases)}")
-total_parts = math.ceil(len(diseases) / BATCH_SIZE)
-print(f"Sẽ chia thành {total_parts} phần (~{BATCH_SIZE} bệnh/phần)")
-
-
-# Này để gọi model
-def call_openrouter(prompt: str) -> str:
-    try:
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "HTTP-Referer": "http://localhost",
-            "X-Title": "BenhDaLieuGenerator",
-            "Content-Type": "application/json",
-        }
-        data = {
-            "model": MODEL,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7,
-            "max_tokens": 2000,
-        }
-        resp = requests.post("https://openrouter.ai/api/v1/chat/completions", json=data, headers=headers)
-        if resp.status_code != 200:
-            return f"[Lỗi API: {resp.status_code}] {resp.text[:200]}"
-        return resp.json()["choices"][0]["message"]["content"].strip()
-    except Exception as e:
-        return f"[Lỗi khi gọi API: {e}]"
-
-
-#Generate nội dung
-for part in range(total_parts):
-    start = part * BATCH_SIZE
-    end = min((part + 1) * BATCH_SIZE, len(diseases))
-    sublist = diseases[start:end]
-    full_text = ""
-
-    print(f"\nĐang xử lý phần {part + 1}/{total_parts} ({start + 1}–{end}) ...")
-
-    for i, name in enumerate(sublist, 1):
-        print(f" Bệnh {start + i}: {name}")
-        prompt = f"""
+PROMPT_TEMPLATE = """
         Viết bài phổ thông, dễ hiểu, theo Tây y, cho bệnh: {name}.
         Cấu trúc gồm 3 phần:
         1. Lý thuyết về bệnh (nguyên nhân, yếu tố nguy cơ, cơ chế bệnh sinh, dịch tễ học).
@@ -70,26 +38,171 @@ for part in range(total_parts):
         Trình bày bằng tiếng Việt, mỗi phần khoảng 2–3 đoạn, dễ đọc, dễ hiểu.
         """
 
-        content = call_openrouter(prompt)
-        full_text += f"\n=============================\nTên bệnh: {name}\n{content}\n"
 
-        time.sleep(2)  #sleep để tránh bị giới hạn
+class RateLimitError(Exception):
+    pass
+
 
-    # Lưu từng phần
-    part_file = os.path.join(OUTPUT_DIR, f"benh_da_lieu_ai_part{part+1}.txt")
-    with open(part_file, "w", encoding="utf-8") as f:
-        f.write(full_text)
-    print(f"Đã lưu {part_file}")
+class TokenBucket:
+    """Cho phép trung bình rate request/giây, dồn tối đa capacity request liền nhau"""
 
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
 
-#Gộp file lại
-merged_file = os.path.join(OUTPUT_DIR, "benh_da_lieu_ai_full.txt")
-with open(merged_file, "w", encoding="utf-8") as f_out:
-    for i in range(total_parts):
-        part_file = os.path.join(OUTPUT_DIR, f"benh_da_lieu_ai_part{i+1}.txt")
-        if os.path.exists(part_file):
-            with open(part_file, "r", encoding="utf-8") as f_in:
-                f_out.write(f_in.read())
-                f_out.write("\n\n")
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_s = (1 - self._tokens) / self.rate
+            time.sleep(wait_s)
 
-print(f"\n Hoàn tất! File tổng hợp: {merged_file}")
+
+#Đọc bệnh
+def load_diseases(input_csv, title_column):
+    df = pd.read_csv(input_csv)
+    if title_column not in df.columns:
+        raise ValueError(f"Không tìm thấy cột '{title_column}' trong file CSV!")
+    # Bỏ trùng nhưng giữ thứ tự
+    return list(dict.fromkeys(df[title_column].dropna().astype(str).str.strip()))
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _retry_after(resp, attempt, backoff):
+    """Ưu tiên header Retry-After (giây), nếu không có thì backoff lũy thừa + jitter"""
+    header = resp.headers.get("Retry-After") if resp is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt) + random.uniform(0, backoff)
+
+
+# Này để gọi model
+def call_openrouter(session, prompt, bucket, base_url=BASE_URL, api_key=API_KEY, model=MODEL,
+                    max_retries=5, backoff=1.0, timeout=120):
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "HTTP-Referer": "http://localhost",
+        "X-Title": "BenhDaLieuGenerator",
+        "Content-Type": "application/json",
+    }
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.7,
+        "max_tokens": 2000,
+    }
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        resp = None
+        try:
+            resp = session.post(f"{base_url.rstrip('/')}/chat/completions", json=data, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            error = f"[Lỗi khi gọi API: {e}]"
+        else:
+            if resp.status_code == 200:
+                return resp.json()["choices"][0]["message"]["content"].strip()
+            error = f"[Lỗi API: {resp.status_code}] {resp.text[:200]}"
+            # Lỗi phía client khác 429 thì thử lại cũng vô ích
+            if resp.status_code != 429 and resp.status_code < 500:
+                raise RuntimeError(error)
+        if attempt < max_retries:
+            time.sleep(_retry_after(resp, attempt, backoff))
+    if resp is not None and resp.status_code == 429:
+        raise RateLimitError(error)
+    raise RuntimeError(error)
+
+
+def generate_all(diseases, output_path, checkpoint_path, concurrency=4, rate=1.0, **call_kwargs):
+    """
+    Sinh bài cho các bệnh chưa có trong checkpoint. Mỗi bài xong được append ngay vào
+    output_path rồi mới ghi tên bệnh vào checkpoint. Trả về (số bài xong, list bệnh lỗi).
+    """
+    done = load_checkpoint(checkpoint_path)
+    todo = [name for name in diseases if name not in done]
+    print(f"Tổng số bệnh: {len(diseases)}, đã xong: {len(diseases) - len(todo)}, cần sinh: {len(todo)}")
+
+    bucket = TokenBucket(rate)
+    session = make_session(concurrency)
+    failed = []
+    finished = 0
+
+    with open(output_path, "a", encoding="utf-8") as f_out, \
+            open(checkpoint_path, "a", encoding="utf-8") as f_done, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(call_openrouter, session, PROMPT_TEMPLATE.format(name=name), bucket, **call_kwargs): name
+            for name in todo
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                failed.append(name)
+                print(f" Lỗi với bệnh {name}: {e}")
+                continue
+            # Chỉ thread chính ghi file nên không cần lock
+            f_out.write(f"\n=============================\nTên bệnh: {name}\n{content}\n")
+            f_out.flush()
+            f_done.write(name + "\n")
+            f_done.flush()
+            finished += 1
+            print(f" [{finished}/{len(todo)}] Xong: {name}")
+
+    return finished, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh bài viết bệnh da liễu bằng LLM")
+    parser.add_argument("--input-csv", default=INPUT_CSV)
+    parser.add_argument("--title-column", default=TITLE_COLUMN)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--concurrency", type=int, default=4, help="Số request chạy đồng thời")
+    parser.add_argument("--rate", type=float, default=1.0, help="Số request/giây tối đa")
+    parser.add_argument("--max-retries", type=int, default=5)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    diseases = load_diseases(args.input_csv, args.title_column)
+    merged_file = os.path.join(args.output_dir, MERGED_FILENAME)
+
+    started = time.perf_counter()
+    finished, failed = generate_all(
+        diseases, merged_file, os.path.join(args.output_dir, CHECKPOINT_FILENAME),
+        concurrency=args.concurrency, rate=args.rate,
+        base_url=args.base_url, model=args.model, max_retries=args.max_retries
+    )
+    print(f"\n Hoàn tất {finished} bài trong {time.perf_counter() - started:.1f}s. File tổng hợp: {merged_file}")
+    if failed:
+        print(f" {len(failed)} bệnh lỗi, chạy lại lệnh để thử tiếp: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CacheBackend:
+    """
+    Nơi lưu các entry của SemanticCache. Mỗi entry là dict
+    {'vector': np.ndarray (đã chuẩn hóa), 'answer': str, 'created_at': float}
+    """
+
+    def items(self):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, entry):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Backend mặc định: LRU trong process, giới hạn max_entries"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SemanticCache:
+    """
+    Cache câu trả lời theo embedding của câu hỏi: câu hỏi mới có cosine similarity
+    >= threshold với 1 câu đã trả lời (và chưa hết ttl) sẽ dùng lại câu trả lời cũ
+    """
+
+    def __init__(self, backend=None, threshold=0.95, ttl=3600):
+        self.backend = backend if backend is not None else InMemoryCacheBackend()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.version = None
+        self._version_synced = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, vector):
+        """Trả về câu trả lời đã cache gần nhất với vector, hoặc None"""
+        query = self._normalize(vector)
+        now = time.time()
+
+        keys, vectors = [], []
+        for key, entry in self.backend.items():
+            if now - entry['created_at'] > self.ttl:
+                self.backend.delete(key)
+                continue
+            keys.append(key)
+            vectors.append(entry['vector'])
+
+        if vectors:
+            scores = np.stack(vectors) @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                # get() để backend cập nhật thứ tự LRU
+                entry = self.backend.get(keys[best])
+                if entry is not None:
+                    self._count(True)
+                    return entry['answer']
+
+        self._count(False)
+        return None
+
+    def store(self, vector, answer):
+        self.backend.put(uuid.uuid4().hex, {
+            'vector': self._normalize(vector),
+            'answer': answer,
+            'created_at': time.time(),
+        })
+
+    def sync_version(self, version):
+        """Xóa cache khi collection trong vector DB thay đổi (version khác lần trước)"""
+        with self._lock:
+            changed = self._version_synced and version != self.version
+            self.version = version
+            self._version_synced = True
+        if changed:
+            self.invalidate()
+
+    def invalidate(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': len(self.backend),
+        }
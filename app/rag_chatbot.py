@@ -1,19 +1,35 @@
 import os
+import time
+from werkzeug.utils import import_string
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_qdrant import QdrantVectorStore
 from langchain_community.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.messages import HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
+from sentence_transformers import CrossEncoder
 from app import app
+from app.rag_rerank import RerankRetriever
+from app.rag_cache import SemanticCache, InMemoryCacheBackend
+from app.rag_embeddings import CachedEmbeddings, MicroBatchEmbeddings
+from app.rag_history import ConversationRAGMixin
+from app.rag_utils import EMBEDDING_MODEL_NAME, read_ingest_version
 
 
-class RAGSystem:
+class RAGSystem(ConversationRAGMixin):
     def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="dangvantuan/vietnamese-embedding"
+        embedding_model_name = EMBEDDING_MODEL_NAME
+        # Qdrant store dùng embeddings đã bọc cache + micro-batch nên không cần đổi gì thêm
+        self.embeddings = CachedEmbeddings(
+            MicroBatchEmbeddings(
+                HuggingFaceEmbeddings(model_name=embedding_model_name),
+                max_batch_size=app.config['EMBEDDING_BATCH_MAX_SIZE'],
+                max_wait_ms=app.config['EMBEDDING_BATCH_WAIT_MS']
+            ),
+            max_entries=app.config['EMBEDDING_CACHE_SIZE'],
+            cache_path=app.config['EMBEDDING_CACHE_PATH'],
+            namespace=embedding_model_name
         )
         self.docsearch = QdrantVectorStore.from_existing_collection(
             embedding=self.embeddings,
@@ -23,8 +39,15 @@ class RAGSystem:
         )
         self.retriever = self.docsearch.as_retriever(
             search_type="similarity",
-            search_kwargs={"k": 40}
+            search_kwargs={"k": app.config['RAG_CANDIDATE_K']}
         )
+        if app.config['RAG_RERANK_ENABLED'] and app.config['MODEL_CROSS_ENCODER_NAME']:
+            self.retriever = RerankRetriever(
+                base_retriever=self.retriever,
+                reranker=CrossEncoder(app.config['MODEL_CROSS_ENCODER_NAME']),
+                top_n=app.config['RAG_RERANK_TOP_N'],
+                token_budget=app.config['RAG_CONTEXT_TOKEN_BUDGET']
+            )
         self.llm = ChatOpenAI(
             model=app.config['MODEL_LLM_NAME'],
             openai_api_key=app.config['OPENAI_API_KEY'],
@@ -51,72 +74,170 @@ class RAGSystem:
             ("human", "{input}")
         ])
 
-    def _get_conversation_messages(self, conversation_id):
-        """
-        Lấy lịch sử hội thoại và chuyển đổi sang định dạng LangChain messages
-        """
-        from app.models import ChatMessage
-
-        messages = ChatMessage.query.filter_by(
-            conversation_id=conversation_id
-        ).order_by(ChatMessage.timestamp.asc()).all()
-
-        # Chuyển đổi sang định dạng LangChain messages
-        langchain_messages = []
-        for msg in messages:
-            if msg.message_type == "user":
-                langchain_messages.append(HumanMessage(content=msg.content))
-            elif msg.message_type == "bot":
-                langchain_messages.append(AIMessage(content=msg.content))
+        # Chain chỉ phụ thuộc retriever/llm/prompt nên build 1 lần cho cả process,
+        # mỗi request chỉ truyền input + chat_history
+        self.question_answer_chain = create_stuff_documents_chain(
+            self.llm,
+            self.prompt
+        )
+        self.rag_chain = create_retrieval_chain(
+            self.retriever,
+            self.question_answer_chain
+        )
 
-        return langchain_messages
+        self.answer_cache = self._build_answer_cache() if app.config['RAG_CACHE_ENABLED'] else None
+        self._cache_version_checked_at = 0.0
+
+    def _build_answer_cache(self):
+        if app.config['RAG_CACHE_BACKEND']:
+            backend = import_string(app.config['RAG_CACHE_BACKEND'])()
+        else:
+            backend = InMemoryCacheBackend(max_entries=app.config['RAG_CACHE_MAX_ENTRIES'])
+        return SemanticCache(
+            backend=backend,
+            threshold=app.config['RAG_CACHE_THRESHOLD'],
+            ttl=app.config['RAG_CACHE_TTL']
+        )
 
-    def get_rag_response(self, query, conversation_id):
+    def _sync_cache_version(self):
         """
-        Lấy response từ RAG cho 1 conversation_id
+        Đọc version mà app.ingest đặt cho collection, tối đa 1 lần / RAG_CACHE_VERSION_CHECK_SECONDS
         """
+        now = time.monotonic()
+        if now - self._cache_version_checked_at < app.config['RAG_CACHE_VERSION_CHECK_SECONDS']:
+            return
+        self._cache_version_checked_at = now
         try:
-            # 1. Lấy lịch sử chat từ DB cho conversation
-            chat_history = self._get_conversation_messages(conversation_id)
-
-            # 2. Tạo memory đúng cách - KHÔNG truyền chat_history vào constructor
-            memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True
+            self.answer_cache.sync_version(
+                read_ingest_version(self.docsearch.client, app.config['COLLECTION_NAME'])
             )
+        except Exception as e:
+            app.logger.warning(f"Không lấy được version collection cho cache: {e}")
 
-            # 3. Thêm tin nhắn vào memory thủ công
-            for message in chat_history:
-                if isinstance(message, HumanMessage):
-                    memory.chat_memory.add_user_message(message.content)
-                elif isinstance(message, AIMessage):
-                    memory.chat_memory.add_ai_message(message.content)
-
-            # 4. Tạo chain
-            question_answer_chain = create_stuff_documents_chain(
-                self.llm,
-                self.prompt
-            )
-            rag_chain = create_retrieval_chain(
-                self.retriever,
-                question_answer_chain
-            )
+    def cache_stats(self):
+        """
+        Hit/miss của semantic cache (None nếu cache tắt)
+        """
+        return self.answer_cache.stats() if self.answer_cache else None
 
-            # 5. Tạo input với chat_history từ memory
-            inputs = {
-                "input": query,
-                "chat_history": memory.chat_memory.messages
-            }
+    def retrieval_stats(self):
+        """
+        Thống kê token của bước rerank (None nếu đang dùng retriever thường)
+        """
+        if isinstance(self.retriever, RerankRetriever):
+            return self.retriever.stats()
+        return None
 
-            # 6. Lấy response
-            response = rag_chain.invoke(inputs)
-            answer = response.get('answer', 'Xin lỗi, tôi không thể trả lời câu hỏi này.')
+    def _summarize_history(self, previous_summary, messages):
+        """
+        Gộp tóm tắt cũ + các tin nhắn mới rơi khỏi cửa sổ thành tóm tắt mới
+        """
+        lines = []
+        for msg in messages:
+            speaker = "Người dùng" if msg.message_type == "user" else "Trợ lý"
+            lines.append(f"{speaker}: {msg.content}")
+
+        prompt = (
+            "Tóm tắt ngắn gọn (tối đa 5 câu, tiếng Việt) cuộc trò chuyện tư vấn da liễu sau, "
+            "giữ lại triệu chứng, chẩn đoán và lời khuyên quan trọng.\n"
+            f"Tóm tắt trước đó: {previous_summary or '(chưa có)'}\n"
+            "Tin nhắn mới:\n" + "\n".join(lines)
+        )
+        return self.llm.invoke(prompt).content.strip()
 
-            return answer
+    @staticmethod
+    def _has_prior_turns(chat_history):
+        """
+        Lịch sử có gì ngoài tin nhắn hiện tại của user (đã lưu trước khi gọi LLM) không.
+        Tóm tắt hội thoại cũng tính là có lượt trước.
+        """
+        if not chat_history:
+            return False
+        return len(chat_history) > 1 or not isinstance(chat_history[-1], HumanMessage)
 
+    def _lookup_cache(self, query, chat_history):
+        """
+        Trả về (câu trả lời đã cache hoặc None, vector câu hỏi để lưu cache sau, hoặc None).
+        Cache dùng chung cho mọi user nên chỉ dùng khi câu trả lời không phụ thuộc lượt trước
+        (câu hỏi mở đầu hội thoại), tránh lộ nội dung hội thoại của người này sang người khác
+        """
+        if not self.answer_cache or self._has_prior_turns(chat_history):
+            return None, None
+        self._sync_cache_version()
+        query_vector = self.embeddings.embed_query(query)
+        return self.answer_cache.lookup(query_vector), query_vector
+
+    def retrieve(self, query):
+        """
+        Chỉ chạy bước retrieve (embed + Qdrant + rerank) để có thể chạy song song với
+        các bước khác, kết quả truyền lại qua context_docs. Lỗi thì trả về None.
+        """
+        try:
+            return self.retriever.invoke(query)
         except Exception as e:
-            app.logger.error(f"RAG System Error: {e}")
-            return "Xin lỗi, có lỗi xảy ra khi xử lý yêu cầu của bạn. Vui lòng thử lại."
+            app.logger.error(f"RAG retrieve error: {e}")
+            return None
+
+    def _invoke_chain(self, query, chat_history, context_docs):
+        inputs = {"input": query, "chat_history": chat_history}
+        if context_docs is None:
+            return self.rag_chain.invoke(inputs).get('answer')
+        return self.question_answer_chain.invoke({**inputs, "context": context_docs})
+
+    def _stream_chain(self, query, chat_history, context_docs):
+        """Chuẩn hóa output stream của 2 chain về các chunk dạng dict như rag_chain"""
+        inputs = {"input": query, "chat_history": chat_history}
+        if context_docs is None:
+            yield from self.rag_chain.stream(inputs)
+            return
+        yield {'context': context_docs}
+        for token in self.question_answer_chain.stream({**inputs, "context": context_docs}):
+            yield {'answer': token}
+
+    def answer(self, query, chat_history, context_docs=None):
+        """
+        Trả lời query với chat_history (LangChain messages) đã có sẵn, không đọc DB.
+        context_docs: tài liệu đã retrieve sẵn (bỏ qua bước retrieve của chain)
+        """
+        # Câu hỏi gần giống câu đã trả lời (lịch sử ngắn) -> lấy từ semantic cache
+        cached_answer, query_vector = self._lookup_cache(query, chat_history)
+        if cached_answer is not None:
+            return cached_answer
 
+        answer = self._invoke_chain(query, chat_history, context_docs)
+        if not answer:
+            return 'Xin lỗi, tôi không thể trả lời câu hỏi này.'
 
-rag_chatbot = RAGSystem()
\ No newline at end of file
+        if query_vector is not None:
+            self.answer_cache.store(query_vector, answer)
+
+        return answer
+
+    def stream_answer(self, query, chat_history, context_docs=None):
+        """
+        Giống answer nhưng stream: yield ('sources', docs), các ('token', text)
+        của LLM, cuối cùng là ('answer', toàn bộ câu trả lời)
+        """
+        cached_answer, query_vector = self._lookup_cache(query, chat_history)
+        if cached_answer is not None:
+            yield 'sources', []
+            yield 'token', cached_answer
+            yield 'answer', cached_answer
+            return
+
+        parts = []
+        for chunk in self._stream_chain(query, chat_history, context_docs):
+            if 'context' in chunk:
+                yield 'sources', chunk['context']
+            if chunk.get('answer'):
+                parts.append(chunk['answer'])
+                yield 'token', chunk['answer']
+
+        answer = "".join(parts)
+        if not answer:
+            answer = 'Xin lỗi, tôi không thể trả lời câu hỏi này.'
+            yield 'token', answer
+        elif query_vector is not None:
+            self.answer_cache.store(query_vector, answer)
+
+        yield 'answer', answer
@@ -0,0 +1,120 @@
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.batching import MicroBatcher
+
+
+def normalize_text(text):
+    """Chuẩn hóa unicode (NFC) + khoảng trắng để cùng 1 câu hỏi luôn ra cùng 1 key"""
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc 1 Embeddings khác: LRU trong RAM (max_entries) + tầng SQLite trên đĩa (tùy chọn)
+    """
+
+    def __init__(self, inner, max_entries=4096, cache_path=None, namespace="default"):
+        self.inner = inner
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if cache_path:
+            self._disk = sqlite3.connect(cache_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "namespace TEXT NOT NULL, text_key TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (namespace, text_key))"
+            )
+            self._disk.commit()
+
+    def _get(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT vector FROM embedding_cache WHERE namespace = ? AND text_key = ?",
+                    (self.namespace, key)
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._remember(key, vector)
+                    self.hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _put_many(self, pairs):
+        with self._lock:
+            for key, vector in pairs:
+                self._remember(key, vector)
+            if self._disk is not None:
+                self._disk.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (namespace, text_key, vector) VALUES (?, ?, ?)",
+                    [(self.namespace, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in pairs]
+                )
+                self._disk.commit()
+
+    def embed_query(self, text):
+        key = normalize_text(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.inner.embed_query(key)
+            self._put_many([(key, vector)])
+        return vector
+
+    def embed_documents(self, texts):
+        keys = [normalize_text(text) for text in texts]
+        vectors = [self._get(key) for key in keys]
+        missing = sorted({key for key, vector in zip(keys, vectors) if vector is None})
+        if missing:
+            computed = dict(zip(missing, self.inner.embed_documents(missing)))
+            self._put_many(list(computed.items()))
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._memory)}
+
+
+class MicroBatchEmbeddings(Embeddings):
+    """
+    Gom embed_query của các request đồng thời thành 1 lần embed_documents (1 forward pass)
+    """
+
+    def __init__(self, inner, max_batch_size=32, max_wait_ms=5):
+        self.inner = inner
+        self._batcher = MicroBatcher(
+            inner.embed_documents,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name="embedding-batcher"
+        )
+
+    def embed_query(self, text):
+        return self._batcher.submit(text)
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
@@ -0,0 +1,187 @@
+from types import SimpleNamespace
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from app import app
+from app.extensions import db
+from app.models import ChatConversation, ChatMessage
+from app.rag_utils import estimate_tokens
+
+
+def to_langchain_message(msg):
+    if msg.message_type == "user":
+        return HumanMessage(content=msg.content)
+    if msg.message_type == "bot":
+        return AIMessage(content=msg.content)
+    return None
+
+
+def load_recent_messages(conversation_id, max_messages, token_budget):
+    """
+    Lấy tối đa max_messages tin nhắn mới nhất rồi cắt tiếp từ cũ -> mới cho vừa token_budget.
+    Trả về list ChatMessage theo thứ tự thời gian tăng dần.
+    """
+    recent = ChatMessage.query.filter_by(
+        conversation_id=conversation_id
+    ).order_by(
+        ChatMessage.timestamp.desc(), ChatMessage.message_id.desc()
+    ).limit(max_messages).all()
+
+    kept = []
+    used = 0
+    for msg in recent:
+        tokens = estimate_tokens(msg.content)
+        if kept and used + tokens > token_budget:
+            break
+        kept.append(msg)
+        used += tokens
+
+    kept.reverse()
+    return kept
+
+
+def _pending_filter(conversation_id, summary_message_id, first_kept_id):
+    # Tin nhắn đã rơi khỏi cửa sổ nhưng chưa được gộp vào summary
+    return (
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.message_id > (summary_message_id or 0),
+        ChatMessage.message_id < first_kept_id
+    )
+
+
+def update_summary(conversation_id, max_messages, token_budget, summarize, batch_size):
+    """
+    Gộp dần các tin nhắn đã rơi khỏi cửa sổ (nằm giữa summary_message_id và first_kept_id)
+    vào conversation.summary. Chỉ gọi summarize khi dồn đủ batch_size tin nhắn.
+    Đọc xong thì commit trước khi gọi LLM, kết quả ghi bằng 1 transaction ngắn riêng; nếu
+    summary đã bị lần chạy khác cập nhật trong lúc chờ LLM thì bỏ kết quả này.
+    Trả về True nếu đã cập nhật summary.
+    """
+    messages = load_recent_messages(conversation_id, max_messages, token_budget)
+    conversation = db.session.get(ChatConversation, conversation_id)
+    if not messages or conversation is None:
+        db.session.commit()
+        return False
+
+    previous_summary = conversation.summary
+    previous_message_id = conversation.summary_message_id
+    pending = [
+        SimpleNamespace(message_id=msg.message_id, message_type=msg.message_type, content=msg.content)
+        for msg in ChatMessage.query.filter(
+            *_pending_filter(conversation_id, previous_message_id, messages[0].message_id)
+        ).order_by(ChatMessage.message_id.asc()).limit(batch_size * 4)
+    ]
+    db.session.commit()
+
+    if len(pending) < batch_size:
+        return False
+
+    summary = summarize(previous_summary, pending)
+
+    if previous_message_id is None:
+        unchanged = ChatConversation.summary_message_id.is_(None)
+    else:
+        unchanged = ChatConversation.summary_message_id == previous_message_id
+    updated = ChatConversation.query.filter(
+        ChatConversation.conversation_id == conversation_id, unchanged
+    ).update(
+        {'summary': summary, 'summary_message_id': pending[-1].message_id},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return updated == 1
+
+
+def load_history(conversation_id, max_messages, token_budget, summary_batch=0):
+    """
+    Lịch sử gửi cho LLM: [tóm tắt phần cũ] + cửa sổ tin nhắn gần nhất trong ngân sách token,
+    nên chi phí mỗi lượt không tăng theo độ dài cuộc trò chuyện.
+    Trả về (history, summary_due): summary_due = đã dồn đủ summary_batch tin nhắn chưa tóm tắt
+    (summary_batch=0 thì không kiểm tra), khi đó gọi update_summary ngoài request.
+    """
+    messages = load_recent_messages(conversation_id, max_messages, token_budget)
+
+    history = []
+    summary_due = False
+    if messages:
+        conversation = db.session.get(ChatConversation, conversation_id)
+        if conversation:
+            if conversation.summary:
+                history.append(SystemMessage(
+                    content=f"Tóm tắt phần trước của cuộc trò chuyện: {conversation.summary}"
+                ))
+            if summary_batch:
+                pending_count = ChatMessage.query.filter(*_pending_filter(
+                    conversation_id, conversation.summary_message_id, messages[0].message_id
+                )).count()
+                summary_due = pending_count >= summary_batch
+
+    for msg in messages:
+        lc_message = to_langchain_message(msg)
+        if lc_message is not None:
+            history.append(lc_message)
+    return history, summary_due
+
+
+class ConversationRAGMixin:
+    """
+    Phần dùng chung giữa RAGSystem (model trong process) và RemoteRAGSystem (model server):
+    đọc lịch sử hội thoại từ DB ở web worker rồi gọi answer()/stream_answer().
+    Lớp con cần cài answer, stream_answer và _summarize_history.
+    """
+
+    RAG_ERROR_ANSWER = "Xin lỗi, có lỗi xảy ra khi xử lý yêu cầu của bạn. Vui lòng thử lại."
+
+    def load_conversation_history(self, conversation_id):
+        """
+        Lấy lịch sử hội thoại (cửa sổ gần nhất + tóm tắt) dạng LangChain messages, chỉ đọc DB.
+        Trả về (history, summary_due); summary_due thì gọi summarize_conversation
+        (job nền) sau khi request đã commit.
+        """
+        summary_batch = (
+            app.config['RAG_HISTORY_SUMMARY_BATCH'] if app.config['RAG_HISTORY_SUMMARY_ENABLED'] else 0
+        )
+        return load_history(
+            conversation_id,
+            max_messages=app.config['RAG_HISTORY_MAX_MESSAGES'],
+            token_budget=app.config['RAG_HISTORY_TOKEN_BUDGET'],
+            summary_batch=summary_batch
+        )
+
+    def summarize_conversation(self, conversation_id):
+        """Cập nhật tóm tắt hội thoại (gọi LLM), chạy ở job nền 'summarize_history'"""
+        return update_summary(
+            conversation_id,
+            max_messages=app.config['RAG_HISTORY_MAX_MESSAGES'],
+            token_budget=app.config['RAG_HISTORY_TOKEN_BUDGET'],
+            summarize=self._summarize_history,
+            batch_size=app.config['RAG_HISTORY_SUMMARY_BATCH']
+        )
+
+    def get_rag_response(self, query, conversation_id, context_docs=None, chat_history=None):
+        """
+        Lấy response từ RAG cho 1 conversation_id.
+        context_docs: tài liệu đã retrieve sẵn (bỏ qua bước retrieve của chain)
+        chat_history: lịch sử đã đọc sẵn (None thì đọc từ DB)
+        """
+        try:
+            if chat_history is None:
+                chat_history, _ = self.load_conversation_history(conversation_id)
+            return self.answer(query, chat_history, context_docs)
+        except Exception as e:
+            app.logger.error(f"RAG System Error: {e}")
+            return self.RAG_ERROR_ANSWER
+
+    def stream_rag_response(self, query, conversation_id, context_docs=None, chat_history=None):
+        """
+        Giống get_rag_response nhưng stream từng bước: yield ('sources', docs),
+        các ('token', text) của LLM, cuối cùng là ('answer', toàn bộ câu trả lời)
+        """
+        try:
+            if chat_history is None:
+                chat_history, _ = self.load_conversation_history(conversation_id)
+            yield from self.stream_answer(query, chat_history, context_docs)
+        except Exception as e:
+            app.logger.error(f"RAG System Error: {e}")
+            yield 'token', self.RAG_ERROR_ANSWER
+            yield 'answer', self.RAG_ERROR_ANSWER
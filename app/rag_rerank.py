@@ -0,0 +1,69 @@
+import threading
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+
+from app.rag_utils import estimate_tokens
+
+
+class RerankRetriever(BaseRetriever):
+    """
+    Retrieve 2 bước: lấy tập ứng viên rộng từ base_retriever, chấm điểm lại bằng
+    cross-encoder rồi chỉ giữ top_n đoạn nằm trong token_budget để nhồi vào prompt
+    """
+    base_retriever: BaseRetriever
+    reranker: Any
+    top_n: int = 6
+    token_budget: int = 1500
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _stats: dict = PrivateAttr(default_factory=lambda: {
+        "requests": 0,
+        "candidate_docs": 0,
+        "kept_docs": 0,
+        "candidate_tokens": 0,
+        "context_tokens": 0,
+    })
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        candidates = self.base_retriever.invoke(
+            query,
+            config={"callbacks": run_manager.get_child()}
+        )
+        if not candidates:
+            return []
+
+        scores = self.reranker.predict([(query, doc.page_content) for doc in candidates])
+        ranked = sorted(zip(scores, candidates), key=lambda pair: pair[0], reverse=True)
+
+        kept = []
+        context_tokens = 0
+        for score, doc in ranked:
+            if len(kept) >= self.top_n:
+                break
+            tokens = estimate_tokens(doc.page_content)
+            # Luôn giữ đoạn tốt nhất, các đoạn sau phải vừa ngân sách
+            if kept and context_tokens + tokens > self.token_budget:
+                continue
+            doc.metadata["rerank_score"] = float(score)
+            kept.append(doc)
+            context_tokens += tokens
+
+        candidate_tokens = sum(estimate_tokens(doc.page_content) for doc in candidates)
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["candidate_docs"] += len(candidates)
+            self._stats["kept_docs"] += len(kept)
+            self._stats["candidate_tokens"] += candidate_tokens
+            self._stats["context_tokens"] += context_tokens
+
+        return kept
+
+    def stats(self):
+        """Số token prompt tiết kiệm được so với việc nhồi toàn bộ ứng viên"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["saved_tokens"] = stats["candidate_tokens"] - stats["context_tokens"]
+        return stats
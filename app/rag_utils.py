@@ -0,0 +1,48 @@
+import time
+import uuid
+
+# Model embedding của collection Qdrant (RAG lúc query và app.ingest lúc nạp phải dùng chung)
+EMBEDDING_MODEL_NAME = "dangvantuan/vietnamese-embedding"
+
+
+def estimate_tokens(text):
+    """
+    Ước lượng số token của 1 đoạn text (~4 ký tự/token), đủ dùng để chia ngân sách prompt
+    mà không cần tokenizer của model LLM
+    """
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+
+# Version dữ liệu của collection RAG: app.ingest đổi version sau mỗi lần nạp / xóa point,
+# semantic cache câu trả lời thấy version khác thì xóa. Lưu ở 1 point của collection phụ
+# (vector 1 chiều) để không lẫn vào kết quả tìm kiếm của collection chính
+INGEST_VERSION_POINT_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def version_collection_name(collection_name):
+    return f"{collection_name}__version"
+
+
+def read_ingest_version(client, collection_name):
+    """Version hiện tại của collection, None nếu chưa từng nạp bằng app.ingest"""
+    name = version_collection_name(collection_name)
+    if not client.collection_exists(name):
+        return None
+    points = client.retrieve(name, ids=[INGEST_VERSION_POINT_ID], with_payload=True, with_vectors=False)
+    return points[0].payload.get('version') if points else None
+
+
+def bump_ingest_version(client, collection_name):
+    """Đặt version mới cho collection (gọi sau khi nạp / xóa point), trả về version đó"""
+    from qdrant_client.models import Distance, PointStruct, VectorParams
+
+    name = version_collection_name(collection_name)
+    if not client.collection_exists(name):
+        client.create_collection(name, vectors_config=VectorParams(size=1, distance=Distance.DOT))
+    version = uuid.uuid4().hex
+    client.upsert(name, points=[PointStruct(
+        id=INGEST_VERSION_POINT_ID, vector=[0.0], payload={'version': version, 'updated_at': time.time()}
+    )], wait=True)
+    return version
@@ -6,7 +6,16 @@ class Chatbot {
     this.apiBaseUrl = "/api/chat"
     this.currentConversationId = null
     this.conversations = []
+    // File ảnh đang chọn (gửi nhị phân qua multipart) và object URL để preview
+    this.currentImageFile = null
     this.currentImageData = null
+    // Promise job phân tích ảnh (upload + CNN chạy nền ngay khi chọn ảnh), resolve ra job_id
+    this.currentAnalysisJob = null
+    // Cursor (header X-Next-Cursor) để tải tin nhắn cũ hơn / thêm cuộc trò chuyện
+    this.messagesCursor = null
+    this.conversationsCursor = null
+    this.isLoadingOlder = false
+    this.isLoadingConversations = false
 
     this.initializeElements()
     this.bindEvents()
@@ -96,6 +105,25 @@ setupImageUpload() {
 
     this.elements.clearChat.addEventListener("click", () => this.clearCurrentChat())
 
+    // Cuộn lên gần đầu khung chat -> tải tin nhắn cũ hơn
+    if (this.elements.chatMessages) {
+      this.elements.chatMessages.addEventListener("scroll", () => {
+        if (this.elements.chatMessages.scrollTop < 80) {
+          this.loadOlderMessages()
+        }
+      })
+    }
+
+    // Cuộn xuống cuối sidebar -> tải thêm cuộc trò chuyện
+    if (this.elements.chatHistory) {
+      this.elements.chatHistory.addEventListener("scroll", () => {
+        const el = this.elements.chatHistory
+        if (el.scrollTop + el.clientHeight >= el.scrollHeight - 80) {
+          this.loadMoreConversations()
+        }
+      })
+    }
+
     if (this.elements.themeToggle) {
       this.elements.themeToggle.addEventListener("click", () => this.toggleTheme())
     }
@@ -150,15 +178,29 @@ setupImageUpload() {
       return
     }
 
-    const reader = new FileReader()
-    reader.onload = (e) => {
-      this.currentImageData = e.target.result
-      this.showImagePreview(e.target.result)
-    }
-    reader.onerror = () => {
-      alert('Có lỗi xảy ra khi đọc file. Vui lòng thử lại.')
+    this.clearImagePreview()
+    this.currentAnalysisJob = this.submitImageAnalysis(file)
+
+    // Preview trực tiếp từ file, không đọc ra base64
+    this.currentImageFile = file
+    this.currentImageData = URL.createObjectURL(file)
+    this.showImagePreview(this.currentImageData)
+  }
+
+  // Gửi ảnh lên server để phân tích ở job nền trong lúc user gõ tin nhắn.
+  // Lỗi thì trả về null, tin nhắn sẽ gửi kèm ảnh như cũ.
+  async submitImageAnalysis(file) {
+    try {
+      const formData = new FormData()
+      formData.append('image', file)
+      const response = await fetch(`${this.apiBaseUrl}/upload-image`, { method: 'POST', body: formData })
+      if (!response.ok) return null
+      const data = await response.json()
+      return data.job_id || null
+    } catch (error) {
+      console.error("Image analysis submit error:", error)
+      return null
     }
-    reader.readAsDataURL(file)
   }
 
   showImagePreview(imageData) {
@@ -182,8 +224,28 @@ setupImageUpload() {
     }
   }
 
-  clearImagePreview() {
+  // Ảnh bị đổi / xóa trước khi gửi: báo server bỏ job để xóa ảnh đã upload
+  async discardImageAnalysis(analysisJob) {
+    try {
+      const jobId = await analysisJob
+      if (!jobId) return
+      await fetch(`/api/jobs/${encodeURIComponent(jobId)}`, { method: 'DELETE' })
+    } catch (error) {
+      console.error("Image analysis discard error:", error)
+    }
+  }
+
+  // keepPreviewUrl: ảnh vừa gửi vẫn hiển thị trong khung chat bằng object URL này
+  clearImagePreview(keepPreviewUrl = false) {
+    if (this.currentImageData && !keepPreviewUrl) {
+      URL.revokeObjectURL(this.currentImageData)
+    }
+    if (this.currentAnalysisJob && !keepPreviewUrl) {
+      this.discardImageAnalysis(this.currentAnalysisJob)
+    }
+    this.currentImageFile = null
     this.currentImageData = null
+    this.currentAnalysisJob = null
     const previewDiv = document.getElementById('image-preview')
     const fileInput = document.getElementById('image-upload')
 
@@ -218,6 +280,7 @@ async loadConversations() {
         if (!response.ok) throw new Error("Failed to load conversations")
 
         this.conversations = await response.json()
+        this.conversationsCursor = response.headers.get("X-Next-Cursor")
 
         // Display conversations in sidebar
         if (this.elements.chatHistory) {
@@ -238,6 +301,30 @@ async loadConversations() {
     }
 }
 
+async loadMoreConversations() {
+    if (!this.conversationsCursor || this.isLoadingConversations) return
+
+    this.isLoadingConversations = true
+    try {
+        const cursor = encodeURIComponent(this.conversationsCursor)
+        const response = await fetch(`${this.apiBaseUrl}/conversations?cursor=${cursor}`)
+        if (!response.ok) throw new Error("Failed to load conversations")
+
+        const more = await response.json()
+        this.conversationsCursor = response.headers.get("X-Next-Cursor")
+        const knownIds = new Set(this.conversations.map((conv) => conv.id))
+        this.conversations.push(...more.filter((conv) => !knownIds.has(conv.id)))
+
+        const scrollTop = this.elements.chatHistory.scrollTop
+        this.renderConversationsSidebar(this.conversations)
+        this.elements.chatHistory.scrollTop = scrollTop
+    } catch (error) {
+        console.error("Error loading more conversations:", error)
+    } finally {
+        this.isLoadingConversations = false
+    }
+}
+
   renderConversationsSidebar(conversations) {
     const historyContainer = this.elements.chatHistory
     if (!historyContainer) return
@@ -316,10 +403,13 @@ async loadConversations() {
 async loadConversation(conversationId) {
     try {
         this.currentConversationId = conversationId
+        this.messagesCursor = null
         const response = await fetch(`${this.apiBaseUrl}/conversations/${conversationId}/messages`)
         if (!response.ok) throw new Error("Failed to load messages")
 
         const messages = await response.json()
+        // Chỉ nhận trang mới nhất; cuộn lên để tải tiếp tin cũ hơn
+        this.messagesCursor = response.headers.get("X-Next-Cursor")
 
         if (this.elements.chatMessages) {
             this.elements.chatMessages.innerHTML = ""
@@ -343,6 +433,44 @@ async loadConversation(conversationId) {
     }
 }
 
+async loadOlderMessages() {
+    if (!this.messagesCursor || this.isLoadingOlder || !this.currentConversationId) return
+
+    this.isLoadingOlder = true
+    const conversationId = this.currentConversationId
+    try {
+        const cursor = encodeURIComponent(this.messagesCursor)
+        const response = await fetch(`${this.apiBaseUrl}/conversations/${conversationId}/messages?cursor=${cursor}`)
+        if (!response.ok) throw new Error("Failed to load older messages")
+
+        const messages = await response.json()
+        // Người dùng đã chuyển sang cuộc trò chuyện khác trong lúc chờ
+        if (conversationId !== this.currentConversationId) return
+
+        this.messagesCursor = response.headers.get("X-Next-Cursor")
+        const container = this.elements.chatMessages
+        const previousHeight = container.scrollHeight
+
+        // Chèn lên đầu theo thứ tự ngược để giữ thứ tự thời gian
+        messages.slice().reverse().forEach((msg) => {
+            this.renderMessage({
+                content: msg.content,
+                type: msg.type,
+                timestamp: msg.timestamp,
+                image_url: msg.image_url,
+                is_html: msg.is_html
+            }, true)
+        })
+
+        // Giữ nguyên vị trí đang đọc
+        container.scrollTop += container.scrollHeight - previousHeight
+    } catch (error) {
+        console.error("Error loading older messages:", error)
+    } finally {
+        this.isLoadingOlder = false
+    }
+}
+
 updateSidebarActiveState() {
     const items = document.querySelectorAll('.chat-item')
     items.forEach(item => {
@@ -369,6 +497,7 @@ updateSidebarActiveState() {
 
       const newConversation = await response.json()
       this.currentConversationId = newConversation.id
+      this.messagesCursor = null
       this.conversations.unshift(newConversation)
 
       // Update sidebar
@@ -388,6 +517,8 @@ updateSidebarActiveState() {
 async sendMessage() {
     const message = this.elements.chatInput?.value.trim() || ''
     const imageData = this.currentImageData
+    const imageFile = this.currentImageFile
+    const analysisJob = this.currentAnalysisJob
 
     if ((!message && !imageData) || this.isTyping) {
         if (!message && !imageData) {
@@ -408,63 +539,236 @@ async sendMessage() {
         this.elements.chatInput.value = ""
     }
 
-    this.clearImagePreview()
+    this.clearImagePreview(true)
 
     this.showTypingIndicator()
 
+    // Ảnh đã có job phân tích thì chỉ gửi job id, không gửi lại ảnh
+    const analysisJobId = analysisJob ? await analysisJob : null
+
+    // multipart/form-data: ảnh gửi dạng nhị phân, không qua base64.
+    // Cùng 1 id cho mọi lần gửi lại của tin nhắn này (fallback JSON, retry) để server không lưu trùng
+    const payload = new FormData()
+    payload.append('message', message)
+    payload.append('client_request_id', this.newClientRequestId())
+    if (this.currentConversationId) {
+        payload.append('conversation_id', this.currentConversationId)
+    }
+    if (analysisJobId) {
+        payload.append('analysis_job_id', analysisJobId)
+    } else if (imageFile) {
+        payload.append('image', imageFile, imageFile.name)
+    }
+
     try {
-        const response = await fetch('/api/chat/send-message', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                message: message,
-                image: imageData,
-                conversation_id: this.currentConversationId
-            })
-        })
+        try {
+            await this.deliverMessage(payload)
+        } catch (error) {
+            // Job phân tích ảnh không còn (hết hạn / ở worker khác) -> gửi lại kèm file ảnh
+            if (!error.analysisJobMissing || !imageFile) throw error
+            payload.delete('analysis_job_id')
+            payload.append('image', imageFile, imageFile.name)
+            await this.deliverMessage(payload)
+        }
+        await this.loadConversations()
+    } catch (error) {
+        this.hideTypingIndicator()
+        const errorMsg = error.warmingUp || error.userFacing ? error.message : "Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại sau."
+        this.addMessageToUI(errorMsg, null, "bot")
+        console.error("Chatbot error:", error)
+    }
+}
 
-        const data = await response.json()
+newClientRequestId() {
+    if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+        return window.crypto.randomUUID()
+    }
+    // randomUUID chỉ có trên HTTPS / localhost
+    return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}-${Math.random().toString(16).slice(2)}`
+}
 
-        if (data.success) {
-            this.hideTypingIndicator()
+// Gửi qua SSE, server không hỗ trợ stream thì fallback sang JSON (cùng payload)
+async deliverMessage(payload) {
+    const streamed = await this.sendMessageStream(payload)
+    if (!streamed) {
+        await this.sendMessageJson(payload)
+    }
+}
 
-            // Cập nhật tin nhắn user với URL ảnh thực từ server (nếu có)
-            if (data.image_url) {
-                const userMessages = document.querySelectorAll('.message.user')
-                const lastUserMessage = userMessages[userMessages.length - 1]
-                if (lastUserMessage) {
-                    const imgElement = lastUserMessage.querySelector('.chat-image-preview')
-                    if (imgElement && data.image_url) {
-                        imgElement.src = data.image_url
-                    }
-                }
-            }
+// 404 của send-message khi job phân tích ảnh (analysis_job_id) không còn trên server
+async analysisJobMissingError(response) {
+    const data = await response.clone().json().catch(() => ({}))
+    if (!data.analysis_job_missing) return null
+    const error = new Error(data.error)
+    error.analysisJobMissing = true
+    return error
+}
 
-            // Xử lý response - KHÔNG có HTML lồng nhau
-            let responseContent = data.response
+// Lỗi có thông báo hiển thị thẳng cho người dùng (vd. 413 ảnh quá lớn)
+async userFacingError(response) {
+    const data = await response.json().catch(() => ({}))
+    const error = new Error(data.error || "Không gửi được tin nhắn. Vui lòng thử lại.")
+    error.userFacing = true
+    return error
+}
 
-            // Format response đẹp hơn nếu có cả CV và RAG
-            if (data.cv_prediction && data.response.includes(data.cv_prediction)) {
-                // Tách CV prediction và RAG response
-                const ragOnly = data.response.replace(data.cv_prediction, '').trim()
-                responseContent = `${data.cv_prediction}\n\n${ragOnly}`
-            }
+// Server trả 503 khi model AI còn đang khởi động
+async warmingUpError(response) {
+    const data = await response.json().catch(() => ({}))
+    const error = new Error(data.error || "Hệ thống đang khởi động, vui lòng thử lại sau giây lát.")
+    error.warmingUp = true
+    return error
+}
+
+// Gửi tin nhắn qua SSE: hiện kết quả CV và từng token ngay khi server gửi về.
+// Trả về false nếu server không hỗ trợ stream để fallback sang JSON.
+async sendMessageStream(payload) {
+    const response = await fetch('/api/chat/send-message/stream', {
+        method: 'POST',
+        headers: {
+            'Accept': 'text/event-stream',
+        },
+        body: payload
+    })
+
+    if (response.status === 503) {
+        throw await this.warmingUpError(response)
+    }
+    if (response.status === 413) {
+        throw await this.userFacingError(response)
+    }
+    if (response.status === 404) {
+        const jobMissing = await this.analysisJobMissingError(response)
+        if (jobMissing) throw jobMissing
+    }
+
+    const contentType = response.headers.get('Content-Type') || ''
+    if (!response.ok || !response.body || !contentType.includes('text/event-stream')) {
+        return false
+    }
 
-            this.addMessageToUI(responseContent, null, "bot")
-            await this.loadConversations()
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let cvText = ''
+    let answerText = ''
+    let botElement = null
+
+    const render = () => {
+        const content = cvText && answerText ? `${cvText}\n\n${answerText}` : (cvText || answerText)
+        if (!botElement) {
+            this.hideTypingIndicator()
+            botElement = this.addMessageToUI(content, null, "bot")
         } else {
-            throw new Error(data.error || 'Failed to get response')
+            this.updateMessageContent(botElement, content)
         }
-    } catch (error) {
+        this.scrollToBottom()
+    }
+
+    while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        let boundary
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary)
+            buffer = buffer.slice(boundary + 2)
+
+            let eventName = 'message'
+            let dataText = ''
+            rawEvent.split('\n').forEach((line) => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim()
+                else if (line.startsWith('data:')) dataText += line.slice(5).trim()
+            })
+            const data = dataText ? JSON.parse(dataText) : {}
+
+            if (eventName === 'conversation') {
+                this.currentConversationId = data.conversation_id
+            } else if (eventName === 'cv') {
+                this.updateLastUserImage(data.image_url)
+                cvText = data.cv_prediction || ''
+                render()
+            } else if (eventName === 'token') {
+                answerText += data.text
+                render()
+            } else if (eventName === 'done') {
+                answerText = ''
+                cvText = data.response
+                render()
+            } else if (eventName === 'error') {
+                throw new Error(data.error || 'Failed to get response')
+            }
+        }
+    }
+
+    if (!botElement) {
+        throw new Error('Stream ended without response')
+    }
+    return true
+}
+
+async sendMessageJson(payload) {
+    const response = await fetch('/api/chat/send-message', {
+        method: 'POST',
+        body: payload
+    })
+
+    if (response.status === 503) {
+        throw await this.warmingUpError(response)
+    }
+    if (response.status === 413) {
+        throw await this.userFacingError(response)
+    }
+    if (response.status === 404) {
+        const jobMissing = await this.analysisJobMissingError(response)
+        if (jobMissing) throw jobMissing
+    }
+
+    const data = await response.json()
+
+    if (data.success) {
         this.hideTypingIndicator()
-        const errorMsg = "Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại sau."
-        this.addMessageToUI(errorMsg, null, "bot")
-        console.error("Chatbot error:", error)
+
+        // Cập nhật tin nhắn user với URL ảnh thực từ server (nếu có)
+        this.updateLastUserImage(data.image_url)
+
+        // Xử lý response - KHÔNG có HTML lồng nhau
+        let responseContent = data.response
+
+        // Format response đẹp hơn nếu có cả CV và RAG
+        if (data.cv_prediction && data.response.includes(data.cv_prediction)) {
+            // Tách CV prediction và RAG response
+            const ragOnly = data.response.replace(data.cv_prediction, '').trim()
+            responseContent = `${data.cv_prediction}\n\n${ragOnly}`
+        }
+
+        this.addMessageToUI(responseContent, null, "bot")
+    } else {
+        throw new Error(data.error || 'Failed to get response')
+    }
+}
+
+updateLastUserImage(imageUrl) {
+    if (!imageUrl) return
+    const userMessages = document.querySelectorAll('.message.user')
+    const lastUserMessage = userMessages[userMessages.length - 1]
+    if (lastUserMessage) {
+        const imgElement = lastUserMessage.querySelector('.chat-image-preview')
+        if (imgElement) {
+            imgElement.src = imageUrl
+        }
     }
 }
 
+updateMessageContent(messageElement, content) {
+    const contentElement = messageElement.querySelector('.message-content')
+    if (!contentElement) return
+    const timeElement = contentElement.querySelector('.message-time')
+    contentElement.innerHTML = this.formatMessageContent(content)
+    if (timeElement) contentElement.appendChild(timeElement)
+}
+
 // Sửa hàm addMessageToUI trong chatbot.js
 addMessageToUI(content, imageData, type, imageUrl = null) {
     const timestamp = new Date().toLocaleTimeString("vi-VN", {
@@ -472,7 +776,7 @@ addMessageToUI(content, imageData, type, imageUrl = null) {
         minute: "2-digit",
     })
 
-    this.renderMessage({
+    const messageElement = this.renderMessage({
         content,
         imageData,
         type,
@@ -481,9 +785,10 @@ addMessageToUI(content, imageData, type, imageUrl = null) {
     })
 
     this.scrollToBottom()
+    return messageElement
 }
 // Sửa hàm renderMessage để hiển thị ảnh ngay lập tức
-renderMessage(message) {
+renderMessage(message, prepend = false) {
     if (!this.elements.chatMessages) return
 
     const messageElement = document.createElement("div")
@@ -525,7 +830,12 @@ renderMessage(message) {
     }
 
     messageElement.innerHTML = messageHTML
-    this.elements.chatMessages.appendChild(messageElement)
+    if (prepend) {
+        this.elements.chatMessages.insertBefore(messageElement, this.elements.chatMessages.firstChild)
+    } else {
+        this.elements.chatMessages.appendChild(messageElement)
+    }
+    return messageElement
 }
 
 
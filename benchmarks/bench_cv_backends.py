@@ -0,0 +1,102 @@
+"""
+So sánh các backend của SkinDiseaseModel (keras / tflite / onnx): độ trùng top-1,
+latency từng ảnh, throughput theo batch và bộ nhớ RSS. Mỗi backend chạy trong 1
+process riêng để số RSS không bị cộng dồn.
+
+    python -m benchmarks.bench_cv_backends --images ./sample_images --backends keras tflite
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def load_images(folder, limit):
+    paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return paths, images
+
+
+def run_worker(backend, folder, limit, batch_size):
+    # Đo latency từng request nên tắt micro-batching
+    os.environ['CV_BATCHING_ENABLED'] = 'False'
+    from app.cv_model import SkinDiseaseModel
+
+    _, images = load_images(folder, limit)
+
+    started = time.perf_counter()
+    model = SkinDiseaseModel(backend=backend)
+    load_s = time.perf_counter() - started
+    if model.model is None:
+        raise SystemExit(f"Không load được backend {backend}")
+
+    model.predict(images[0])  # warm-up
+
+    latencies = []
+    labels = []
+    for img in images:
+        t = time.perf_counter()
+        _, _, raw_class = model.predict(img)
+        latencies.append((time.perf_counter() - t) * 1000)
+        labels.append(raw_class)
+
+    t = time.perf_counter()
+    model.predict_batch(images, batch_size=batch_size)
+    batch_s = time.perf_counter() - t
+
+    latencies.sort()
+    print(json.dumps({
+        'backend': backend,
+        'load_s': load_s,
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0],
+        'batch_images_per_s': len(images) / batch_s,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'labels': labels,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', required=True, help="Thư mục ảnh mẫu")
+    parser.add_argument('--backends', nargs='+', default=['keras', 'tflite'])
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.images, args.limit, args.batch_size)
+        return
+
+    results = []
+    for backend in args.backends:
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_cv_backends', '--worker', backend,
+             '--images', args.images, '--limit', str(args.limit), '--batch-size', str(args.batch_size)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    reference = results[0]['labels']
+    print(f"{'backend':<8} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'batch img/s':>12} {'RSS MB':>8} {'top-1 agree':>12}")
+    for r in results:
+        agree = sum(a == b for a, b in zip(reference, r['labels'])) / len(reference)
+        print(f"{r['backend']:<8} {r['load_s']:7.2f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} "
+              f"{r['batch_images_per_s']:12.1f} {r['max_rss_mb']:8.0f} {agree:12.1%}")
+
+
+if __name__ == '__main__':
+    main()
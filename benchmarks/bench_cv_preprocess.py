@@ -0,0 +1,89 @@
+"""
+So sánh tiền xử lý ảnh cũ (decode full ảnh + resize) với fast path (JPEG draft decode
++ ghi thẳng vào buffer float32): thời gian mỗi ảnh, sai khác pixel và độ trùng dự đoán.
+
+    python -m benchmarks.bench_cv_preprocess --images ./sample_images
+    python -m benchmarks.bench_cv_preprocess --images ./sample_images --predict
+"""
+import argparse
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def legacy_preprocess(img_bytes, img_size=(224, 224)):
+    # Giống hệt SkinDiseaseModel.preprocess_image trước khi có fast path
+    img = Image.open(io.BytesIO(img_bytes))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img = img.resize(img_size)
+    img_array = np.asarray(img, dtype=np.float32)
+    img_array = img_array / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+
+def time_per_image(fn, images, repeat):
+    timings = []
+    for img in images:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(img)
+        timings.append((time.perf_counter() - start) / repeat * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', required=True, help="Thư mục ảnh mẫu (ảnh điện thoại càng tốt)")
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--predict', action='store_true', help="So sánh cả dự đoán của CNN")
+    args = parser.parse_args()
+
+    os.environ['CV_BATCHING_ENABLED'] = 'False'
+    from app.cv_model import load_image_array, IMG_SIZE
+
+    paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:args.limit]
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+
+    buffer = np.empty((IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32)
+    legacy = time_per_image(legacy_preprocess, images, args.repeat)
+    fast = time_per_image(lambda img: load_image_array(img, out=buffer), images, args.repeat)
+
+    max_diff = max(
+        float(np.abs(legacy_preprocess(img)[0] - load_image_array(img)[0]).max()) for img in images
+    )
+
+    print(f"{len(images)} ảnh, mỗi ảnh lặp {args.repeat} lần")
+    print(f"legacy   median {statistics.median(legacy):8.2f} ms   total {sum(legacy):9.1f} ms")
+    print(f"fast     median {statistics.median(fast):8.2f} ms   total {sum(fast):9.1f} ms")
+    print(f"speed-up {sum(legacy) / sum(fast):.2f}x, sai khác pixel lớn nhất {max_diff:.4f}")
+
+    if args.predict:
+        from app.cv_model import SkinDiseaseModel
+
+        model = SkinDiseaseModel()
+        if model.model is None:
+            raise SystemExit("Không load được model để so sánh dự đoán")
+        agree = 0
+        for img in images:
+            legacy_probs = model.model.run(legacy_preprocess(img))[0]
+            fast_probs = model.model.run(load_image_array(img))[0]
+            agree += int(np.argmax(legacy_probs) == np.argmax(fast_probs))
+        print(f"top-1 trùng nhau: {agree}/{len(images)} ({agree / len(images):.1%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Seed 1 DB SQLite với số lượng gần thực tế rồi so sánh EXPLAIN QUERY PLAN + thời gian
+các query nóng của chat / diễn đàn trước và sau khi tạo index của các migration
+c4e8a1b3d925 và d9f1b6c2e047 (cùng tên, cùng cột).
+
+    python -m benchmarks.bench_db_indexes --users 2000 --messages-per-conversation 200
+    python -m benchmarks.bench_db_indexes --db /tmp/bench.sqlite --repeat 50
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SCHEMA = """
+CREATE TABLE user (user_id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL);
+CREATE TABLE chatconversation (
+    conversation_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, title TEXT,
+    created_at TIMESTAMP, updated_at TIMESTAMP);
+CREATE TABLE chatmessage (
+    message_id INTEGER PRIMARY KEY, conversation_id INTEGER NOT NULL, user_id INTEGER,
+    content TEXT, message_type TEXT, timestamp TIMESTAMP);
+CREATE TABLE post (
+    post_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, title TEXT, content TEXT,
+    like_count INTEGER DEFAULT 0, comment_count INTEGER DEFAULT 0, created_at TIMESTAMP);
+CREATE TABLE post_image (id INTEGER PRIMARY KEY, post_id INTEGER NOT NULL, image_url TEXT);
+CREATE TABLE comment (
+    comment_id INTEGER PRIMARY KEY, post_id INTEGER, user_id INTEGER, content TEXT, created_at TIMESTAMP);
+CREATE TABLE "like" (
+    like_id INTEGER PRIMARY KEY, post_id INTEGER, user_id INTEGER, created_at TIMESTAMP);
+CREATE TABLE follow (
+    follow_id INTEGER PRIMARY KEY, follower_id INTEGER, followed_id INTEGER, created_at TIMESTAMP);
+"""
+
+# Giống hệt các index trong app/models.py / migrations
+INDEXES = [
+    "CREATE INDEX ix_chatmessage_conversation_timestamp ON chatmessage (conversation_id, timestamp, message_id)",
+    "CREATE INDEX ix_chatconversation_user_created ON chatconversation (user_id, created_at, conversation_id)",
+    "CREATE INDEX ix_comment_post_created ON comment (post_id, created_at, comment_id)",
+    "CREATE INDEX ix_post_created ON post (created_at, post_id)",
+    "CREATE INDEX ix_post_user_created ON post (user_id, created_at)",
+    # Không có trong migration: MySQL tự tạo index cho foreign key post_image.post_id, SQLite thì không
+    "CREATE INDEX post_image_post_id_fk ON post_image (post_id)",
+    'CREATE UNIQUE INDEX uq_like_post_user ON "like" (post_id, user_id)',
+    'CREATE INDEX ix_like_user_post ON "like" (user_id, post_id)',
+    "CREATE INDEX ix_follow_follower_followed ON follow (follower_id, followed_id)",
+    "CREATE INDEX ix_follow_followed_follower ON follow (followed_id, follower_id)",
+]
+
+# (tên, SQL, hàm sinh tham số ngẫu nhiên theo quy mô dữ liệu)
+QUERIES = [
+    ("chat: 50 tin mới nhất",
+     "SELECT * FROM chatmessage WHERE conversation_id = ? "
+     "ORDER BY timestamp DESC, message_id DESC LIMIT 51",
+     lambda s: (random.randint(1, s['conversations']),)),
+    ("chat: lịch sử cho LLM (12 tin)",
+     "SELECT * FROM chatmessage WHERE conversation_id = ? "
+     "ORDER BY timestamp DESC, message_id DESC LIMIT 12",
+     lambda s: (random.randint(1, s['conversations']),)),
+    ("sidebar: hội thoại của user",
+     "SELECT * FROM chatconversation WHERE user_id = ? "
+     "ORDER BY created_at DESC, conversation_id DESC LIMIT 31",
+     lambda s: (random.randint(1, s['users']),)),
+    ("feed: trang đầu",
+     "SELECT * FROM post ORDER BY created_at DESC, post_id DESC LIMIT 6",
+     lambda s: ()),
+    ("feed: ảnh của 1 trang",
+     "SELECT * FROM post_image WHERE post_id IN (?, ?, ?, ?, ?)",
+     lambda s: tuple(random.randint(1, s['posts']) for _ in range(5))),
+    ("post: bình luận",
+     "SELECT * FROM comment WHERE post_id = ? ORDER BY created_at, comment_id LIMIT 21",
+     lambda s: (random.randint(1, s['posts']),)),
+    ("post: user đã like chưa",
+     'SELECT 1 FROM "like" WHERE post_id = ? AND user_id = ? LIMIT 1',
+     lambda s: (random.randint(1, s['posts']), random.randint(1, s['users']))),
+    ("profile: bài của user",
+     "SELECT * FROM post WHERE user_id = ? ORDER BY created_at DESC LIMIT 10",
+     lambda s: (random.randint(1, s['users']),)),
+    ("follow: A có follow B",
+     "SELECT 1 FROM follow WHERE follower_id = ? AND followed_id = ? LIMIT 1",
+     lambda s: (random.randint(1, s['users']), random.randint(1, s['users']))),
+    ("follow: người follow B",
+     "SELECT follower_id FROM follow WHERE followed_id = ?",
+     lambda s: (random.randint(1, s['users']),)),
+]
+
+
+def seed(conn, users, conversations_per_user, messages_per_conversation, posts_per_user,
+         comments_per_post, likes_per_post, follows_per_user):
+    random.seed(42)
+    start = datetime(2025, 1, 1)
+
+    def ts():
+        return start + timedelta(seconds=random.randint(0, 300 * 86400))
+
+    conn.executemany("INSERT INTO user VALUES (?, ?)", ((i, f"user{i}") for i in range(1, users + 1)))
+
+    n_conv = users * conversations_per_user
+    conn.executemany(
+        "INSERT INTO chatconversation VALUES (?, ?, ?, ?, ?)",
+        ((i, random.randint(1, users), "Cuộc trò chuyện", ts(), ts()) for i in range(1, n_conv + 1))
+    )
+    conn.executemany(
+        "INSERT INTO chatmessage (conversation_id, user_id, content, message_type, timestamp) VALUES (?, ?, ?, ?, ?)",
+        ((random.randint(1, n_conv), None, "Da tôi bị ngứa và nổi mẩn đỏ", random.choice(["user", "bot"]), ts())
+         for _ in range(n_conv * messages_per_conversation))
+    )
+
+    n_posts = users * posts_per_user
+    conn.executemany(
+        "INSERT INTO post (post_id, user_id, title, content, created_at) VALUES (?, ?, ?, ?, ?)",
+        ((i, random.randint(1, users), "Hỏi về chàm", "Nội dung", ts()) for i in range(1, n_posts + 1))
+    )
+    conn.executemany(
+        "INSERT INTO post_image (post_id, image_url) VALUES (?, ?)",
+        ((random.randint(1, n_posts), "https://example.com/a.jpg") for _ in range(n_posts * 2))
+    )
+    conn.executemany(
+        "INSERT INTO comment (post_id, user_id, content, created_at) VALUES (?, ?, ?, ?)",
+        ((random.randint(1, n_posts), random.randint(1, users), "Bình luận", ts())
+         for _ in range(n_posts * comments_per_post))
+    )
+    likes = {(random.randint(1, n_posts), random.randint(1, users)) for _ in range(n_posts * likes_per_post)}
+    conn.executemany(
+        'INSERT INTO "like" (post_id, user_id, created_at) VALUES (?, ?, ?)',
+        ((post_id, user_id, ts()) for post_id, user_id in likes)
+    )
+    conn.executemany(
+        "INSERT INTO follow (follower_id, followed_id, created_at) VALUES (?, ?, ?)",
+        ((random.randint(1, users), random.randint(1, users), ts()) for _ in range(users * follows_per_user))
+    )
+    conn.commit()
+    return {'users': users, 'conversations': n_conv, 'posts': n_posts}
+
+
+def explain(conn, sql, params):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+def time_query(conn, sql, make_params, sizes, repeat):
+    timings = []
+    for _ in range(repeat):
+        params = make_params(sizes)
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run_queries(conn, sizes, repeat):
+    results = {}
+    for name, sql, make_params in QUERIES:
+        results[name] = (explain(conn, sql, make_params(sizes)), time_query(conn, sql, make_params, sizes, repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="File SQLite (mặc định: file tạm, xóa sau khi chạy)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--conversations-per-user", type=int, default=5)
+    parser.add_argument("--messages-per-conversation", type=int, default=100)
+    parser.add_argument("--posts-per-user", type=int, default=3)
+    parser.add_argument("--comments-per-post", type=int, default=10)
+    parser.add_argument("--likes-per-post", type=int, default=20)
+    parser.add_argument("--follows-per-user", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench_db_indexes.sqlite")
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        started = time.perf_counter()
+        sizes = seed(conn, args.users, args.conversations_per_user, args.messages_per_conversation,
+                     args.posts_per_user, args.comments_per_post, args.likes_per_post, args.follows_per_user)
+        print(f"Seed xong sau {time.perf_counter() - started:.1f}s: {sizes}")
+
+        before = run_queries(conn, sizes, args.repeat)
+        for statement in INDEXES:
+            conn.execute(statement)
+        conn.execute("ANALYZE")
+        after = run_queries(conn, sizes, args.repeat)
+
+        for name, _, _ in QUERIES:
+            plan_before, ms_before = before[name]
+            plan_after, ms_after = after[name]
+            speedup = ms_before / ms_after if ms_after else float('inf')
+            print(f"\n{name}: {ms_before:.3f} ms -> {ms_after:.3f} ms ({speedup:.1f}x)")
+            print(f"  trước: {plan_before}")
+            print(f"  sau:   {plan_after}")
+    finally:
+        conn.close()
+        if not args.db:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
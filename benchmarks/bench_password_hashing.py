@@ -0,0 +1,85 @@
+"""
+Đo số lần đăng nhập/giây (verify mật khẩu) và latency theo từng thuật toán + cost của
+PASSWORD_HASH_METHOD, qua đúng PasswordHasher của app (pool giới hạn PASSWORD_HASH_WORKERS).
+Dùng để chọn cost: càng cao càng khó brute force nhưng càng ít login/s trên mỗi CPU.
+
+    python -m benchmarks.bench_password_hashing --clients 32 --logins 200
+    python -m benchmarks.bench_password_hashing --methods pbkdf2:sha256:600000 scrypt:32768:8:1 --workers 8
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_METHODS = [
+    "md5",  # hash cũ, chỉ để so sánh
+    "pbkdf2:sha256:100000",
+    "pbkdf2:sha256:300000",
+    "pbkdf2:sha256:600000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+    "scrypt:65536:8:1",
+]
+PASSWORD = "MatKhau@2025"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench_method(method, workers, clients, logins):
+    import hashlib
+    from app.passwords import PasswordHasher
+
+    # Hàng đợi đủ lớn để đo throughput, không đo việc báo bận
+    hasher = PasswordHasher(method="scrypt" if method == "md5" else method,
+                            max_workers=workers, max_pending=clients, timeout=600)
+    stored = hashlib.md5(PASSWORD.encode("utf-8")).hexdigest() if method == "md5" else hasher.hash(PASSWORD)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def login(_):
+        started = time.perf_counter()
+        ok = hasher.verify(stored, PASSWORD)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+        return ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    assert all(results), f"verify sai với {method}"
+
+    return {
+        'logins_per_s': logins / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': percentile(latencies, 0.95),
+        'hash_len': len(stored),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark đăng nhập/giây theo cost hash mật khẩu")
+    parser.add_argument("--methods", nargs="+", default=DEFAULT_METHODS)
+    parser.add_argument("--workers", type=int, default=int(os.getenv('PASSWORD_HASH_WORKERS', 4)),
+                        help="Số thread hash (PASSWORD_HASH_WORKERS)")
+    parser.add_argument("--clients", type=int, default=32, help="Số request đăng nhập đồng thời")
+    parser.add_argument("--logins", type=int, default=200, help="Tổng số lần đăng nhập mỗi cost")
+    args = parser.parse_args()
+
+    print(f"workers={args.workers}, clients={args.clients}, logins={args.logins}, CPU={os.cpu_count()}")
+    print(f"{'method':<24} {'login/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'len':>5}")
+    for method in args.methods:
+        result = bench_method(method, args.workers, args.clients, args.logins)
+        print(f"{method:<24} {result['logins_per_s']:>10.1f} {result['p50_ms']:>10.2f} "
+              f"{result['p95_ms']:>10.2f} {result['hash_len']:>5}")
+
+
+if __name__ == "__main__":
+    main()
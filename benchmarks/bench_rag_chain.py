@@ -0,0 +1,93 @@
+"""
+Micro-benchmark: build RAG chain mỗi request (cách cũ) vs build 1 lần và tái sử dụng.
+
+Dùng fake LLM + fake retriever để chỉ đo chi phí dựng memory/chain, không tính
+thời gian gọi OpenRouter hay Qdrant.
+
+    python -m benchmarks.bench_rag_chain --requests 500 --history 20
+"""
+import argparse
+import time
+
+from langchain.chains import create_retrieval_chain
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.memory import ConversationBufferMemory
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.retrievers import BaseRetriever
+
+
+class StaticRetriever(BaseRetriever):
+    docs: list
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        return self.docs
+
+
+def make_prompt():
+    return ChatPromptTemplate.from_messages([
+        ("system", "Bạn là trợ lý ảo chuyên về y tế da liễu.\nThông tin tham khảo:\n{context}\n\nCâu hỏi: {input}"),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{input}")
+    ])
+
+
+def make_history(n):
+    history = []
+    for i in range(n):
+        history.append(HumanMessage(content=f"Câu hỏi số {i} về bệnh chàm?"))
+        history.append(AIMessage(content=f"Trả lời số {i}: nên dưỡng ẩm và đi khám."))
+    return history
+
+
+def per_request(llm, retriever, prompt, history, query):
+    # Đúng như get_rag_response trước đây: memory + chain mới cho mỗi tin nhắn
+    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    for message in history:
+        if isinstance(message, HumanMessage):
+            memory.chat_memory.add_user_message(message.content)
+        elif isinstance(message, AIMessage):
+            memory.chat_memory.add_ai_message(message.content)
+    qa_chain = create_stuff_documents_chain(llm, prompt)
+    rag_chain = create_retrieval_chain(retriever, qa_chain)
+    return rag_chain.invoke({"input": query, "chat_history": memory.chat_memory.messages})
+
+
+def run(label, fn, n):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+    per_call_ms = elapsed / n * 1000
+    print(f"{label:<28} {per_call_ms:8.3f} ms/request")
+    return per_call_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--history", type=int, default=10, help="Số lượt hỏi-đáp trong lịch sử")
+    parser.add_argument("--docs", type=int, default=40)
+    args = parser.parse_args()
+
+    llm = FakeListChatModel(responses=["Bạn nên giữ da sạch và dưỡng ẩm."])
+    retriever = StaticRetriever(docs=[
+        Document(page_content=f"Tài liệu {i}: viêm da cơ địa là bệnh mạn tính.") for i in range(args.docs)
+    ])
+    prompt = make_prompt()
+    history = make_history(args.history)
+    query = "Bị ngứa da về đêm là bệnh gì?"
+
+    shared_chain = create_retrieval_chain(retriever, create_stuff_documents_chain(llm, prompt))
+
+    old = run("build per request", lambda: per_request(llm, retriever, prompt, history, query), args.requests)
+    new = run("prebuilt chain", lambda: shared_chain.invoke({"input": query, "chat_history": history}), args.requests)
+    print(f"{'saved':<28} {old - new:8.3f} ms/request ({(old - new) / old:.1%})")
+
+
+if __name__ == "__main__":
+    main()
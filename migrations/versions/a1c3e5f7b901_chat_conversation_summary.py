@@ -0,0 +1,31 @@
+"""chat conversation rolling summary
+
+Revision ID: a1c3e5f7b901
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+Các bảng gốc được tạo bằng db.create_all(), revision này là mốc đầu tiên:
+chạy `flask db stamp head` trước nếu DB đã có đủ schema mới.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c3e5f7b901'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('chatconversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('summary_message_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('chatconversation', schema=None) as batch_op:
+        batch_op.drop_column('summary_message_id')
+        batch_op.drop_column('summary')
@@ -0,0 +1,57 @@
+"""post like/comment counters and unique like per user
+
+Revision ID: b7d2f4a6c813
+Revises: a1c3e5f7b901
+Create Date: 2026-10-18 11:00:00.000000
+
+Xóa like trùng (giữ like_id nhỏ nhất) trước khi thêm unique (post_id, user_id),
+sau đó backfill like_count / comment_count từ dữ liệu hiện có.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f4a6c813'
+down_revision = 'a1c3e5f7b901'
+branch_labels = None
+depends_on = None
+
+
+post = sa.table('post', sa.column('post_id'), sa.column('like_count'), sa.column('comment_count'))
+like = sa.table('like', sa.column('like_id'), sa.column('post_id'), sa.column('user_id'))
+comment = sa.table('comment', sa.column('comment_id'), sa.column('post_id'))
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('like_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # Bọc thêm 1 lớp subquery vì MySQL không cho DELETE bảng đang SELECT trực tiếp
+    keep = sa.select(sa.func.min(like.c.like_id).label('keep_id')).group_by(
+        like.c.post_id, like.c.user_id
+    ).subquery('keep')
+    op.execute(like.delete().where(like.c.like_id.notin_(sa.select(keep.c.keep_id))))
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_like_post_user', ['post_id', 'user_id'])
+
+    op.execute(post.update().values(
+        like_count=sa.select(sa.func.count(like.c.like_id)).where(
+            like.c.post_id == post.c.post_id
+        ).scalar_subquery(),
+        comment_count=sa.select(sa.func.count(comment.c.comment_id)).where(
+            comment.c.post_id == post.c.post_id
+        ).scalar_subquery()
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_like_post_user', type_='unique')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('like_count')
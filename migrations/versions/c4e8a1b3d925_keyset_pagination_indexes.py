@@ -0,0 +1,47 @@
+"""composite indexes for keyset pagination
+
+Revision ID: c4e8a1b3d925
+Revises: b7d2f4a6c813
+Create Date: 2026-10-18 13:00:00.000000
+
+Index khớp đúng (bộ lọc, cột sắp xếp, id) của các trang cursor để DB đọc thẳng
+theo thứ tự index, không phải sort.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1b3d925'
+down_revision = 'b7d2f4a6c813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('chatmessage', schema=None) as batch_op:
+        batch_op.create_index('ix_chatmessage_conversation_timestamp', ['conversation_id', 'timestamp', 'message_id'])
+
+    with op.batch_alter_table('chatconversation', schema=None) as batch_op:
+        batch_op.create_index('ix_chatconversation_user_created', ['user_id', 'created_at', 'conversation_id'])
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_post_created', ['post_id', 'created_at', 'comment_id'])
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_created', ['created_at', 'post_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_created')
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_post_created')
+
+    with op.batch_alter_table('chatconversation', schema=None) as batch_op:
+        batch_op.drop_index('ix_chatconversation_user_created')
+
+    with op.batch_alter_table('chatmessage', schema=None) as batch_op:
+        batch_op.drop_index('ix_chatmessage_conversation_timestamp')
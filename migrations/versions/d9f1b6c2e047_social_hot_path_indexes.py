@@ -0,0 +1,44 @@
+"""indexes for follow, like and post hot paths
+
+Revision ID: d9f1b6c2e047
+Revises: c4e8a1b3d925
+Create Date: 2026-10-18 14:00:00.000000
+
+Bổ sung cho c4e8a1b3d925 (chat / comment / feed) và unique (post_id, user_id) của like.
+post_image.post_id không cần index riêng: MySQL đã tự tạo index cho foreign key.
+So sánh plan trước/sau: python -m benchmarks.bench_db_indexes
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9f1b6c2e047'
+down_revision = 'c4e8a1b3d925'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('follow', schema=None) as batch_op:
+        batch_op.create_index('ix_follow_follower_followed', ['follower_id', 'followed_id'])
+        batch_op.create_index('ix_follow_followed_follower', ['followed_id', 'follower_id'])
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.create_index('ix_like_user_post', ['user_id', 'post_id'])
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_user_created', ['user_id', 'created_at'])
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_user_created')
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.drop_index('ix_like_user_post')
+
+    with op.batch_alter_table('follow', schema=None) as batch_op:
+        batch_op.drop_index('ix_follow_followed_follower')
+        batch_op.drop_index('ix_follow_follower_followed')
@@ -0,0 +1,32 @@
+"""chat message client_request_id for idempotent send
+
+Revision ID: e3a7c9d1f258
+Revises: d9f1b6c2e047
+Create Date: 2026-10-18 16:00:00.000000
+
+Tin nhắn cũ để NULL (unique cho phép nhiều NULL).
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7c9d1f258'
+down_revision = 'd9f1b6c2e047'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('chatmessage', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('client_request_id', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint(
+            'uq_chatmessage_client_request', ['user_id', 'client_request_id', 'message_type']
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('chatmessage', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_chatmessage_client_request', type_='unique')
+        batch_op.drop_column('client_request_id')
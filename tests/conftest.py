@@ -0,0 +1,76 @@
+"""
+Test chạy trên SQLite file tạm (không cần MySQL); đặt TEST_DATABASE_URL để chạy trên DB
+khác (vd. MySQL test, các bảng bị tạo / xóa sau mỗi test). Biến môi trường phải đặt trước
+khi import app vì config được đọc lúc import.
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+_TEST_DIR = tempfile.mkdtemp(prefix='skinbox-test-')
+os.environ['DATABASE_URL'] = (
+    os.getenv('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}"
+)
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('MAIL_PORT', '587')
+os.environ['JOB_BACKEND'] = 'inprocess'
+os.environ['MODEL_PRELOAD'] = 'lazy'
+
+from app import app as flask_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import User, Post, PostImage, RoleEnum  # noqa: E402
+from app.dao import dao_authen  # noqa: E402
+
+
+@pytest.fixture
+def app_ctx():
+    """App context với DB trống, xóa hết bảng sau mỗi test"""
+    # Id user được dùng lại giữa các test nên cache user của process phải xóa theo
+    dao_authen._user_cache.clear()
+    with flask_app.app_context():
+        db.create_all()
+        try:
+            yield flask_app
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def make_user(app_ctx):
+    counter = {'n': 0}
+
+    def _make_user():
+        counter['n'] += 1
+        n = counter['n']
+        user = User(
+            email=f"user{n}@example.com", username=f"user{n}", password='x',
+            first_name='Test', last_name=str(n), phone_number=f"0900000{n:03d}",
+            address='HCM', role=RoleEnum.USER
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return _make_user
+
+
+@pytest.fixture
+def make_post(app_ctx):
+    base = datetime(2024, 1, 1)
+    counter = {'n': 0}
+
+    def _make_post(user, images=0):
+        counter['n'] += 1
+        post = Post(
+            user_id=user.user_id, title=f"Post {counter['n']}", content='...',
+            created_at=base + timedelta(minutes=counter['n'])
+        )
+        post.images = [PostImage(image_url=f"https://img/{counter['n']}/{i}.jpg") for i in range(images)]
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    return _make_post
@@ -0,0 +1,56 @@
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+from app.batching import MicroBatcher
+
+
+def test_concurrent_submits_are_batched_in_order():
+    sizes = []
+
+    def process(items):
+        sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=50)
+    results = {}
+
+    def submit(i):
+        results[i] = batcher.submit(i)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: i * 2 for i in range(8)}
+    assert max(sizes) > 1
+
+
+def test_short_result_list_fails_every_future():
+    batcher = MicroBatcher(lambda items: items[:-1], max_wait_ms=50)
+    futures = [batcher.submit_async(i) for i in range(3)]
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=2)
+
+
+def test_submit_times_out_by_default_and_batcher_keeps_working():
+    release = threading.Event()
+
+    def process(items):
+        release.wait(2)
+        return items
+
+    batcher = MicroBatcher(process, max_wait_ms=1, timeout=0.1)
+    started = time.monotonic()
+    with pytest.raises(FutureTimeoutError):
+        batcher.submit('slow')
+    assert time.monotonic() - started < 1
+
+    release.set()
+    assert batcher.submit('next', timeout=2) == 'next'
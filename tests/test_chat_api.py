@@ -0,0 +1,197 @@
+"""
+Luồng send-message / stream với model giả (không cần TensorFlow / LangChain thật):
+kiểm tra transaction và connection DB quanh các bước chậm.
+"""
+import io
+import json
+import time
+
+import pytest
+
+import app.index  # noqa: F401  (đăng ký route + user_loader)
+from app import controllers
+from app.jobs import job_runner, DONE
+from app.extensions import db
+from app.model_registry import model_registry
+from app.models import ChatConversation, ChatMessage
+from app.rag_history import ConversationRAGMixin
+
+
+class FakeRAG(ConversationRAGMixin):
+    def __init__(self, engine):
+        self.engine = engine
+        self.checked_out_during_llm = []
+        self.answered_in_transaction = []
+        self.summarized_in_transaction = []
+
+    def retrieve(self, query):
+        return []
+
+    def _summarize_history(self, previous_summary, messages):
+        self.summarized_in_transaction.append(db.session().in_transaction())
+        return f"{previous_summary or ''} +{len(messages)}"
+
+    def answer(self, query, chat_history, context_docs=None):
+        self.checked_out_during_llm.append(self.engine.pool.checkedout())
+        self.answered_in_transaction.append(db.session().in_transaction())
+        return f"Trả lời: {query}"
+
+    def stream_answer(self, query, chat_history, context_docs=None):
+        self.checked_out_during_llm.append(self.engine.pool.checkedout())
+        yield 'sources', []
+        for token in ("Trả ", "lời"):
+            yield 'token', token
+        yield 'answer', "Trả lời"
+
+
+class FakeCV:
+    def predict(self, image_bytes):
+        return "Chàm", 0.9, "Eczema"
+
+
+@pytest.fixture
+def fake_models(app_ctx):
+    rag = FakeRAG(db.engine)
+    model_registry.register('rag_chatbot', lambda: rag)
+    model_registry.register('cv_model', FakeCV)
+    assert model_registry.wait('rag_chatbot', 5) is rag
+    assert model_registry.wait('cv_model', 5) is not None
+    return rag
+
+
+@pytest.fixture
+def client(app_ctx, make_user, fake_models):
+    user = make_user()
+    test_client = app_ctx.test_client()
+    with test_client.session_transaction() as session:
+        session['_user_id'] = str(user.user_id)
+        session['_fresh'] = True
+    test_client.user_id = user.user_id
+    return test_client
+
+
+def _sse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def test_send_message_creates_conversation_only_when_saving(app_ctx, client, monkeypatch):
+    seen = []
+    engine = db.engine
+
+    def slow_upload(image_bytes):
+        time.sleep(0.1)
+        checked_out = engine.pool.checkedout()
+        with app_ctx.app_context():
+            seen.append((checked_out, ChatConversation.query.count()))
+        return "https://img/chat.jpg"
+
+    monkeypatch.setattr(controllers, '_upload_chat_image', slow_upload)
+    response = client.post('/api/chat/send-message', data={
+        'message': 'Da bị ngứa', 'client_request_id': 'req-1',
+        'image': (io.BytesIO(b'fake-image'), 'a.jpg')
+    }, content_type='multipart/form-data')
+
+    data = response.get_json()
+    assert response.status_code == 200, data
+    # Trong lúc upload: request không giữ connection, conversation chưa được tạo
+    assert seen == [(0, 0)]
+    assert data['conversation_id'] == ChatConversation.query.one().conversation_id
+    assert data['image_url'] == "https://img/chat.jpg"
+    messages = ChatMessage.query.order_by(ChatMessage.message_id).all()
+    assert [(m.message_type, m.client_request_id) for m in messages] == [('user', 'req-1'), ('bot', 'req-1')]
+
+
+def test_send_message_unknown_conversation_is_404(client):
+    response = client.post('/api/chat/send-message', json={'message': 'Chào', 'conversation_id': 999})
+    assert response.status_code == 404
+
+
+def test_stream_reports_conversation_after_commit(client):
+    response = client.post('/api/chat/send-message/stream', json={
+        'message': 'Da bị ngứa', 'client_request_id': 'req-2'
+    })
+    events = _sse_events(response.get_data(as_text=True))
+
+    assert [name for name, _ in events] == ['conversation', 'sources', 'token', 'token', 'done']
+    conversation_id = events[0][1]['conversation_id']
+    assert db.session.get(ChatConversation, conversation_id) is not None
+    assert events[-1][1]['response'] == "Trả lời"
+
+
+def test_history_summary_runs_in_background_job(app_ctx, client, fake_models, monkeypatch):
+    monkeypatch.setitem(app_ctx.config, 'RAG_HISTORY_MAX_MESSAGES', 2)
+    monkeypatch.setitem(app_ctx.config, 'RAG_HISTORY_SUMMARY_BATCH', 4)
+    conversation = ChatConversation(user_id=client.user_id)
+    db.session.add(conversation)
+    db.session.flush()
+    for i in range(6):
+        db.session.add(ChatMessage(
+            conversation_id=conversation.conversation_id, user_id=client.user_id,
+            content=f"Tin {i}", message_type='user' if i % 2 == 0 else 'bot'
+        ))
+    conversation_id = conversation.conversation_id
+    db.session.flush()
+    seeded_ids = [m.message_id for m in ChatMessage.query.order_by(ChatMessage.message_id)]
+    db.session.commit()
+
+    submitted = []
+    submit = job_runner.submit
+
+    def record_submit(kind, payload, owner_id=None):
+        job_id = submit(kind, payload, owner_id)
+        submitted.append((kind, job_id))
+        return job_id
+
+    monkeypatch.setattr(job_runner, 'submit', record_submit)
+    response = client.post('/api/chat/send-message', json={
+        'message': 'Còn ngứa không?', 'conversation_id': conversation_id
+    })
+    assert response.status_code == 200, response.get_json()
+    assert [kind for kind, _ in submitted] == ['summarize_history']
+
+    job = job_runner.wait(submitted[0][1], 5)
+    assert job['status'] == DONE and job['result'] == {'updated': True}
+    # Cả LLM trả lời (request) lẫn LLM tóm tắt (job) đều được gọi sau commit
+    assert fake_models.answered_in_transaction == [False]
+    assert fake_models.summarized_in_transaction == [False]
+
+    db.session.expire_all()
+    conversation = db.session.get(ChatConversation, conversation_id)
+    # Cửa sổ 2 tin mới nhất -> ít nhất Tin 0..4 đã được gộp vào tóm tắt
+    assert conversation.summary in (" +5", " +6")
+    assert conversation.summary_message_id >= seeded_ids[4]
+
+
+def test_get_job_purged_while_waiting_is_404(client, monkeypatch):
+    queued = {'job_id': 'abc', 'owner_id': client.user_id, 'status': 'queued'}
+    monkeypatch.setattr(job_runner, 'get', lambda job_id: queued)
+    # Job bị purge trong lúc long-poll
+    monkeypatch.setattr(job_runner, 'wait', lambda job_id, timeout: None)
+
+    response = client.get('/api/jobs/abc?wait=1')
+    assert response.status_code == 404
+
+
+def test_stream_saves_answer_when_client_disconnects(client):
+    response = client.post('/api/chat/send-message/stream', json={
+        'message': 'Da bị ngứa', 'client_request_id': 'req-3'
+    }, buffered=False)
+    events = iter(response.response)
+    assert next(events).startswith(b"event: conversation")
+    # Client đóng kết nối trước khi LLM trả lời xong
+    response.close()
+
+    messages = ChatMessage.query.order_by(ChatMessage.message_id).all()
+    assert [(m.message_type, m.content) for m in messages] == [('user', 'Da bị ngứa'), ('bot', 'Trả lời')]
+
+    # Gửi lại cùng client_request_id -> nhận câu trả lời đã lưu
+    replay = client.post('/api/chat/send-message/stream', json={
+        'message': 'Da bị ngứa', 'client_request_id': 'req-3'
+    })
+    replayed = _sse_events(replay.get_data(as_text=True))
+    assert [name for name, _ in replayed] == ['conversation', 'done']
+    assert replayed[-1][1]['response'] == "Trả lời"
@@ -0,0 +1,121 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import crawler_content
+from app.crawler_content import HostRateLimiter, ResponseCache, extract_text, fetch_content, make_session
+
+ARTICLE_HTML = """
+<html><head><title>Viêm da cơ địa</title></head>
+<body>
+  <div class="menu">Trang chủ</div>
+  <div class="detail-content">
+    <h2>Viêm da cơ địa là gì?</h2>
+    <p>Bệnh viêm da mạn tính, hay tái phát.</p>
+    <p>Điều trị: dưỡng ẩm, tránh dị nguyên.</p>
+    <p>TÀI LIỆU THAM KHẢO</p>
+    <p>1. Sách giáo khoa da liễu</p>
+  </div>
+  <div class="footer">Liên hệ</div>
+</body></html>
+"""
+ETAG = '"v1"'
+
+
+class ArticleHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get('If-None-Match'), time.monotonic()))
+        if self.path != '/bai-viet':
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+        body = ARTICLE_HTML.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def article_server():
+    ArticleHandler.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ArticleHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_extract_text_keeps_content_and_drops_references():
+    text = extract_text(ARTICLE_HTML)
+    assert text.splitlines() == [
+        'Viêm da cơ địa là gì?',
+        'Bệnh viêm da mạn tính, hay tái phát.',
+        'Điều trị: dưỡng ẩm, tránh dị nguyên.',
+    ]
+
+
+def test_extract_text_without_content_div():
+    assert extract_text("<html><body><p>Không có bài</p></body></html>") == ""
+
+
+def test_fetch_content_uses_cache_on_304(article_server, tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    session = make_session(2)
+    url = f"{article_server}/bai-viet"
+
+    content, from_cache = fetch_content(session, cache, url)
+    assert not from_cache
+    assert content == extract_text(ARTICLE_HTML)
+    assert cache.get(url)['etag'] == ETAG
+
+    # Lần 2 gửi If-None-Match, server trả 304 -> dùng nội dung trong cache
+    content_again, from_cache = fetch_content(session, cache, url)
+    assert from_cache
+    assert content_again == content
+    assert [etag for _, etag, _ in ArticleHandler.requests_seen] == [None, ETAG]
+
+
+def test_fetch_content_error_without_cache(article_server, tmp_path):
+    content, from_cache = fetch_content(make_session(1), ResponseCache(str(tmp_path)), f"{article_server}/khong-co")
+    assert (content, from_cache) == ("", False)
+
+
+def test_crawl_http_spaces_requests_per_host(article_server, tmp_path):
+    links = [(f"Bài {i}", f"{article_server}/bai-viet") for i in range(4)]
+    output = tmp_path / 'out.txt'
+
+    crawler_content.crawl_http(links, str(output), workers=4, cache_dir='', interval=0.1)
+
+    times = sorted(seen_at for _, _, seen_at in ArticleHandler.requests_seen)
+    assert len(times) == 4
+    # 4 luồng song song nhưng cùng host nên các request cách nhau >= interval
+    assert all(b - a >= 0.09 for a, b in zip(times, times[1:]))
+    assert output.read_text(encoding='utf-8').count('Viêm da cơ địa là gì?') == 4
+
+
+def test_host_rate_limiter_is_per_host():
+    limiter = HostRateLimiter(0.2)
+    started = time.monotonic()
+    limiter.wait('http://a.example/1')
+    limiter.wait('http://b.example/1')
+    assert time.monotonic() - started < 0.1
+    limiter.wait('http://a.example/2')
+    assert time.monotonic() - started >= 0.19
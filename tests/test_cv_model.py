@@ -0,0 +1,76 @@
+"""
+SkinDiseaseModel.predict với backend giả (không cần TensorFlow): ảnh được tiền xử lý vào
+buffer riêng của từng thread và buffer được dùng lại giữa các lần predict.
+"""
+import io
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app import cv_model
+
+
+class FakeBackend:
+    def __init__(self):
+        self.inputs = []
+
+    def run(self, batch):
+        self.inputs.append((threading.get_ident(), batch.__array_interface__['data'][0], batch.shape))
+        # Lớp dự đoán = kênh có giá trị trung bình lớn nhất (R -> 0, G -> 1, B -> 2)
+        probs = np.zeros((len(batch), 10), dtype=np.float32)
+        probs[np.arange(len(batch)), batch.mean(axis=(1, 2)).argmax(axis=1)] = 1.0
+        return probs
+
+
+def _jpeg(color):
+    output = io.BytesIO()
+    Image.new('RGB', (300, 200), color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def model(app_ctx, tmp_path, monkeypatch):
+    model_path = tmp_path / 'model.tflite'
+    model_path.write_bytes(b'')
+    backend = FakeBackend()
+    monkeypatch.setattr(cv_model, 'load_backend', lambda name, path: backend)
+    monkeypatch.setitem(app_ctx.config, 'CV_BATCHING_ENABLED', False)
+    return cv_model.SkinDiseaseModel(model_path=str(model_path), backend='tflite')
+
+
+def test_predict_reuses_thread_buffer(model):
+    red, green = _jpeg((255, 0, 0)), _jpeg((0, 255, 0))
+
+    assert model.predict(red)[2] == 'Eczema'
+    assert model.predict(green)[2] == 'Warts Molluscum and other Viral Infections'
+    assert model.predict(red)[2] == 'Eczema'
+
+    addresses = {address for _, address, _ in model.model.inputs}
+    assert len(addresses) == 1
+    assert {shape for _, _, shape in model.model.inputs} == {(1, 224, 224, 3)}
+
+
+def test_threads_get_their_own_buffer(model):
+    images = {'red': _jpeg((255, 0, 0)), 'blue': _jpeg((0, 0, 255))}
+    results = {}
+    start = threading.Barrier(2)
+
+    def worker(name):
+        start.wait()
+        results[name] = [model.predict(images[name])[2] for _ in range(5)]
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in images]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results['red'] == ['Eczema'] * 5
+    assert results['blue'] == ['Melanoma'] * 5
+    buffers = {}
+    for thread_id, address, _ in model.model.inputs:
+        buffers.setdefault(thread_id, set()).add(address)
+    assert len(buffers) == 2 and all(len(addresses) == 1 for addresses in buffers.values())
+    assert len(set.union(*buffers.values())) == 2
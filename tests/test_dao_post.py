@@ -0,0 +1,132 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event, func
+
+from app.dao import dao_post
+from app.extensions import db
+from app.models import Like, Post
+
+
+@contextmanager
+def count_queries():
+    """Đếm số câu SQL chạy trên engine trong khối with"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _render_feed(posts):
+    """Truy cập mọi thứ template feed dùng, lazy load sẽ làm tăng số query"""
+    return [
+        (post.user.username, [image.image_url for image in post.images], post.like_count, post.comment_count)
+        for post in posts
+    ]
+
+
+def test_get_all_posts_query_count_does_not_grow_with_page(make_user, make_post):
+    users = [make_user() for _ in range(3)]
+    for i in range(12):
+        make_post(users[i % 3], images=i % 3)
+    db.session.expire_all()
+
+    with count_queries() as small:
+        posts, _ = dao_post.get_all_posts(limit=2)
+        _render_feed(posts)
+    db.session.expire_all()
+
+    with count_queries() as large:
+        posts, next_cursor = dao_post.get_all_posts(limit=10)
+        _render_feed(posts)
+
+    # post JOIN user + 1 query selectin ảnh, dù trang có 2 hay 10 bài
+    assert len(small) == 2
+    assert len(large) == 2
+    assert len(posts) == 10
+    assert next_cursor is not None
+
+
+def test_get_all_posts_next_page_query_count(make_user, make_post):
+    user = make_user()
+    for _ in range(7):
+        make_post(user, images=1)
+    first_page, cursor = dao_post.get_all_posts(limit=5)
+    db.session.expire_all()
+
+    with count_queries() as statements:
+        posts, next_cursor = dao_post.get_all_posts(limit=5, cursor=cursor)
+        _render_feed(posts)
+
+    assert len(statements) == 2
+    assert len(posts) == 2
+    assert next_cursor is None
+    assert not {p.post_id for p in posts} & {p.post_id for p in first_page}
+
+
+def test_concurrent_like_unlike_keeps_like_count_consistent(app_ctx, make_user, make_post):
+    users = [make_user() for _ in range(4)]
+    post = make_post(users[0])
+    post_id, user_ids = post.post_id, [user.user_id for user in users]
+    # 2 thread cho mỗi user: cùng user like/unlike song song (nhiều tab) lẫn các user khác nhau
+    workers = [user_id for user_id in user_ids for _ in range(2)]
+    start = threading.Barrier(len(workers))
+    errors = []
+
+    def worker(user_id, seed):
+        rng = random.Random(seed)
+        with app_ctx.app_context():
+            start.wait()
+            try:
+                for _ in range(25):
+                    action = rng.choice(('toggle', 'like', 'unlike'))
+                    if action == 'toggle':
+                        dao_post.toggle_like(post_id, user_id)
+                    else:
+                        dao_post.set_like(post_id, user_id, action == 'like')
+            except Exception as e:
+                # Kể cả IntegrityError: set_like phải tự xử lý khi 2 request cùng like
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(user_id, i)) for i, user_id in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    db.session.expire_all()
+    like_rows = db.session.query(func.count(Like.like_id)).filter_by(post_id=post_id).scalar()
+    assert db.session.get(Post, post_id).like_count == like_rows
+    assert dao_post.count_likes(post_id) == like_rows
+    assert like_rows <= len(user_ids)
+
+
+def test_toggle_like_commits_once(make_user, make_post):
+    user = make_user()
+    post_id = make_post(user).post_id
+    commits = []
+
+    def on_commit(conn):
+        commits.append(conn)
+
+    event.listen(db.engine, 'commit', on_commit)
+    try:
+        assert dao_post.toggle_like(post_id, user.user_id) is True
+        assert len(commits) == 1
+        assert dao_post.toggle_like(post_id, user.user_id) is False
+        assert len(commits) == 2
+    finally:
+        event.remove(db.engine, 'commit', on_commit)
+
+    assert dao_post.count_likes(post_id) == 0
+    assert not dao_post.user_liked_post(post_id, user.user_id)
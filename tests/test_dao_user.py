@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+
+from sqlalchemy import update
+
+from app.dao import dao_authen, dao_user
+from app.extensions import db
+from app.models import User
+from app.passwords import password_hasher
+
+
+@contextmanager
+def new_request(app):
+    """Như 1 request thật: app context riêng nên g và db.session đều mới"""
+    with app.app_context(), app.test_request_context():
+        try:
+            yield
+        finally:
+            db.session.remove()
+
+
+def _cache_then_change_elsewhere(app_ctx, user, **changes):
+    """Đưa user vào cache của process rồi đổi dòng trong DB như 1 worker khác"""
+    user_id = user.user_id
+    with new_request(app_ctx):
+        dao_authen.get_info_by_id(user_id)
+
+    with db.engine.begin() as conn:
+        conn.execute(update(User).where(User.user_id == user_id).values(**changes))
+    return user_id
+
+
+def test_change_password_reads_fresh_row_not_cached_snapshot(app_ctx, make_user):
+    user = make_user()
+    user.password = password_hasher.hash('old-password')
+    db.session.commit()
+    user_id = _cache_then_change_elsewhere(app_ctx, user, password=password_hasher.hash('changed-elsewhere'))
+
+    with new_request(app_ctx):
+        stale = dao_authen.get_info_by_id(user_id)
+        assert password_hasher.verify(stale.password, 'old-password')
+
+        ok, _ = dao_user.change_password(user_id, 'changed-elsewhere', 'new-password')
+
+    assert ok
+    db.session.expire_all()
+    assert password_hasher.verify(db.session.get(User, user_id).password, 'new-password')
+
+
+def test_update_user_profile_reads_fresh_row_not_cached_snapshot(app_ctx, make_user):
+    user = make_user()
+    user_id = _cache_then_change_elsewhere(app_ctx, user, email='moved@example.com')
+
+    with new_request(app_ctx):
+        assert dao_authen.get_info_by_id(user_id).email != 'moved@example.com'
+
+        ok, message = dao_user.update_user_profile(
+            user_id, 'New', 'Name', 'moved@example.com', user.phone_number, 'HN'
+        )
+
+    assert ok, message
+    db.session.expire_all()
+    assert db.session.get(User, user_id).first_name == 'New'
+
+
+def test_auth_user_uses_current_password(app_ctx, make_user):
+    user = make_user()
+    user.password = password_hasher.hash('old-password')
+    db.session.commit()
+    user_id = _cache_then_change_elsewhere(app_ctx, user, password=password_hasher.hash('changed-elsewhere'))
+
+    with new_request(app_ctx):
+        dao_authen.get_info_by_id(user_id)
+        assert dao_authen.auth_user(user.username, 'old-password') is None
+        assert dao_authen.auth_user(user.username, 'changed-elsewhere').user_id == user_id
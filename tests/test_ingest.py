@@ -0,0 +1,66 @@
+"""
+app.ingest trên Qdrant in-memory (vector giả, không cần model embedding): khóa source theo
+đường dẫn tương đối, --prune không lẫn 2 file cùng tên và version của collection.
+"""
+import pytest
+
+from app import ingest
+from app.rag_utils import bump_ingest_version, read_ingest_version
+
+pytest.importorskip('langchain_text_splitters')
+qdrant_client = pytest.importorskip('qdrant_client')
+
+DIM = 4
+
+
+def _write_articles(path, *articles):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    blocks = [f"=============================\n{i}. {title}\n=============================\n{body}\n"
+              for i, (title, body) in enumerate(articles, start=1)]
+    path.write_text("".join(blocks), encoding='utf-8')
+
+
+def _ingest(ingestor, paths):
+    """Như Ingestor.run nhưng vector giả, chạy ngay trong process test"""
+    for batch in ingestor._batches(paths):
+        ingestor._ensure_collection(DIM)
+        ingestor._upsert(batch, [[1.0, 0.0, 0.0, 0.0]] * len(batch))
+
+
+def _sources(client):
+    points, _ = client.scroll('benh', limit=100, with_payload=True)
+    return sorted((point.payload['metadata']['source'], point.payload['page_content']) for point in points)
+
+
+def test_source_key_is_relative_posix_path(tmp_path):
+    assert ingest.source_key(tmp_path / 'a' / 'benh.txt', tmp_path) == 'a/benh.txt'
+    assert ingest.source_key(tmp_path / 'benh.txt', tmp_path) == 'benh.txt'
+
+
+def test_prune_keeps_same_named_file_in_other_directory(tmp_path):
+    first, second = tmp_path / 'nguon1' / 'benh.txt', tmp_path / 'nguon2' / 'benh.txt'
+    _write_articles(first, ("Chàm", "Chàm gây ngứa và khô da."))
+    _write_articles(second, ("Vảy nến", "Vảy nến tạo mảng đỏ có vảy trắng."))
+    client = qdrant_client.QdrantClient(':memory:')
+    _ingest(ingest.Ingestor(client, 'benh', root=str(tmp_path)), [str(first), str(second)])
+    assert [source for source, _ in _sources(client)] == ['nguon1/benh.txt', 'nguon2/benh.txt']
+
+    # Sửa bài trong nguon1 rồi nạp lại riêng file đó với --prune
+    _write_articles(first, ("Chàm", "Chàm thể tạng thường gặp ở trẻ nhỏ."))
+    ingestor = ingest.Ingestor(client, 'benh', root=str(tmp_path))
+    _ingest(ingestor, [str(first)])
+    assert ingestor.prune([str(first)]) == 1
+
+    assert _sources(client) == [
+        ('nguon1/benh.txt', "Chàm thể tạng thường gặp ở trẻ nhỏ."),
+        ('nguon2/benh.txt', "Vảy nến tạo mảng đỏ có vảy trắng."),
+    ]
+
+
+def test_bump_ingest_version_changes_version():
+    client = qdrant_client.QdrantClient(':memory:')
+    assert read_ingest_version(client, 'benh') is None
+    first = bump_ingest_version(client, 'benh')
+    assert read_ingest_version(client, 'benh') == first
+    second = bump_ingest_version(client, 'benh')
+    assert second != first and read_ingest_version(client, 'benh') == second
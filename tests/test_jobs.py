@@ -0,0 +1,105 @@
+"""
+Hàng đợi job SQLite (nhận job, lease khi process chết / khởi động lại) và vòng đời
+kết quả job (consume / discard / purge + cleanup).
+"""
+import os
+import time
+
+import pytest
+
+from app.jobs import SQLiteJobBackend, JobRunner, QUEUED, RUNNING, DONE, FAILED
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'jobs.sqlite')
+
+
+def _set_job(backend, job_id, **values):
+    columns = ", ".join(f"{name} = ?" for name in values)
+    backend._conn().execute(f"UPDATE job SET {columns} WHERE job_id = ?", (*values.values(), job_id))
+
+
+def test_claim_takes_oldest_job_once(db_path):
+    backend = SQLiteJobBackend(db_path, poll_interval=0.01)
+    other_process = SQLiteJobBackend(db_path, poll_interval=0.01)
+    backend.enqueue('a', 'echo', {'text': 'A', 'image': b'\x00\x01'}, owner_id=1)
+    backend.enqueue('b', 'echo', {'text': 'B'}, owner_id=1)
+
+    assert backend.dequeue(timeout=0) == ('a', 'echo', {'text': 'A', 'image': b'\x00\x01'})
+    assert other_process.dequeue(timeout=0) == ('b', 'echo', {'text': 'B'})
+    assert backend.dequeue(timeout=0) is None
+
+    assert backend.get('a')['status'] == RUNNING
+    owner_pid, heartbeat_at = backend._conn().execute(
+        "SELECT owner_pid, heartbeat_at FROM job WHERE job_id = 'a'"
+    ).fetchone()
+    assert owner_pid == os.getpid() and heartbeat_at is not None
+
+
+def test_restart_keeps_live_lease_and_requeues_expired(db_path):
+    backend = SQLiteJobBackend(db_path, lease_timeout=30)
+    backend.enqueue('live', 'echo', {}, owner_id=None)
+    backend.enqueue('dead', 'echo', {}, owner_id=None)
+    assert backend.dequeue(timeout=0)[0] == 'live'
+    assert backend.dequeue(timeout=0)[0] == 'dead'
+    # Process chạy job 'dead' đã dừng gia hạn lease từ lâu
+    _set_job(backend, 'dead', owner_pid=999999, heartbeat_at=time.time() - 60)
+
+    # Process khác khởi động: không đụng job còn lease, chỉ chạy lại job hết lease
+    restarted = SQLiteJobBackend(db_path, lease_timeout=30)
+    assert restarted.get('live')['status'] == RUNNING
+    assert restarted.dequeue(timeout=0)[0] == 'dead'
+    assert restarted.dequeue(timeout=0) is None
+
+
+def test_renew_extends_lease_and_finish_requires_it(db_path):
+    backend = SQLiteJobBackend(db_path, lease_timeout=30)
+    backend.enqueue('a', 'echo', {}, owner_id=None)
+    backend.dequeue(timeout=0)
+    _set_job(backend, 'a', heartbeat_at=time.time() - 60)
+    backend.renew()
+    assert SQLiteJobBackend(db_path, lease_timeout=30).dequeue(timeout=0) is None
+
+    # Lease mất (job đã được đưa lại hàng đợi) -> kết quả lần chạy cũ không được ghi
+    _set_job(backend, 'a', status=QUEUED, owner_pid=None)
+    backend.finish('a', DONE, result={'ok': True})
+    assert backend.get('a')['status'] == QUEUED
+
+
+@pytest.fixture
+def runner(db_path):
+    cleaned = []
+    runner = JobRunner(SQLiteJobBackend(db_path, poll_interval=0.01), workers=1, result_ttl=3600)
+    runner.register('echo', lambda text: {'text': text}, cleanup=cleaned.append)
+    runner.register('boom', lambda: 1 / 0, cleanup=cleaned.append)
+    runner.cleaned = cleaned
+    return runner
+
+
+def test_purge_cleans_discarded_and_expired_but_not_consumed(runner):
+    kept = runner.submit('echo', {'text': 'kept'})
+    dropped = runner.submit('echo', {'text': 'dropped'})
+    failed = runner.submit('boom', {})
+    for job_id in (kept, dropped, failed):
+        runner.wait(job_id, 5)
+    assert runner.get(kept)['result'] == {'text': 'kept'}
+    assert runner.get(failed)['status'] == FAILED
+
+    runner.consume(kept)
+    runner.discard(dropped)
+    runner.purge()
+    # Bị discard thì purge ngay, job khác chưa hết result_ttl thì giữ lại
+    assert runner.cleaned == [{'text': 'dropped'}]
+    assert runner.get(dropped) is None
+    assert runner.get(kept) is not None
+
+    runner.result_ttl = -1
+    runner.purge()
+    # Job đã consume / lỗi thì chỉ xóa, không cleanup
+    assert runner.cleaned == [{'text': 'dropped'}]
+    assert runner.get(kept) is None and runner.get(failed) is None
+
+
+def test_wait_returns_none_for_purged_job(runner):
+    assert runner.wait('missing', 0.1) is None
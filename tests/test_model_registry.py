@@ -0,0 +1,64 @@
+"""
+Model registry: load nền, lỗi thì thử lại sau retry_seconds, và load lại ở process con
+khi fork lúc model đang load (gunicorn --preload).
+"""
+import os
+import time
+
+import pytest
+
+from app.model_registry import ModelRegistry, READY, ERROR, PENDING
+
+
+def _slow_factory(seconds, value='model'):
+    def factory():
+        time.sleep(seconds)
+        return value
+    return factory
+
+
+def test_get_loads_in_background():
+    registry = ModelRegistry()
+    registry.register('m', _slow_factory(0.1))
+    assert registry.state('m') == PENDING
+    assert registry.get('m') is None
+    assert registry.wait('m', 5) == 'model'
+    assert registry.is_ready()
+
+
+def test_error_is_retried_after_retry_seconds():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("chưa tải được")
+        return 'model'
+
+    registry = ModelRegistry(retry_seconds=60)
+    registry.register('m', flaky)
+    assert registry.wait('m', 5) is None
+    assert registry.state('m') == ERROR
+    assert registry.status()['m']['error'] == "chưa tải được"
+    # Chưa hết retry_seconds thì get không load lại
+    assert registry.get('m') is None and len(calls) == 1
+
+    registry._failed_at['m'] -= 61
+    assert registry.wait('m', 5) == 'model'
+    assert registry.state('m') == READY
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="cần os.fork")
+def test_child_process_reloads_model_loading_at_fork():
+    registry = ModelRegistry()
+    registry.register('m', _slow_factory(0.3))
+    registry.start_background()
+
+    pid = os.fork()
+    if pid == 0:
+        # Process con: thread load của process cha không còn, phải tự load lại
+        ok = registry.wait('m', 5) == 'model' and registry.is_ready()
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert registry.wait('m', 5) == 'model'
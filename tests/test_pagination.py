@@ -0,0 +1,82 @@
+"""
+Cursor phân trang keyset: mã hóa / giải mã, biên trang (giá trị trùng, trang cuối vừa đủ),
+dòng có cột sắp xếp NULL và danh sách hội thoại khi hội thoại được cập nhật giữa chừng.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.dao import dao_chat
+from app.dao.pagination import encode_cursor, decode_cursor, keyset_page
+from app.extensions import db
+from app.models import ChatConversation, Post
+
+
+def test_cursor_round_trip():
+    value = datetime(2024, 5, 1, 8, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(value, 42)) == (value, 42)
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+    assert '=' not in encode_cursor(value, 42)
+
+
+@pytest.mark.parametrize('cursor', ['', 'abc', encode_cursor(None, 1)[:-2] + '!!'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def _page_all(query, column, id_column, limit, descending=True):
+    ids, cursor, pages = [], None, 0
+    while True:
+        items, cursor = keyset_page(query, column, id_column, limit, cursor, descending)
+        ids.extend(getattr(item, id_column.key) for item in items)
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_pages_cover_ties_and_nulls_exactly_once(app_ctx, make_user, make_post, descending):
+    user = make_user()
+    posts = [make_post(user) for _ in range(7)]
+    # 3 bài cùng created_at (trùng giá trị ở biên trang) và 2 bài created_at NULL
+    same_time = datetime(2024, 3, 1)
+    for post in posts[1:4]:
+        post.created_at = same_time
+    db.session.commit()
+    Post.query.filter(Post.post_id.in_([posts[4].post_id, posts[6].post_id])).update(
+        {'created_at': None}, synchronize_session=False
+    )
+    db.session.commit()
+
+    expected = [post.post_id for post in Post.query.order_by(
+        Post.created_at.desc() if descending else Post.created_at.asc(),
+        Post.post_id.desc() if descending else Post.post_id.asc()
+    )]
+    for limit in (1, 2, 3, 7):
+        ids, pages = _page_all(Post.query, Post.created_at, Post.post_id, limit, descending)
+        assert ids == expected
+        # Trang cuối vừa đủ limit thì không trả cursor thừa dẫn tới 1 trang rỗng
+        assert pages == -(-len(expected) // limit)
+
+
+def test_conversations_stable_when_updated_while_paging(app_ctx, make_user):
+    user = make_user()
+    base = datetime(2024, 1, 1)
+    conversations = [
+        ChatConversation(user_id=user.user_id, created_at=base + timedelta(minutes=i), updated_at=base)
+        for i in range(5)
+    ]
+    db.session.add_all(conversations)
+    db.session.commit()
+
+    first, cursor = dao_chat.get_conversations(user.user_id, limit=2)
+    # Hội thoại cũ nhất có tin nhắn mới trong lúc client đang xem trang 1
+    conversations[0].updated_at = base + timedelta(days=1)
+    db.session.commit()
+    second, cursor = dao_chat.get_conversations(user.user_id, limit=2, cursor=cursor)
+    third, cursor = dao_chat.get_conversations(user.user_id, limit=2, cursor=cursor)
+
+    seen = [conv.conversation_id for conv in first + second + third]
+    assert seen == [conv.conversation_id for conv in reversed(conversations)]
+    assert cursor is None
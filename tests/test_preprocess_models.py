@@ -0,0 +1,156 @@
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import preprocess_models
+from app.preprocess_models import RateLimitError, TokenBucket, call_openrouter, make_session
+
+DISEASES = ["Mụn trứng cá", "Vảy nến", "Chàm", "Nấm da"]
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    Server giả /chat/completions: lần đầu mỗi bệnh trả 429 (kèm Retry-After nếu có),
+    lần sau trả 200; bệnh trong `broken` luôn trả 400
+    """
+    calls = []
+    broken = set()
+    retry_after = "0.2"
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][0]['content']
+        name = next(name for name in DISEASES + ['Khác'] if name in prompt)
+        with self.lock:
+            attempt = sum(1 for called, _ in self.calls if called == name)
+            self.calls.append((name, time.monotonic()))
+
+        if name in self.broken:
+            self._reply(400, {'error': 'bad request'})
+        elif attempt == 0:
+            self._reply(429, {'error': 'rate limited'}, self.retry_after)
+        else:
+            self._reply(200, {'choices': [{'message': {'content': f" Bài viết về {name} "}}]})
+
+    def _reply(self, status, payload, retry_after=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if retry_after:
+            self.send_header('Retry-After', retry_after)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def llm_server():
+    StubLLMHandler.calls = []
+    StubLLMHandler.broken = set()
+    StubLLMHandler.retry_after = "0.2"
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubLLMHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/v1"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _calls_for(name):
+    return [called_at for called, called_at in StubLLMHandler.calls if called == name]
+
+
+def _run_main(monkeypatch, base_url, input_csv, output_dir, rate):
+    monkeypatch.setattr(sys, 'argv', [
+        'preprocess_models.py', '--input-csv', str(input_csv), '--output-dir', str(output_dir),
+        '--base-url', base_url, '--concurrency', '4', '--rate', str(rate), '--max-retries', '2'
+    ])
+    preprocess_models.main()
+
+
+def test_main_retries_429_with_retry_after_and_resumes_from_checkpoint(llm_server, tmp_path, monkeypatch):
+    input_csv = tmp_path / 'diseases.csv'
+    input_csv.write_text("title\n" + "\n".join(DISEASES + [DISEASES[0]]) + "\n", encoding='utf-8')
+    output_dir = tmp_path / 'out'
+    StubLLMHandler.broken = {"Nấm da"}
+
+    started = time.monotonic()
+    _run_main(monkeypatch, llm_server, input_csv, output_dir, rate=10)
+    elapsed = time.monotonic() - started
+
+    merged = (output_dir / preprocess_models.MERGED_FILENAME).read_text(encoding='utf-8')
+    checkpoint = (output_dir / preprocess_models.CHECKPOINT_FILENAME).read_text(encoding='utf-8')
+    assert sorted(checkpoint.splitlines()) == sorted(["Mụn trứng cá", "Vảy nến", "Chàm"])
+    for name in ("Mụn trứng cá", "Vảy nến", "Chàm"):
+        assert f"Tên bệnh: {name}\nBài viết về {name}\n" in merged
+        # 429 rồi thử lại sau đúng Retry-After, không phải backoff mặc định (1s+)
+        first, retry = _calls_for(name)
+        assert 0.2 <= retry - first < 1.0
+    # Lỗi 400 không retry
+    assert len(_calls_for("Nấm da")) == 1
+    assert elapsed < 5
+
+
+    # Chạy lại: chỉ bệnh lỗi được gọi, bài cũ không bị ghi lặp
+    StubLLMHandler.calls = []
+    StubLLMHandler.broken = set()
+    _run_main(monkeypatch, llm_server, input_csv, output_dir, rate=10)
+
+    assert {name for name, _ in StubLLMHandler.calls} == {"Nấm da"}
+    merged = (output_dir / preprocess_models.MERGED_FILENAME).read_text(encoding='utf-8')
+    assert merged.count("Tên bệnh: ") == 4
+    assert len((output_dir / preprocess_models.CHECKPOINT_FILENAME).read_text(encoding='utf-8').splitlines()) == 4
+
+
+def test_generate_all_is_limited_by_token_bucket_including_retries(llm_server, tmp_path):
+    StubLLMHandler.retry_after = "0"
+    finished, failed = preprocess_models.generate_all(
+        DISEASES, str(tmp_path / 'out.txt'), str(tmp_path / 'done.txt'),
+        concurrency=4, rate=4, base_url=llm_server, api_key='test'
+    )
+    assert (finished, failed) == (4, [])
+
+    # 4 bệnh x (429 + 200) = 8 request; capacity 4 đi ngay, sau đó 4 request/giây
+    times = sorted(called_at for _, called_at in StubLLMHandler.calls)
+    assert len(times) == 8
+    for i in range(4, 8):
+        assert times[i] - times[0] >= (i - 3) / 4 - 0.05
+
+
+def test_call_openrouter_backs_off_without_retry_after(llm_server):
+    StubLLMHandler.retry_after = None
+    started = time.monotonic()
+    content = call_openrouter(make_session(1), "Khác", TokenBucket(100), base_url=llm_server,
+                              api_key='test', backoff=0.1)
+    assert content == "Bài viết về Khác"
+    first, retry = _calls_for("Khác")
+    # backoff * 2**0 + jitter trong [0, backoff]
+    assert 0.1 <= retry - first < 0.5
+    assert time.monotonic() - started < 1
+
+
+def test_call_openrouter_raises_rate_limit_after_max_retries(llm_server):
+    StubLLMHandler.retry_after = "0"
+    with pytest.raises(RateLimitError):
+        call_openrouter(make_session(1), "Khác", TokenBucket(100), base_url=llm_server,
+                        api_key='test', max_retries=0)
+    assert len(_calls_for("Khác")) == 1
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # 2 token có sẵn, 4 token còn lại phải chờ nạp ở 20 token/s
+    assert time.monotonic() - started >= 4 / 20 * 0.9
@@ -0,0 +1,87 @@
+"""
+Semantic cache câu trả lời RAG: ngưỡng similarity, TTL, LRU và xóa cache khi version
+của collection đổi.
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import rag_cache
+from app.rag_cache import SemanticCache, InMemoryCacheBackend
+from app.rag_utils import INGEST_VERSION_POINT_ID, read_ingest_version, version_collection_name
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {'t': 1000.0}
+    monkeypatch.setattr(rag_cache, 'time', SimpleNamespace(time=lambda: now['t']))
+    return now
+
+
+def test_lookup_hits_above_threshold_and_misses_below():
+    cache = SemanticCache(threshold=0.95)
+    cache.store([1.0, 0.0], "Trả lời A")
+
+    assert cache.lookup([10.0, 0.2]) == "Trả lời A"  # cos ~ 0.9998, không phụ thuộc độ dài vector
+    assert cache.lookup([1.0, 1.0]) is None  # cos ~ 0.707
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1}
+
+
+def test_expired_entries_are_dropped(clock):
+    cache = SemanticCache(ttl=60)
+    cache.store([1.0, 0.0], "Trả lời A")
+
+    clock['t'] += 59
+    assert cache.lookup([1.0, 0.0]) == "Trả lời A"
+    clock['t'] += 2
+    assert cache.lookup([1.0, 0.0]) is None
+    assert len(cache.backend) == 0
+
+
+def test_lru_evicts_least_recently_used():
+    cache = SemanticCache(backend=InMemoryCacheBackend(max_entries=2))
+    cache.store([1.0, 0.0, 0.0], "A")
+    cache.store([0.0, 1.0, 0.0], "B")
+    assert cache.lookup([1.0, 0.0, 0.0]) == "A"  # A vừa được dùng -> B cũ nhất
+
+    cache.store([0.0, 0.0, 1.0], "C")
+    assert cache.lookup([0.0, 1.0, 0.0]) is None
+    assert cache.lookup([1.0, 0.0, 0.0]) == "A"
+    assert cache.lookup([0.0, 0.0, 1.0]) == "C"
+
+
+def test_version_change_invalidates():
+    cache = SemanticCache()
+    cache.sync_version(None)  # collection chưa có version
+    cache.store([1.0, 0.0], "A")
+
+    cache.sync_version(None)
+    assert cache.lookup([1.0, 0.0]) == "A"
+    cache.sync_version("v1")  # lần nạp đầu bằng app.ingest
+    assert cache.lookup([1.0, 0.0]) is None
+
+    cache.store([1.0, 0.0], "B")
+    cache.sync_version("v1")
+    assert cache.lookup([1.0, 0.0]) == "B"
+    cache.sync_version("v2")
+    assert len(cache.backend) == 0
+
+
+class FakeQdrant:
+    def __init__(self, points):
+        self.points = points
+
+    def collection_exists(self, name):
+        return name in self.points
+
+    def retrieve(self, name, ids, with_payload, with_vectors):
+        return [SimpleNamespace(id=i, payload=self.points[name][i]) for i in ids if i in self.points[name]]
+
+
+def test_read_ingest_version():
+    name = version_collection_name('benh_da_lieu')
+    assert read_ingest_version(FakeQdrant({}), 'benh_da_lieu') is None
+    assert read_ingest_version(FakeQdrant({name: {}}), 'benh_da_lieu') is None
+    client = FakeQdrant({name: {INGEST_VERSION_POINT_ID: {'version': 'abc'}}})
+    assert read_ingest_version(client, 'benh_da_lieu') == 'abc'